@@ -55,6 +55,22 @@ def allowed_orgunits_qs(user, request=None):
 
     return OrgUnit.objects.filter(id__in=list(ids))
 
+def access_scope_key(user, request=None):
+    """
+    Short key for the data scope of `user`, for caches shared between users:
+    "all" for enterprise planners, otherwise the effective (acting-as) user.
+    """
+    if not getattr(user, "is_authenticated", False):
+        return "anon"
+    if is_enterprise_planner(user):
+        return "all"
+    delegator = get_effective_delegator(request) if request else None
+    if delegator:
+        delegation = can_act_as(user, delegator)
+        if delegation and delegation.is_active():
+            return f"u{delegator.pk}"
+    return f"u{user.pk}"
+
 def can_edit_ou(user, ou, request=None):
     if is_enterprise_planner(user):
         return True
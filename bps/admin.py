@@ -5,6 +5,8 @@ from django import forms
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.db.models import Count
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
 from .models.admin_proxy import PlanningAdminDashboard
 from django.template.response import TemplateResponse
 
@@ -13,7 +15,8 @@ from .models.models import (
     PlanningFunction, ReferenceData, KeyFigure, DataRequest, DataRequestLog, PlanningFact,
     PlanningSession, PlanningStage, Period, PeriodGrouping, RateCard, Position, Resource, Skill
 )
-from .models.models_extras import DimensionKey, PlanningFactExtra
+from .models.models_extras import DimensionKey, PlanningFactExtra, refresh_dimension_signatures
+from .models.models_jobs import Job
 
 from .models.models_layout import (
     PlanningLayout, PlanningLayoutYear, PlanningLayoutDimension, LayoutDimensionOverride, PlanningKeyFigure
@@ -25,7 +28,8 @@ from .models.models_dimension import (
 
 from .models.models_resource import Skill, Resource
 from .models.models_workflow import (
-    PlanningScenario, ScenarioStep, ScenarioStage, ScenarioFunction, ScenarioOrgUnit
+    PlanningScenario, ScenarioStep, ScenarioStage, ScenarioFunction, ScenarioOrgUnit,
+    ScenarioPipelineRun,
 )
 
 from .admin_access import OrgUnitAccessAdmin, DelegationAdmin
@@ -87,9 +91,9 @@ class SubFormulaAdmin(admin.ModelAdmin):
 
 @admin.register(Formula)
 class FormulaAdmin(admin.ModelAdmin):
-    list_display   = ('name', 'layout')
+    list_display   = ('name', 'layout', 'loop_mode')
     search_fields  = ('name', 'layout__code')
-    list_filter    = ('layout',)
+    list_filter    = ('layout', 'loop_mode')
 
 
 # ── Formula Runs & Entries ────────────────────────────────────────────────
@@ -105,12 +109,32 @@ class FormulaRunEntryInline(admin.TabularInline):
 
 @admin.register(FormulaRun)
 class FormulaRunAdmin(admin.ModelAdmin):
-    list_display    = ('id', 'formula', 'run_at', 'preview')
-    list_filter     = ('formula', 'preview')
-    readonly_fields = ('formula', 'run_at', 'preview')
+    list_display    = ('id', 'formula', 'run_at', 'run_by', 'wall_seconds', 'combinations',
+                       'query_count', 'query_seconds', 'rows_read', 'rows_written')
+    list_filter     = ('formula', 'profiled', 'preview')
+    readonly_fields = ('formula', 'run_at', 'run_by', 'preview', 'profiled', 'wall_seconds',
+                       'combinations', 'query_count', 'query_seconds', 'rows_read',
+                       'rows_written', 'slowest', 'profile_report')
+    exclude         = ('slow_expressions',)
     inlines         = [FormulaRunEntryInline]
     ordering        = ('-run_at',)
 
+    def slowest(self, obj):
+        if not obj.slow_expressions:
+            return "—"
+        return format_html_join(
+            mark_safe("<br>"), "{} s · {} calls · <code>{}</code>",
+            ((e["seconds"], e["calls"], e["expr"]) for e in obj.slow_expressions),
+        )
+    slowest.short_description = "Slowest sub-expressions"
+
+    def profile_report(self, obj):
+        if not obj.profile_data:
+            return "—"
+        from .views.formula_profile import profile_report
+        return format_html("<pre>{}</pre>", profile_report(obj.profile_data))
+    profile_report.short_description = "cProfile (top 25, cumulative)"
+
 
 # ── PlanningFunction & ReferenceData ──────────────────────────────────────
 
@@ -153,11 +177,33 @@ class ScenarioStepAdmin(admin.ModelAdmin):
 
 @admin.register(ScenarioFunction)
 class ScenarioFunctionAdmin(admin.ModelAdmin):
-    list_display   = ('scenario', 'function', 'order')
-    list_filter    = ('scenario', 'function')
+    list_display   = ('scenario', 'function', 'stage', 'order')
+    list_filter    = ('scenario', 'function', 'stage')
     ordering       = ('scenario', 'order')
 
 
+@admin.register(ScenarioPipelineRun)
+class ScenarioPipelineRunAdmin(admin.ModelAdmin):
+    list_display    = ('id', 'scenario', 'status', 'started_at', 'started_by', 'seconds',
+                       'steps_ok', 'steps_failed', 'steps_skipped', 'workers')
+    list_filter     = ('status', 'scenario')
+    readonly_fields = ('scenario', 'started_by', 'started_at', 'finished_at', 'status', 'workers',
+                       'retries', 'seconds', 'steps_ok', 'steps_failed', 'steps_skipped', 'step_table')
+    exclude         = ('steps',)
+    ordering        = ('-started_at',)
+
+    def step_table(self, obj):
+        if not obj.steps:
+            return "—"
+        return format_html_join(
+            mark_safe("<br>"), "{}. {} @ {} · {} · {} attempt(s) · {} s",
+            ((st["order"], st["function"], st["org_unit"],
+              "skipped" if st.get("skipped") else (st.get("error") or f"result {st.get('result')}"),
+              st.get("attempts", 0), st.get("seconds", "—")) for st in obj.steps),
+        )
+    step_table.short_description = "Steps"
+
+
 @admin.register(ScenarioOrgUnit)
 class ScenarioOrgUnitAdmin(admin.ModelAdmin):
     list_display   = ('scenario', 'org_unit', 'order')
@@ -165,6 +211,25 @@ class ScenarioOrgUnitAdmin(admin.ModelAdmin):
     ordering       = ('scenario', 'order')
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display    = ('id', 'kind', 'status', 'progress', 'message', 'created_by', 'created_at',
+                       'started_at', 'finished_at', 'worker', 'attempts')
+    list_filter     = ('status', 'kind')
+    readonly_fields = ('kind', 'params', 'status', 'progress', 'message', 'result', 'error',
+                       'cancel_requested', 'attempts', 'worker', 'created_by', 'created_at',
+                       'started_at', 'finished_at', 'heartbeat_at')
+    exclude         = ('max_attempts',)
+    ordering        = ('-created_at',)
+    actions         = ['cancel_jobs']
+
+    @admin.action(description="Cancel selected jobs")
+    def cancel_jobs(self, request, queryset):
+        from .utils.job_queue import cancel
+        jobs = [cancel(job) for job in queryset if not job.is_finished]
+        self.message_user(request, f"{len(jobs)} job(s) cancelled or asked to stop.")
+
+
 # ── InfoObject‐derived Dimensions ───────────────────────────────────────────
 
 class InfoObjectAdmin(admin.ModelAdmin):
@@ -471,4 +536,19 @@ class DimensionKeyAdmin(admin.ModelAdmin):
 class PlanningFactExtraAdmin(admin.ModelAdmin):
     list_display = ('fact', 'key', 'content_type', 'object_id', 'value_obj')
     list_filter = ('key', 'content_type')
-    search_fields = ('fact__id', 'key__key')    
\ No newline at end of file
+    search_fields = ('fact__id', 'key__key')
+
+    # keep the owning fact's cell signature in step with hand edits
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.fact.refresh_signature()
+
+    def delete_model(self, request, obj):
+        fact = obj.fact
+        super().delete_model(request, obj)
+        fact.refresh_signature()
+
+    def delete_queryset(self, request, queryset):
+        fact_ids = list(queryset.values_list('fact_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        refresh_dimension_signatures(fact_ids)
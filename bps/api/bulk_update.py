@@ -0,0 +1,414 @@
+# bps/api/bulk_update.py
+"""
+Set-based engine behind PlanningGridBulkUpdateView.
+
+The whole payload is resolved up front (against the dimension registry), applied to
+an in-memory image of the touched cells, and flushed with a handful of bulk
+statements under one DataRequest per session.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, List
+
+from bps.models.models import PlanningFact, Period, KeyFigure, DataRequest
+from bps.models.models_dimension import OrgUnit, Service
+from bps.models.models_workflow import PlanningSession, PlanningScenario, ScenarioStep
+from bps.models.models_extras import PlanningFactExtra, DimensionKey, dimension_signature
+
+from bps.utils.dimension_registry import dimension_index
+from bps.views.formula_graph import auto_recalculate
+
+from .cache import invalidate_layout_year
+from .utils import normalize_period_code, parse_pk_or_code
+
+# PlanningFact columns covered by the uniq_fact_cell constraint
+CELL_FIELDS = [
+    "session", "period", "key_figure", "org_unit", "service", "account", "dim_signature",
+    "year", "version",
+]
+
+TRUTHY = {"1", "true", "yes"}
+
+
+class _Lookup:
+    """pk/code resolution for one dimension model, served by the dimension registry."""
+
+    def __init__(self, model, *, case_insensitive=False):
+        self.index = dimension_index(model)
+        self.ci = case_insensitive
+
+    def get(self, raw):
+        """Return the pk for `raw` (pk first, then code) or None."""
+        return self.index.resolve(raw, case_insensitive=self.ci)
+
+
+class GridBulkUpdate:
+    """
+    Apply a batch of grid edits to one layout-year.
+
+    Rows flagged ``delete_row`` are applied first, then upserts; blank or zero
+    values delete the cell when ``delete_blanks``/``delete_zeros`` are set.
+    Per-row failures are collected in ``errors`` with the same messages the
+    row-by-row implementation produced.
+    """
+
+    BATCH_SIZE = 2000
+
+    def __init__(self, ly, *, user=None, headers=None, delete_zeros=True, delete_blanks=True):
+        self.ly = ly
+        self.user = user
+        self.headers: Dict[str, Any] = headers or {}
+        self.delete_zeros = delete_zeros
+        self.delete_blanks = delete_blanks
+
+        self.json_dim_keys = [
+            ld.content_type.model
+            for ld in ly.layout.dimensions.select_related("content_type")
+            if ld.content_type.model not in ("orgunit", "service")
+        ]
+
+        self.errors: List[Dict[str, Any]] = []
+        self.updated = 0
+        self.changed: set[tuple] = set()   # (session, period, key figure) written
+        self.recalculated = 0
+        self.recalc_errors: List[str] = []
+
+        # in-memory image of the touched cells
+        self._by_cell: Dict[tuple, int] = {}              # cell key -> id
+        self._by_row: Dict[tuple, list] = defaultdict(list)   # (org, sig) -> [cell keys]
+        self._new: Dict[tuple, dict] = {}                 # cell key -> pending insert
+        self._dead: set[int] = set()
+        self._dirty: Dict[int, Decimal] = {}
+        self._cancelled = 0   # rows inserted and deleted again within the batch
+
+    # ---- parsing ----------------------------------------------------------
+    def _raw_row(self, upd):
+        h = self.headers
+        org = upd.get("org_unit") or h.get("orgunit") or h.get("org_unit")
+        svc = upd.get("service")
+        if svc is None:
+            svc = h.get("service")
+
+        extras: Dict[str, Any] = {}
+        for k, v in (upd.get("extra_dimensions_json") or {}).items():
+            if v is not None:
+                extras[k] = v
+        for key in self.json_dim_keys:
+            if key in extras:
+                continue
+            val = upd.get(key)
+            if val is None:
+                val = h.get(key)
+            if val is not None:
+                extras[key] = val
+
+        return {
+            "upd": upd,
+            "delete_row": str(upd.get("delete_row")).lower() in TRUTHY,
+            "org": org,
+            "svc": svc,
+            "extras": extras,
+            "period": upd.get("period"),
+            "kf": upd.get("key_figure"),
+            "value": upd.get("value", None),
+        }
+
+    # ---- resolution (dimension registry) ------------------------------------
+    def _load_lookups(self, rows):
+        self.orgs = _Lookup(OrgUnit)
+        self.services = _Lookup(Service)
+        self.kfs = _Lookup(KeyFigure, case_insensitive=True)
+        kf_ids = {self.kfs.get(r["kf"]) for r in rows if r["kf"]} - {None}
+        self.kf_uom = dict(
+            KeyFigure.objects.filter(pk__in=kf_ids).values_list("pk", "default_uom_id")
+        ) if kf_ids else {}
+        self.periods = dimension_index(Period).by_code
+
+        wanted = {k.lower() for r in rows for k in r["extras"]}
+        self.dim_keys = {
+            dk.key.lower(): dk
+            for dk in DimensionKey.objects.select_related("content_type")
+            if dk.key.lower() in wanted
+        }
+        self.extra_lookups = {
+            k: _Lookup(dk.content_type.model_class()) for k, dk in self.dim_keys.items()
+        }
+
+    def _bind(self, r):
+        """Resolve one parsed row to ids, raising ValueError like the old per-row path."""
+        if not r["org"]:
+            raise ValueError("Missing 'org_unit' (row or headers)")
+        org_id = self.orgs.get(r["org"])
+        if org_id is None:
+            raise ValueError(f"OrgUnit not found for value '{r['org']}'")
+
+        svc_flag, svc_id = None, None
+        kind, _ = parse_pk_or_code(r["svc"])
+        if kind == "NULL":
+            svc_flag = "NULL"
+        elif kind is not None:
+            svc_id = self.services.get(r["svc"])
+            if svc_id is None:
+                raise ValueError(f"Service not found for value '{r['svc']}'")
+            svc_flag = "VAL"
+
+        pairs = []
+        for key, val in r["extras"].items():
+            dk = self.dim_keys.get(key.lower())
+            if dk is None:
+                raise ValueError(f"Unknown dimension key: {key}")
+            oid = self.extra_lookups[key.lower()].get(val)
+            if oid is not None:
+                pairs.append((dk, oid))
+        signature = dimension_signature((dk.id, oid) for dk, oid in pairs)
+
+        per_code = normalize_period_code(r["period"])
+        per_id = None
+        if per_code:
+            per_id = self.periods.get(per_code)
+            if per_id is None:
+                raise ValueError("No Period matches the given query.")
+
+        return org_id, svc_flag, svc_id, pairs, signature, per_id
+
+    def _kf_id(self, raw, *, required):
+        if not raw:
+            if required:
+                raise ValueError("Missing 'key_figure' code")
+            return None
+        kf_id = self.kfs.get(raw)
+        if kf_id is None:
+            raise ValueError(f"KeyFigure not found for value '{raw}'")
+        return kf_id
+
+    def _load_sessions(self, org_ids):
+        self.sessions: Dict[int, int] = {}
+        for sid, oid in (
+            PlanningSession.objects
+            .filter(scenario__layout_year=self.ly, org_unit_id__in=org_ids)
+            .order_by("id").values_list("id", "org_unit_id")
+        ):
+            self.sessions.setdefault(oid, sid)
+        self._scenario = self._first_step = None
+
+    def _session_for(self, org_id):
+        sid = self.sessions.get(org_id)
+        if sid:
+            return sid
+        if self._scenario is None:
+            self._scenario = (
+                PlanningScenario.objects.filter(layout_year=self.ly, is_active=True)
+                .order_by("id").first()
+            )
+            if not self._scenario:
+                raise ValueError("No active scenario for this layout/year/version.")
+            self._first_step = (
+                ScenarioStep.objects.filter(scenario=self._scenario).order_by("order").first()
+            )
+        if not self._first_step:
+            raise ValueError("Scenario has no steps configured.")
+        user = self.user if getattr(self.user, "is_authenticated", False) else None
+        session = PlanningSession.objects.create(
+            scenario=self._scenario,
+            org_unit_id=org_id,
+            created_by=user,
+            current_step=self._first_step,
+        )
+        self.sessions[org_id] = session.pk
+        return session.pk
+
+    def _facts_qs(self):
+        # year/version pin statements to one partition when partitioning is enabled
+        return PlanningFact.objects.filter(year_id=self.ly.year_id, version_id=self.ly.version_id)
+
+    def _load_facts(self, org_ids, signatures):
+        qs = self._facts_qs().filter(
+            layout_year=self.ly,
+            org_unit_id__in=org_ids,
+            dim_signature__in=signatures,
+        ).values_list(
+            "id", "session_id", "period_id", "key_figure_id", "org_unit_id",
+            "service_id", "account_id", "dim_signature",
+        )
+        for row in qs.iterator(chunk_size=self.BATCH_SIZE):
+            fid, cell = row[0], row[1:]
+            self._by_cell[cell] = fid
+            self._by_row[(cell[3], cell[6])].append(cell)
+
+    # ---- in-memory operations ---------------------------------------------
+    def _delete(self, org_id, svc_flag, svc_id, per_id, kf_id, signature):
+        """Mark matching cells deleted; None for period/key figure matches any."""
+        n = 0
+        for cell in self._by_row.get((org_id, signature), ()):
+            _sid, c_per, c_kf, _org, c_svc, _acct, _sig = cell
+            if svc_flag == "VAL" and c_svc != svc_id:
+                continue
+            if svc_flag == "NULL" and c_svc is not None:
+                continue
+            if per_id is not None and c_per != per_id:
+                continue
+            if kf_id is not None and c_kf != kf_id:
+                continue
+            fid = self._by_cell.get(cell)
+            if fid is not None:
+                if fid in self._dead:
+                    continue
+                self._dead.add(fid)
+                self._dirty.pop(fid, None)
+                n += 1
+            elif cell in self._new:
+                # fact row plus its extras, as the cascade would report
+                self._cancelled += 1 + len(self._new.pop(cell)["pairs"])
+                n += 1
+        return n
+
+    def _upsert(self, cell, value, pairs):
+        fid = self._by_cell.get(cell)
+        if fid is not None:
+            self._dead.discard(fid)
+            self._dirty[fid] = value
+            return
+        if cell not in self._new:
+            self._by_row[(cell[3], cell[6])].append(cell)
+        self._new[cell] = {"value": value, "pairs": pairs}
+
+    # ---- driver -----------------------------------------------------------
+    def run(self, updates: List[Dict[str, Any]]) -> Dict[str, Any]:
+        rows = [self._raw_row(u) for u in updates]
+        self._load_lookups(rows)
+
+        bound = []
+        for r in rows:
+            try:
+                bound.append((r, self._bind(r)))
+            except Exception as e:
+                bound.append((r, e))
+
+        ok = [b for _, b in bound if not isinstance(b, Exception)]
+        self._load_sessions({b[0] for b in ok})
+        self._load_facts({b[0] for b in ok}, {b[4] for b in ok})
+
+        for r, b in [x for x in bound if x[0]["delete_row"]]:
+            try:
+                if isinstance(b, Exception):
+                    raise b
+                org_id, svc_flag, svc_id, _pairs, signature, per_id = b
+                kf_id = self._kf_id(r["kf"], required=False)
+                n = self._delete(org_id, svc_flag, svc_id, per_id, kf_id, signature)
+                if not n:
+                    self.errors.append({"update": r["upd"], "error": "No facts matched for deletion"})
+            except Exception as e:
+                self.errors.append({"update": r["upd"], "error": str(e)})
+
+        for r, b in [x for x in bound if not x[0]["delete_row"]]:
+            try:
+                if isinstance(b, Exception):
+                    raise b
+                org_id, svc_flag, svc_id, pairs, signature, per_id = b
+                kf_id = self._kf_id(r["kf"], required=True)
+
+                raw_val = r["value"]
+                is_blank = (raw_val is None) or (isinstance(raw_val, str) and raw_val.strip() == "")
+                if (self.delete_blanks and is_blank) or (
+                    self.delete_zeros and not is_blank and Decimal(str(raw_val)) == 0
+                ):
+                    n = self._delete(org_id, svc_flag, svc_id, per_id, kf_id, signature)
+                    if not n:
+                        self.errors.append({"update": r["upd"], "error": "No facts matched for zero/blank deletion"})
+                    continue
+
+                val = Decimal(str(raw_val))
+                sid = self._session_for(org_id)
+                cell = (sid, per_id, kf_id, org_id, svc_id if svc_flag == "VAL" else None, None, signature)
+                self._upsert(cell, val, pairs)
+                self.updated += 1
+            except Exception as e:
+                self.errors.append({"update": r["upd"], "error": str(e)})
+
+        deleted = self._flush()
+        if self.updated or deleted:
+            self.recalculated = auto_recalculate(self.ly, self.changed, self.recalc_errors)
+            invalidate_layout_year(self.ly.pk)
+        result = {"updated": self.updated, "deleted": deleted, "recalculated": self.recalculated}
+        if self.recalc_errors:
+            result["recalc_errors"] = self.recalc_errors
+        return result
+
+    # ---- write-back -------------------------------------------------------
+    def _flush(self) -> int:
+        ly = self.ly
+        cell_of = {fid: cell for cell, fid in self._by_cell.items()}
+
+        # counts include cascaded rows, matching queryset.delete()
+        deleted = self._cancelled
+        if self._dead:
+            deleted += self._facts_qs().filter(id__in=self._dead).delete()[0]
+        self.changed = {
+            cell_of[fid][:3] for fid in self._dead | set(self._dirty)
+        } | {cell[:3] for cell in self._new}
+
+        touched = {cell_of[fid][0] for fid in self._dirty} | {cell[0] for cell in self._new}
+        if not touched:
+            return deleted
+        requests = {
+            sid: DataRequest(session_id=sid, description="Manual grid update")
+            for sid in sorted(touched)
+        }
+        DataRequest.objects.bulk_create(requests.values())
+
+        if self._dirty:
+            self._facts_qs().bulk_update(
+                [
+                    PlanningFact(id=fid, value=val, request=requests[cell_of[fid][0]])
+                    for fid, val in self._dirty.items()
+                ],
+                ["request", "value"],
+                batch_size=self.BATCH_SIZE,
+            )
+
+        if self._new:
+            new_facts, new_pairs = [], []
+            for cell, spec in self._new.items():
+                sid, per_id, kf_id, org_id, svc_id, acct_id, signature = cell
+                new_facts.append(PlanningFact(
+                    request=requests[sid],
+                    session_id=sid,
+                    layout_year_id=ly.pk,
+                    org_unit_id=org_id,
+                    service_id=svc_id,
+                    account_id=acct_id,
+                    period_id=per_id,
+                    key_figure_id=kf_id,
+                    version_id=ly.version_id,
+                    year_id=ly.year_id,
+                    uom_id=self.kf_uom.get(kf_id),
+                    value=spec["value"],
+                    ref_value=Decimal("0"),
+                    ref_uom=None,
+                    dim_signature=signature,
+                ))
+                new_pairs.append(spec["pairs"])
+            PlanningFact.objects.bulk_create(
+                new_facts,
+                batch_size=self.BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=CELL_FIELDS,
+                update_fields=["request", "value"],
+            )
+            PlanningFactExtra.objects.bulk_create(
+                [
+                    PlanningFactExtra(
+                        fact_id=fact.pk,
+                        key=dk,
+                        content_type_id=dk.content_type_id,
+                        object_id=oid,
+                        year_id=fact.year_id,
+                        version_id=fact.version_id,
+                    )
+                    for fact, pairs in zip(new_facts, new_pairs)
+                    for dk, oid in pairs
+                ],
+                batch_size=self.BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+        return deleted
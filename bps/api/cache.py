@@ -0,0 +1,122 @@
+# bps/api/cache.py
+"""
+Response cache for the read-only grid endpoints.
+
+Entries live in Django's cache framework (alias settings.BPS_GRID_CACHE,
+locmem by default; file/redis backends share them between workers) and are
+keyed by view, layout-year, the layout-year's cache generation and change
+stamp, the caller's access scope and the query string (plus the
+conversion-rate version for `display_uom` reads).
+
+Writers (grid bulk update, planning functions, formula runs) call
+invalidate_layout_year(), which bumps the generation once their transaction
+commits; the change stamp in the key covers every other write path.
+"""
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+from bps.access import access_scope_key
+from bps.models.models_view import layout_year_stamp
+from bps.utils.conversion_rates import rates_version
+
+PREFIX = "bps:grid"
+STATS = ("hits", "misses")
+
+
+def _cache():
+    return caches[getattr(settings, "BPS_GRID_CACHE", "default")]
+
+
+def _timeout():
+    return getattr(settings, "BPS_GRID_CACHE_TIMEOUT", 300)
+
+
+def _generation_key(layout_year_id):
+    return f"{PREFIX}:gen:{layout_year_id}"
+
+
+def _count(cache, stat):
+    key = f"{PREFIX}:stats:{stat}"
+    if not cache.add(key, 1, None):
+        cache.incr(key)
+
+
+def invalidate_layout_year(layout_year_id):
+    """Drop every cached response of a layout-year once the current transaction commits."""
+    def bump():
+        cache = _cache()
+        key = _generation_key(layout_year_id)
+        if not cache.add(key, 2, None):
+            cache.incr(key)
+    transaction.on_commit(bump)
+
+
+def cache_stats():
+    cache = _cache()
+    found = cache.get_many([f"{PREFIX}:stats:{s}" for s in STATS])
+    hits, misses = (found.get(f"{PREFIX}:stats:{s}", 0) for s in STATS)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 3) if total else None,
+        "timeout": _timeout(),
+    }
+
+
+def reset_cache_stats():
+    _cache().delete_many([f"{PREFIX}:stats:{s}" for s in STATS])
+
+
+def cached_grid_response(*params):
+    """
+    Cache decorator for an APIView.get keyed by the first present
+    layout-year query param. Only 200 responses are stored, with their
+    X-Grid-* headers; the X-Grid-Cache header tells HIT from MISS.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            raw = next((request.GET[p] for p in params if request.GET.get(p)), None)
+            timeout = _timeout()
+            if not timeout or not str(raw or "").isdigit():
+                return view(request, *args, **kwargs)
+
+            ly_pk = int(raw)
+            cache = _cache()
+            stamp = layout_year_stamp(ly_pk)
+            query = hashlib.md5(urlencode(sorted(request.GET.items())).encode()).hexdigest()
+            key = ":".join([
+                PREFIX, view.__qualname__, str(ly_pk),
+                str(cache.get_or_set(_generation_key(ly_pk), 1, None)),
+                stamp[0] if stamp else "-",
+                access_scope_key(request.user, request),
+                query,
+            ])
+            if request.GET.get("display_uom"):
+                # converted values go stale with the rates, not with the facts
+                key += f":u{rates_version()}"
+
+            cached = cache.get(key)
+            if cached is not None:
+                _count(cache, "hits")
+                data, headers = cached
+                response = Response(data, headers=headers)
+                response["X-Grid-Cache"] = "HIT"
+                return response
+
+            _count(cache, "misses")
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                headers = {k: v for k, v in response.items() if k.startswith("X-Grid-")}
+                cache.set(key, (response.data, headers), timeout)
+            response["X-Grid-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
@@ -4,11 +4,14 @@ from rest_framework.routers import DefaultRouter
 from .api import (
     PlanningGridView,
     PlanningGridBulkUpdateView,
+    GridCacheStatsView,
 )
 from .views_manual import ManualPlanningGridAPIView
 from ..views.viewsets import PlanningFactViewSet, OrgUnitViewSet
 from .views import PlanningFactPivotedAPIView, SessionFactsPageAPIView
 from .views_lookup import header_options
+from .views_formula import FormulaPreviewView, FormulaPreviewDetailView, FormulaPreviewCommitView
+from .views_jobs import JobListView, JobDetailView, JobCancelView, JobDownloadView
 
 app_name = "bps_api"
 
@@ -40,6 +43,12 @@ urlpatterns = [
         name="planning_grid_update",
     ),
 
+    path(
+        "grid-cache/stats/",
+        GridCacheStatsView.as_view(),
+        name="grid_cache_stats",
+    ),
+
     # pivot endpoint (if still needed by other UIs)
     path(
         "pivot/",
@@ -50,4 +59,15 @@ urlpatterns = [
     path("api/layout/<int:layout_year_id>/header-options/<str:model_name>/", header_options, name="header-options"),
     path("sessions/<int:pk>/facts/", SessionFactsPageAPIView.as_view(), name="session-facts"),
 
+    # formula preview: in-memory diff, committed on request
+    path("formulas/<int:pk>/preview/", FormulaPreviewView.as_view(), name="formula_preview"),
+    path("formula-previews/<str:token>/", FormulaPreviewDetailView.as_view(), name="formula_preview_detail"),
+    path("formula-previews/<str:token>/commit/", FormulaPreviewCommitView.as_view(), name="formula_preview_commit"),
+
+    # background jobs (bps_worker): queue, poll, cancel, download
+    path("jobs/", JobListView.as_view(), name="job_list"),
+    path("jobs/<int:pk>/", JobDetailView.as_view(), name="job_detail"),
+    path("jobs/<int:pk>/cancel/", JobCancelView.as_view(), name="job_cancel"),
+    path("jobs/<int:pk>/download/", JobDownloadView.as_view(), name="job_download"),
+
 ]
\ No newline at end of file
@@ -1,31 +1,149 @@
 # api/utils.py
+import re
+import hashlib
 from collections import defaultdict, OrderedDict
+from urllib.parse import urlencode
+
+from django.views.decorators.http import condition
+
 from bps.models.models import Period
+from bps.models.models_view import layout_year_stamp, session_stamp
+from bps.utils.conversion_rates import DisplayFactors, rates_version
 
-def pivot_facts_grouped(facts, use_ref_value=False):
+def pivot_facts_grouped(pivots, use_ref_value=False, factors=None):
     """
     Returns a list of dicts, each with:
       { "org_unit": ..., "service": ..., "key_figure": ...,
         "Jan": 123.4, "Feb": 98.7, … }
+
+    `pivots` is a PivotedPlanningFact queryset; cells that differ only in
+    their extra dimensions are summed into one row. `factors`
+    (DisplayFactors) converts the values into a display unit.
     """
-    # build map: (org,service,key_figure) → {period_code → value}
+    periods = list(Period.objects.order_by("order").values_list("code", "name"))
+    prefix = "r" if use_ref_value else "v"
+    cols = [f"{prefix}{code}" for code, _ in periods]
+
+    # build map: (org,service,key_figure) → {column → value}
     matrix = defaultdict(lambda: defaultdict(float))
     meta = {}
-    for f in facts:
-        key = (f.org_unit.name, (f.service.name if f.service else None), f.key_figure.code)
-        val = float(f.ref_value if use_ref_value else f.value)
-        matrix[key][f.period.code] += val
-        meta[key] = {
-            "org_unit":   f.org_unit.name,
-            "service":    (f.service.name if f.service else None),
-            "key_figure": f.key_figure.code,
-        }
+    qs = pivots.values("session_id", "key_figure_id",
+                       "org_unit__name", "service__name", "key_figure__code", *cols)
+    for p in qs.iterator(chunk_size=2000):
+        key = (p["org_unit__name"], p["service__name"], p["key_figure__code"])
+        factor = factors.factor(p["session_id"], p["key_figure_id"]) if factors else None
+        for col in cols:
+            if p[col] is not None:
+                matrix[key][col] += DisplayFactors.apply(p[col], factor)
+        meta.setdefault(key, {
+            "org_unit":   p["org_unit__name"],
+            "service":    p["service__name"],
+            "key_figure": p["key_figure__code"],
+        })
     # turn into list of ordered dicts
-    periods = Period.objects.order_by("order").values_list("code", "name")
     out = []
     for key, row in matrix.items():
         entry = OrderedDict(meta[key])
-        for code,name in periods:
-            entry[name] = row.get(code, 0.0)
+        for (code, name), col in zip(periods, cols):
+            entry[name] = row.get(col, 0.0)
         out.append(entry)
-    return out
\ No newline at end of file
+    return out
+
+
+MONTH_ALIASES = {
+    "JAN": "01", "FEB": "02", "MAR": "03", "APR": "04",
+    "MAY": "05", "JUN": "06", "JUL": "07", "AUG": "08",
+    "SEP": "09", "OCT": "10", "NOV": "11", "DEC": "12",
+}
+QTR_FIRST_MONTH = {"Q1": "01", "Q2": "04", "Q3": "07", "Q4": "10"}
+
+
+def normalize_period_code(raw):
+    """Return 'MM' or None (for year-dependent)."""
+    if raw is None:
+        return None
+    s = str(raw).strip().upper()
+    if s == "" or s == "NULL":
+        return None
+    if s.startswith("M") and s[1:].isdigit():
+        s = s[1:]
+    if s in QTR_FIRST_MONTH:
+        return QTR_FIRST_MONTH[s]
+    if s[:3] in MONTH_ALIASES:
+        return MONTH_ALIASES[s[:3]]
+    if s.isdigit():
+        i = int(s)
+        if 1 <= i <= 12:
+            return f"{i:02d}"
+    if re.fullmatch(r"\d{2}", s):
+        return s
+    raise ValueError(f"Invalid period '{raw}'")
+
+
+def parse_pk_or_code(val):
+    if val is None or val == "":
+        return None, None
+    s = str(val).strip()
+    if s.lower() in {"null", "(null)"}:
+        return "NULL", None
+    if s.isdigit():
+        return "PK", int(s)
+    return "CODE", s
+
+
+# ── Conditional GET ──────────────────────────────────────────────────────
+def _stamp_condition(resolve):
+    """
+    condition() for an APIView.get whose payload only depends on the facts of
+    one layout-year or session. `resolve(request, kwargs)` returns
+    (scope, stamp, changed_at) or None; it reads FactChangeStamp only, so a
+    matching If-None-Match / If-Modified-Since answers 304 without touching
+    the fact table. The query string is part of the ETag (filters change the
+    body), and so is the conversion-rate version when values are shown in a
+    `display_uom`.
+    """
+    def lookup(request, kwargs):
+        if not hasattr(request, "_bps_stamp"):
+            request._bps_stamp = resolve(request, kwargs)
+        return request._bps_stamp
+
+    def etag(request, *args, **kwargs):
+        found = lookup(request, kwargs)
+        if found is None:
+            return None
+        scope, stamp, _ = found
+        query = hashlib.md5(urlencode(sorted(request.GET.items())).encode()).hexdigest()[:12]
+        if request.GET.get("display_uom"):
+            query += f"-u{rates_version()}"
+        return f'W/"{scope}-{stamp}-{query}"'
+
+    def last_modified(request, *args, **kwargs):
+        found = lookup(request, kwargs)
+        return found[2] if found else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _as_pk(raw):
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+def layout_year_condition(*params):
+    """Conditional GET keyed by the first present layout-year query param."""
+    def resolve(request, kwargs):
+        ly_pk = _as_pk(next((request.GET[p] for p in params if request.GET.get(p)), None))
+        found = layout_year_stamp(ly_pk) if ly_pk else None
+        return (f"ly{ly_pk}", *found) if found else None
+    return _stamp_condition(resolve)
+
+
+def session_condition(kwarg="pk"):
+    """Conditional GET keyed by a session id URL kwarg."""
+    def resolve(request, kwargs):
+        sess_pk = _as_pk(kwargs.get(kwarg))
+        found = session_stamp(sess_pk) if sess_pk else None
+        return (f"s{sess_pk}", *found) if found else None
+    return _stamp_condition(resolve)
@@ -8,40 +8,63 @@ from rest_framework import status
 import logging
 from math import ceil
 from django.core.paginator import Paginator
+from django.utils.decorators import method_decorator
 
 # import the layout‐year model
 from bps.models.models_layout import PlanningLayoutYear
 from bps.models.models import PlanningFact, Version
+from bps.models.models_view import PivotedPlanningFact, MONTHS
+from bps.models.models_extras import extras_map_subquery, dimension_label_maps
 from bps.models.models_workflow import PlanningSession
+from bps.utils.conversion_rates import DisplayFactors
 
 from .serializers import PlanningFactPivotRowSerializer
-from .utils import pivot_facts_grouped
+from .utils import pivot_facts_grouped, layout_year_condition, session_condition
+from .cache import cached_grid_response
 
 class PlanningFactPivotedAPIView(APIView):
+    """
+    GET ?layout=<layout-year pk>[&display_uom=<code>]
+    One row per (org unit, service) with "<period>_<kf>" columns; `display_uom`
+    converts values into that unit on the fly (cells without a rate keep theirs).
+    """
     permission_classes = [AllowAny]
     renderer_classes   = [JSONRenderer]   # JSON only, no HTML render
 
+    @method_decorator([
+        layout_year_condition("layout"),
+        cached_grid_response("layout"),
+    ])
     def get(self, request):
         ly_pk = request.query_params.get("layout")
         if not ly_pk:
             return Response({"error": "Missing layout parameter"}, status=400)
 
-        # 1) Fetch all facts in one hit, pulling back only the fields we need
-        qs = PlanningFact.objects.filter(
-            session__scenario__layout_year_id=ly_pk
-        ).select_related(
-            "org_unit", "service", "period", "key_figure"
+        factors = None
+        display_uom = request.query_params.get("display_uom")
+        if display_uom:
+            try:
+                factors = DisplayFactors(get_object_or_404(PlanningLayoutYear, pk=ly_pk), display_uom)
+            except ValueError as exc:
+                return Response({"error": str(exc)}, status=400)
+
+        # 1) One row per pivoted cell, months already side by side
+        month_cols = [f"v{m}" for m in MONTHS]
+        qs = PivotedPlanningFact.objects.filter(
+            layout_year_id=ly_pk
         ).values(
+            "session_id",
+            "key_figure_id",
             "org_unit__name",
             "service__name",
-            "period__code",
             "key_figure__code",
-            "value",
+            "year_value",
+            *month_cols,
         )
 
-        # 2) Pivot in pure Python, operating on simple dicts not full models
+        # 2) Merge cells into (org, service) rows, operating on simple dicts
         rows = {}
-        for f in qs:
+        for f in qs.iterator(chunk_size=2000):
             org   = f["org_unit__name"]
             svc   = f["service__name"] or None
             key   = (org, svc)
@@ -49,10 +72,18 @@ class PlanningFactPivotedAPIView(APIView):
                 "org_unit": org,
                 "service":  svc,
             })
-            col   = f"{f['period__code']}_{f['key_figure__code']}"
-            row[col] = float(f["value"])
-
-        return Response(list(rows.values()))
+            kf    = f["key_figure__code"]
+            factor = factors.factor(f["session_id"], f["key_figure_id"]) if factors else None
+            for m, col in zip(MONTHS, month_cols):
+                if f[col] is not None:
+                    row[f"{m}_{kf}"] = DisplayFactors.apply(f[col], factor)
+            if f["year_value"] is not None:
+                row[f"YEAR_{kf}"] = DisplayFactors.apply(f["year_value"], factor)
+
+        response = Response(list(rows.values()))
+        if factors:
+            factors.annotate(response)
+        return response
     
 class PlanningFactPivotedAPIView_OLD(APIView):
     permission_classes = [AllowAny]
@@ -65,8 +96,8 @@ class PlanningFactPivotedAPIView_OLD(APIView):
             return Response({"error": "Missing layout parameter"}, status=400)
         ly = get_object_or_404(PlanningLayoutYear, pk=ly_pk)
 
-        # 2) base queryset: always filter by session → layout_year
-        facts = PlanningFact.objects.filter(session__scenario__layout_year=ly)
+        # 2) base queryset: always filter by layout_year
+        facts = PivotedPlanningFact.objects.filter(layout_year=ly)
 
         # 3) optional version filter
         version_code = request.query_params.get("version")
@@ -88,11 +119,11 @@ class PlanningFactPivotedAPIView_OLD(APIView):
             # only apply if it matches one of our row-dimensions
             if driver_key not in valid_driver_keys:
                 continue
-            # filter by JSON‐key exists, then contains the specific value
+            # filter by extras key exists, then contains the specific value
             facts = (
                 facts
-                .filter(extra_dimensions_json__has_key=driver_key)
-                .filter(extra_dimensions_json__contains={driver_key: val})
+                .filter(extras__has_key=driver_key)
+                .filter(extras__contains={driver_key: int(val) if str(val).isdigit() else val})
             )
 
         # 6) pivot & serialize
@@ -107,6 +138,7 @@ log = logging.getLogger(__name__)
 class SessionFactsPageAPIView(APIView):
     permission_classes = [AllowAny]
 
+    @method_decorator(session_condition("pk"))
     def get(self, request, pk):
         try:
             # Tabulator remote sends ?page=&size= by default
@@ -126,37 +158,50 @@ class SessionFactsPageAPIView(APIView):
             qs = (
                 PlanningFact.objects
                 .filter(session=sess)
-                .select_related(
-                    "period", "key_figure", "uom", "ref_uom",
-                    "org_unit", "service", "account"
-                )
                 .order_by("period__order", "key_figure__code", "service__name")
+                .annotate(extras_map=extras_map_subquery())
+                .values(
+                    "id", "org_unit__name", "service__name", "account__name",
+                    "period__code", "key_figure__code", "value", "uom__code",
+                    "ref_value", "ref_uom__code", "extras_map",
+                )
             )
 
             paginator = Paginator(qs, size)
             page_obj  = paginator.get_page(page)
+            page_rows = list(page_obj.object_list)
+
+            # labels for the extra dimensions on this page only
+            wanted = {}
+            for f in page_rows:
+                for key, obj_id in (f["extras_map"] or {}).items():
+                    wanted.setdefault(key, set()).add(obj_id)
+            labels = dimension_label_maps(set(wanted), wanted)
+
+            # Safe number conversion (Decimal -> float)
+            def f2(x):
+                try:
+                    return float(x)
+                except Exception:
+                    return None
 
             rows = []
-            for f in page_obj.object_list:
-                # Safe number conversion (Decimal -> float)
-                def f2(x):
-                    try:
-                        return float(x)
-                    except Exception:
-                        return None
-
+            for f in page_rows:
+                extras = f["extras_map"] or {}
                 rows.append({
-                    "id": f.id,
-                    "org_unit":   getattr(f.org_unit, "name", None),
-                    "service":    getattr(f.service, "name", None),
-                    "account":    getattr(f.account, "name", None),
-                    "period":     getattr(f.period, "code", None),
-                    "key_figure": getattr(f.key_figure, "code", None),
-                    "value":      f2(f.value),
-                    "uom":        getattr(f.uom, "code", None),
-                    "ref_value":  f2(f.ref_value),
-                    "ref_uom":    getattr(f.ref_uom, "code", None),
-                    "extra_dimensions": f.extra_dimensions_json or {},
+                    "id": f["id"],
+                    "org_unit":   f["org_unit__name"],
+                    "service":    f["service__name"],
+                    "account":    f["account__name"],
+                    "period":     f["period__code"],
+                    "key_figure": f["key_figure__code"],
+                    "value":      f2(f["value"]),
+                    "uom":        f["uom__code"],
+                    "ref_value":  f2(f["ref_value"]),
+                    "ref_uom":    f["ref_uom__code"],
+                    "extra_dimensions": {
+                        k: labels.get(k, {}).get(v, v) for k, v in extras.items()
+                    },
                 })
 
             return Response({
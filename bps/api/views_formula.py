@@ -0,0 +1,106 @@
+# bps/api/views_formula.py
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from rest_framework import serializers, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from bps.models.models import Formula
+from bps.models.models_workflow import PlanningSession
+from bps.views.formula_compiler import FormulaError
+from bps.views.formula_executor import FormulaExecutor
+from bps.views.formula_preview import SORTS, FormulaDiff
+
+
+class PageSerializer(serializers.Serializer):
+    page = serializers.IntegerField(required=False, default=1, min_value=1)
+    page_size = serializers.IntegerField(required=False, default=50, min_value=1, max_value=1000)
+    sort = serializers.ChoiceField(required=False, default="-abs_delta",
+                                   choices=[p + s for s in SORTS for p in ("", "-")])
+    changed_only = serializers.BooleanField(required=False, default=False)
+    top = serializers.IntegerField(required=False, default=10, min_value=0, max_value=100)
+
+
+class FormulaPreviewSerializer(PageSerializer):
+    session = serializers.IntegerField()
+    period = serializers.CharField(required=False, default="01")
+
+
+def _preview_response(diff: FormulaDiff, opts, status_code=status.HTTP_200_OK):
+    return Response({
+        "token": diff.token,
+        "formula": diff.formula_id,
+        "session": diff.session_id,
+        "period": diff.period,
+        "summary": diff.summary(top=opts["top"]),
+        **diff.page(opts["page"], opts["page_size"], opts["sort"], opts["changed_only"]),
+    }, status=status_code)
+
+
+class FormulaPreviewView(APIView):
+    """
+    POST /formulas/<pk>/preview/ {session, period, page, page_size, sort, changed_only, top}
+    Evaluates the formula in memory and returns a token, a summary and the first page.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        ser = FormulaPreviewSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        opts = ser.validated_data
+        formula = get_object_or_404(Formula, pk=pk)
+        session = get_object_or_404(
+            PlanningSession.objects.select_related("org_unit", "scenario__layout_year"),
+            pk=opts["session"])
+        try:
+            diff = FormulaExecutor(formula, session, opts["period"], preview=True).execute()
+        except (FormulaError, LookupError) as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        diff.save()
+        return _preview_response(diff, opts, status.HTTP_201_CREATED)
+
+
+class FormulaPreviewDetailView(APIView):
+    """
+    GET    /formula-previews/<token>/?page=&page_size=&sort=&changed_only=&top=
+    POST   /formula-previews/<token>/commit/   write the previewed values
+    DELETE /formula-previews/<token>/          drop the preview
+    """
+    permission_classes = [IsAuthenticated]
+
+    def _load(self, token):
+        diff = FormulaDiff.load(token)
+        if diff is None:
+            return None, Response({"error": "Preview expired or unknown"}, status=status.HTTP_404_NOT_FOUND)
+        return diff, None
+
+    def get(self, request, token):
+        diff, error = self._load(token)
+        if error:
+            return error
+        ser = PageSerializer(data=request.query_params)
+        ser.is_valid(raise_exception=True)
+        return _preview_response(diff, ser.validated_data)
+
+    def delete(self, request, token):
+        diff, error = self._load(token)
+        if error:
+            return error
+        diff.discard()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class FormulaPreviewCommitView(FormulaPreviewDetailView):
+    http_method_names = ["post", "options"]
+
+    @transaction.atomic
+    def post(self, request, token):
+        diff, error = self._load(token)
+        if error:
+            return error
+        try:
+            run = diff.commit(user=request.user)
+        except FormulaError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return Response({"run": run.pk, "entries": run.entries.count()})
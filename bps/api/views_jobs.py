@@ -0,0 +1,195 @@
+# bps/api/views_jobs.py
+from django.core.files.storage import default_storage
+from django.http import FileResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from rest_framework import serializers, status
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from bps.access import is_enterprise_planner
+from bps.models.models import Formula, PlanningFunction
+from bps.models.models_jobs import Job
+from bps.models.models_layout import PlanningLayoutYear
+from bps.models.models_workflow import PlanningSession
+from bps.utils.job_queue import HANDLERS, cancel, enqueue
+
+# kinds that write across many sessions / layout-years
+PRIVILEGED_KINDS = {"copy", "pipeline"}
+
+
+def _exists(model):
+    def check(pk):
+        if not model.objects.filter(pk=pk).exists():
+            raise serializers.ValidationError(f"{model.__name__} {pk} does not exist")
+    return check
+
+
+_ids = lambda: serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+_codes = lambda: serializers.ListField(child=serializers.CharField(), required=False, allow_empty=False)
+
+
+class FormulaJobParams(serializers.Serializer):
+    formula = serializers.IntegerField(validators=[_exists(Formula)])
+    session = serializers.IntegerField(required=False, validators=[_exists(PlanningSession)])
+    sessions = _ids()
+    period = serializers.CharField(required=False, max_length=2)
+    mode = serializers.ChoiceField(choices=["slice", "row"], required=False)
+
+    def validate(self, attrs):
+        if not attrs.get("session") and not attrs.get("sessions"):
+            raise serializers.ValidationError("Give `session` or `sessions`")
+        return attrs
+
+
+class FunctionJobParams(serializers.Serializer):
+    function = serializers.IntegerField(validators=[_exists(PlanningFunction)])
+    session = serializers.IntegerField(validators=[_exists(PlanningSession)])
+
+
+class PipelineJobParams(serializers.Serializer):
+    scenario = serializers.CharField()
+    sessions = _ids()
+    workers = serializers.IntegerField(required=False, min_value=1)
+    retries = serializers.IntegerField(required=False, min_value=0)
+    continue_on_error = serializers.BooleanField(required=False)
+
+
+class CopyJobParams(serializers.Serializer):
+    layout_year = serializers.IntegerField(validators=[_exists(PlanningLayoutYear)])
+    to_version = serializers.CharField()
+    to_year = serializers.CharField(required=False)
+    to_scenario = serializers.CharField(required=False)
+    sessions = _ids()
+    key_figures = _codes()
+    periods = _codes()
+    overwrite = serializers.BooleanField(required=False)
+
+
+class ExportJobParams(serializers.Serializer):
+    layout_year = serializers.IntegerField(required=False)
+    session = serializers.IntegerField(required=False)
+    search = serializers.CharField(required=False)
+
+
+JOB_PARAMS = {
+    "formula": FormulaJobParams,
+    "function": FunctionJobParams,
+    "pipeline": PipelineJobParams,
+    "copy": CopyJobParams,
+    "export": ExportJobParams,
+}
+
+
+class JobCreateSerializer(serializers.Serializer):
+    """A job request; `params` are checked against the kind's params serializer."""
+    kind = serializers.CharField()
+    params = serializers.DictField(required=False, default=dict)
+
+    def validate_kind(self, value):
+        if value not in HANDLERS:
+            raise serializers.ValidationError(f"One of {', '.join(sorted(HANDLERS))}")
+        return value
+
+    def validate(self, attrs):
+        params_class = JOB_PARAMS.get(attrs["kind"])
+        if params_class is not None:
+            params = params_class(data=attrs["params"])
+            if not params.is_valid():
+                raise serializers.ValidationError({"params": params.errors})
+            attrs["params"] = dict(params.validated_data)
+        return attrs
+
+
+def can_queue(user, kind):
+    """copy and pipeline jobs are for staff and enterprise planners only."""
+    return kind not in PRIVILEGED_KINDS or user.is_staff or is_enterprise_planner(user)
+
+
+def job_url(job, request=None):
+    url = reverse("bps_api:job_detail", args=[job.pk])
+    return request.build_absolute_uri(url) if request else url
+
+
+def job_payload(job, request=None):
+    return {
+        "id": job.pk,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "result": job.result,
+        "error": job.error,
+        "cancel_requested": job.cancel_requested,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "url": job_url(job, request),
+    }
+
+
+def _visible_jobs(user):
+    qs = Job.objects.all()
+    return qs if user.is_staff else qs.filter(created_by=user)
+
+
+class JobListView(APIView):
+    """
+    GET  /jobs/                 the caller's latest jobs (all jobs for staff)
+    POST /jobs/ {kind, params}  queue a job -> 202 with its poll URL; 400 for
+                                bad params, 403 for copy/pipeline without
+                                staff or enterprise-planner rights
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        jobs = _visible_jobs(request.user).order_by("-created_at")[:50]
+        return Response([job_payload(j, request) for j in jobs])
+
+    def post(self, request):
+        kind = request.data.get("kind")
+        if not can_queue(request.user, kind):
+            raise PermissionDenied(f"Only staff and enterprise planners may queue {kind} jobs")
+        ser = JobCreateSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        job = enqueue(ser.validated_data["kind"], ser.validated_data["params"], user=request.user)
+        job.refresh_from_db()
+        return Response(job_payload(job, request), status=status.HTTP_202_ACCEPTED,
+                        headers={"Location": job_url(job, request)})
+
+
+class JobDetailView(APIView):
+    """GET /jobs/<pk>/ status, progress and result of one job (poll this)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(_visible_jobs(request.user), pk=pk)
+        return Response(job_payload(job, request))
+
+
+class JobCancelView(APIView):
+    """POST /jobs/<pk>/cancel/ cancel a queued job, or ask a running one to stop."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        job = get_object_or_404(_visible_jobs(request.user), pk=pk)
+        if job.is_finished:
+            return Response({"error": f"Job already {job.get_status_display().lower()}"},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(job_payload(cancel(job), request))
+
+
+class JobDownloadView(APIView):
+    """GET /jobs/<pk>/download/ the file a finished job produced (e.g. an export)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        job = get_object_or_404(_visible_jobs(request.user), pk=pk)
+        name = (job.result or {}).get("file") if isinstance(job.result, dict) else None
+        if job.status != Job.Status.SUCCEEDED or not name or not default_storage.exists(name):
+            return Response({"error": "No file for this job"}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(default_storage.open(name, "rb"), as_attachment=True,
+                            filename=name.rsplit("/", 1)[-1])
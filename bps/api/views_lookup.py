@@ -3,13 +3,14 @@ from django.http import JsonResponse, Http404
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from ..access import allowed_orgunits_qs
+from ..utils.dimension_registry import dimension_index
 
 PAGE = 30
 
 def header_options(request, layout_year_id, model_name):
     # model_name is lowercase (e.g. "orgunit")
     try:
-        ct = ContentType.objects.get(model=model_name)
+        ct = ContentType.objects.get(app_label="bps", model=model_name)
     except ContentType.DoesNotExist:
         raise Http404("Unknown dimension")
 
@@ -18,18 +19,25 @@ def header_options(request, layout_year_id, model_name):
     page = int(request.GET.get("page", 1))
     if model_name == "orgunit":
         qs = allowed_orgunits_qs(request.user, request)
+        if q:
+            qs = qs.filter(Q(name__icontains=q) | Q(code__icontains=q))
+        total = qs.count()
+        items = [
+            {"id": obj.pk, "text": obj.code or obj.name}
+            for obj in qs.order_by("name")[(page-1)*PAGE: page*PAGE]
+        ]
     else:
-        qs = Model.objects.all()
-
-    if q:
-        crit = Q(name__icontains=q) | Q(code__icontains=q)
-        qs = qs.filter(crit) if hasattr(Model, "code") else qs.filter(name__icontains=q)
-
-    total = qs.count()
-    items = []
-    for obj in qs.order_by("name" if hasattr(Model, "name") else "pk")[(page-1)*PAGE: page*PAGE]:
-        text = getattr(obj, "code", None) or getattr(obj, "name", str(obj))
-        items.append({"id": obj.pk, "text": text})
+        # unrestricted dimensions: search the in-memory registry (rows are name-ordered)
+        rows = dimension_index(Model).rows
+        if q:
+            needle = q.lower()
+            rows = [r for r in rows
+                    if needle in str(r[2] or "").lower() or needle in str(r[1] or "").lower()]
+        total = len(rows)
+        items = [
+            {"id": pk, "text": code or name or str(pk)}
+            for pk, code, name in rows[(page-1)*PAGE: page*PAGE]
+        ]
 
     return JsonResponse({
         "results": items,
@@ -8,12 +8,15 @@ from rest_framework import status
 from decimal import Decimal
 from bps.models.models import PlanningLayoutYear, PlanningFact, PlanningLayoutDimension, Version
 from bps.models.models_layout import LayoutDimensionOverride
+from bps.models.models_view import PivotedPlanningFact
 from .serializers import PlanningFactSerializer, PlanningFactPivotRowSerializer
+from bps.utils.conversion_rates import DisplayFactors
 from .utils import pivot_facts_grouped
 
 class ManualPlanningGridAPIView(APIView):
     """
     GET: Return pivoted grid of facts for a given layout-year-version
+         (?display_uom=<code> converts values into that unit on the fly)
     POST (bulk update): Accepts {layout_id, version, year, updates:[{id, field, value},...]} and saves.
     """
     def get(self, request):
@@ -22,14 +25,24 @@ class ManualPlanningGridAPIView(APIView):
         version   = request.query_params.get('version')
         use_ref   = request.query_params.get('ref') == '1'
         ly = get_object_or_404(PlanningLayoutYear, pk=layout_id)
-        facts = PlanningFact.objects.filter(session__scenario__layout_year=ly)
+        pivots = PivotedPlanningFact.objects.filter(layout_year=ly)
         if year_id:
-            facts = facts.filter(year_id=year_id)
+            pivots = pivots.filter(year_id=year_id)
         if version:
-            facts = facts.filter(version__code=version)
-        pivot = pivot_facts_grouped(facts, use_ref_value=use_ref)
+            pivots = pivots.filter(version__code=version)
+        factors = None
+        display_uom = request.query_params.get('display_uom')
+        if display_uom:
+            try:
+                factors = DisplayFactors(ly, display_uom, "ref_uom_id" if use_ref else "uom_id")
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        pivot = pivot_facts_grouped(pivots, use_ref_value=use_ref, factors=factors)
         # pivot is already a list of dicts with dynamic month‐cols
-        return Response(pivot)
+        response = Response(pivot)
+        if factors:
+            factors.annotate(response)
+        return response
 
     @transaction.atomic
     def post(self, request):
@@ -39,7 +52,8 @@ class ManualPlanningGridAPIView(APIView):
         errors = []
         for upd in payload.get('updates', []):
             try:
-                fact = PlanningFact.objects.get(pk=upd['id'], session__scenario__layout_year=ly)
+                fact = PlanningFact.objects.get(pk=upd['id'], year_id=ly.year_id, version_id=ly.version_id,
+                                                layout_year=ly)
                 # Only allow the two numeric fields
                 if upd['field'] not in ('value','ref_value'):
                     raise ValueError(f"Cannot edit field {upd['field']}")
@@ -90,14 +104,17 @@ class PlanningGridAPIView(APIView):
                 )
 
         # 4. load facts for each
+        # year/version first: lets Postgres prune to one partition when enabled
         base_qs = PlanningFact.objects.filter(
-            session__scenario__layout_year=base_ly
+            year_id=base_ly.year_id, version_id=base_ly.version_id,
+            layout_year=base_ly,
         ).select_related("period", "key_figure", "org_unit", "service")
 
         compare_qs = None
         if compare_ly:
             compare_qs = PlanningFact.objects.filter(
-                session__scenario__layout_year=compare_ly
+                year_id=compare_ly.year_id, version_id=compare_ly.version_id,
+                layout_year=compare_ly,
             ).select_related("period", "key_figure", "org_unit", "service")
 
         # 5. pivot into rows
@@ -149,7 +166,9 @@ class PlanningGridBulkUpdateAPIView(APIView):
 
         # 1) Fetch the layout_year context
         ly = get_object_or_404(PlanningLayoutYear, pk=layout_id)
-        facts_qs = PlanningFact.objects.filter(session__scenario__layout_year=ly)
+        facts_qs = PlanningFact.objects.filter(
+            year_id=ly.year_id, version_id=ly.version_id, layout_year=ly,
+        )
         if version:
             facts_qs = facts_qs.filter(version__code=version)
         if year_code:
@@ -180,7 +199,8 @@ class PlanningGridBulkUpdateAPIView(APIView):
             try:
                 fact = PlanningFact.objects.select_related(
                     "org_unit", "service", "key_figure", "period"
-                ).get(pk=fact_id, session__scenario__layout_year=ly)
+                ).get(pk=fact_id, year_id=ly.year_id, version_id=ly.version_id,
+                      layout_year=ly)
             except PlanningFact.DoesNotExist:
                 errors.append({"update": upd, "error": "Fact not found"})
                 continue
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class BpConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "bps"
+
+    def ready(self):
+        from bps.utils import conversion_rates, dimension_registry, reference_snapshot
+        from bps.views import formula_compiler
+        dimension_registry.connect_signals()
+        conversion_rates.connect_signals()
+        reference_snapshot.connect_signals()
+        formula_compiler.connect_signals()
+        # register the built-in background job handlers
+        from bps.utils import jobs  # noqa: F401
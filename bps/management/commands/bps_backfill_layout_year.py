@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from bps.models.models_view import rebuild_pivot
+
+BACKFILL_BATCH_SQL = """
+WITH batch AS (
+    SELECT f.id, f.year_id, f.version_id, sc.layout_year_id
+      FROM bps_planningfact f
+      JOIN bps_planningsession s ON s.id = f.session_id
+      JOIN bps_planningscenario sc ON sc.id = s.scenario_id
+     WHERE f.layout_year_id IS NULL
+     LIMIT %s
+)
+UPDATE bps_planningfact f
+   SET layout_year_id = b.layout_year_id
+  FROM batch b
+ WHERE f.id = b.id AND f.year_id = b.year_id AND f.version_id = b.version_id
+RETURNING f.session_id
+"""
+
+
+class Command(BaseCommand):
+    help = "Fill PlanningFact.layout_year from session → scenario for facts written without it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20000)
+
+    def handle(self, *args, **options):
+        total, sessions = 0, set()
+        while True:
+            with transaction.atomic(), connection.cursor() as cur:
+                cur.execute(BACKFILL_BATCH_SQL, [options["batch_size"]])
+                rows = cur.fetchall()
+            if not rows:
+                break
+            total += len(rows)
+            sessions.update(r[0] for r in rows)
+            self.stdout.write(f"   ● {total} facts updated…")
+
+        if sessions:
+            # pivot triggers ignore layout_year-only updates
+            with transaction.atomic():
+                rebuild_pivot(sessions)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {total} facts backfilled, pivot refreshed for {len(sessions)} session(s)"
+        ))
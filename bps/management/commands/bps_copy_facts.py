@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bps.api.cache import invalidate_layout_year
+from bps.models.models_layout import PlanningLayoutYear
+from bps.models.models_workflow import PlanningSession
+from bps.utils.fact_copy import copy_sessions
+
+
+class Command(BaseCommand):
+    help = "Copy a layout-year's facts (with extras) into another version/year, in the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--layout-year", type=int, required=True)
+        parser.add_argument("--to-version", required=True, help="Target version id or code")
+        parser.add_argument("--to-year", help="Target year id or code (default: same year)")
+        parser.add_argument("--to-scenario", help="Target scenario code (default: first on the target)")
+        parser.add_argument("--session", type=int, action="append", help="Only these sessions")
+        parser.add_argument("--key-figure", action="append", help="Only these key figure codes")
+        parser.add_argument("--period", action="append", help="Only these period codes")
+        parser.add_argument("--keep-existing", action="store_true",
+                            help="Leave target cells that already exist untouched")
+
+    def handle(self, *args, **options):
+        try:
+            ly = PlanningLayoutYear.objects.get(pk=options["layout_year"])
+        except PlanningLayoutYear.DoesNotExist:
+            raise CommandError(f"Layout-year {options['layout_year']} not found")
+        sessions = PlanningSession.objects.filter(scenario__layout_year=ly).select_related(
+            "scenario__layout_year")
+        if options["session"]:
+            sessions = sessions.filter(pk__in=options["session"])
+
+        started = time.perf_counter()
+        try:
+            result = copy_sessions(
+                sessions.order_by("pk"),
+                to_version=options["to_version"], to_year=options["to_year"],
+                to_scenario=options["to_scenario"],
+                key_figures=options["key_figure"], periods=options["period"],
+                overwrite=not options["keep_existing"],
+                description=f"bps_copy_facts from {ly}",
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if result["layout_year"]:
+            invalidate_layout_year(result["layout_year"])
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {result['facts']} fact(s), {result['extras']} extra(s) from {result['sessions']} "
+            f"session(s) → layout-year {result['layout_year']} in {time.perf_counter() - started:.2f}s"
+        ))
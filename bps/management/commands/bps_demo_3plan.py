@@ -15,7 +15,7 @@ from bps.models.models import (
     Constant,
     Period,
 )
-from bps.models.models_extras import DimensionKey, PlanningFactExtra
+from bps.models.models_extras import DimensionKey, PlanningFactExtra, dimension_signature
 from bps.models.models_dimension import OrgUnit, InternalOrder, Service
 from bps.models.models_layout import PlanningLayoutYear
 from bps.models.models_resource import Position, Skill, RateCard
@@ -73,7 +73,16 @@ class Command(BaseCommand):
         period_ids = [p["id"] for p in periods]  # ids only
 
         # Cache all DimensionKey in memory (by string key)
-        dim_key_map = {dk["key"]: dk for dk in DimensionKey.objects.all().values("id", "key", "content_type_id")}
+        dim_key_map = {
+            dk["key"]: dk
+            for dk in DimensionKey.objects.all().values("id", "key", "content_type_id")
+        }
+
+        def signature_of(ex_set):
+            # same pairs as the PlanningFactExtra rows written below (unknown keys are skipped)
+            return dimension_signature(
+                (dim_key_map[key]["id"], obj_id) for key, obj_id in ex_set if key in dim_key_map
+            )
 
         # Cache RateCard summaries once (used by RES_CON)
         ratecards = list(
@@ -276,6 +285,7 @@ class Command(BaseCommand):
                                     PlanningFact(
                                         request_id=dr.id,
                                         session_id=sess.id,
+                                        layout_year_id=ply.id,
                                         version_id=ply.version_id,
                                         year_id=ply.year_id,
                                         period_id=per_id,
@@ -285,6 +295,7 @@ class Command(BaseCommand):
                                         key_figure_id=kf.id,
                                         value=val,
                                         uom_id=kf.default_uom_id,
+                                        dim_signature=signature_of(ex_key),
                                     )
                                 )
                                 to_create_extras_payload.append(ex_key)
@@ -313,6 +324,8 @@ class Command(BaseCommand):
                                     key_id=dk["id"],
                                     content_type_id=dk["content_type_id"],
                                     object_id=obj_id,
+                                    year_id=fact.year_id,
+                                    version_id=fact.version_id,
                                 )
                             )
                     if extras:
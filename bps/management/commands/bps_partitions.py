@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bps.models.models_dimension import Year, Version
+from bps.utils import partitioning
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage year/version partitions of PlanningFact and PlanningFactExtra: "
+        "enable | list | create | detach | attach"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["enable", "list", "create", "detach", "attach"])
+        parser.add_argument("--year", help="Year code or id")
+        parser.add_argument("--plan-version", dest="version_code", help="Version code or id")
+        parser.add_argument("--drop", action="store_true",
+                            help="detach: drop the partitions instead of moving them to the archive schema")
+
+    def _resolve(self, Model, raw, label):
+        if not raw:
+            raise CommandError(f"--{label} is required")
+        obj = Model.objects.filter(code=raw).first()
+        if obj is None and str(raw).isdigit():
+            obj = Model.objects.filter(pk=int(raw)).first()
+        if obj is None:
+            raise CommandError(f"{Model.__name__} '{raw}' not found")
+        return obj
+
+    def handle(self, *args, **options):
+        action = options["action"]
+
+        if action == "enable":
+            self.stdout.write("→ Converting PlanningFact / PlanningFactExtra to partitioned tables…")
+            partitioning.enable_partitioning(stdout=self.stdout)
+            self.stdout.write(self.style.SUCCESS("   ● partitioning enabled"))
+            return
+
+        if not partitioning.is_partitioned():
+            raise CommandError("PlanningFact is not partitioned; run 'bps_partitions enable' first")
+
+        if action == "list":
+            for table, year_id, version_id, rows in partitioning.list_partitions():
+                self.stdout.write(f"{table:24} year={year_id:<4} version={version_id:<4} ~{rows} rows")
+            return
+
+        year = self._resolve(Year, options["year"], "year")
+        version = self._resolve(Version, options["version_code"], "plan-version")
+
+        if action == "create":
+            partitioning.ensure_partition(year.pk, version.pk)
+            self.stdout.write(self.style.SUCCESS(f"   ● partitions for {year.code}/{version.code} ready"))
+        elif action == "detach":
+            n = partitioning.detach_partition(year.pk, version.pk, archive=not options["drop"], drop=options["drop"])
+            where = "dropped" if options["drop"] else f"moved to schema {partitioning.ARCHIVE_SCHEMA}"
+            self.stdout.write(self.style.SUCCESS(
+                f"   ● {year.code}/{version.code} detached and {where} ({n} session(s) cleared from the pivot)"
+            ))
+        elif action == "attach":
+            n = partitioning.attach_partition(year.pk, version.pk)
+            self.stdout.write(self.style.SUCCESS(f"   ● {year.code}/{version.code} attached ({n} pivot rows rebuilt)"))
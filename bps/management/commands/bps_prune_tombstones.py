@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from bps.models.models_view import prune_pivot_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete pivot tombstones older than --days; grid clients with older delta cursors reload in full"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Keep tombstones of the last N days (default 7)")
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        n = prune_pivot_tombstones(cutoff)
+        self.stdout.write(self.style.SUCCESS(f"   ● {n} tombstones older than {cutoff:%Y-%m-%d %H:%M} removed"))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bps.models.models_view import rebuild_pivot
+from bps.models.models_workflow import PlanningSession
+
+
+class Command(BaseCommand):
+    help = "Rebuild the pivoted_planningfact store from PlanningFact (all sessions, or one layout-year/session)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--layout-year", type=int, help="Only sessions of this PlanningLayoutYear id")
+        parser.add_argument("--session", type=int, action="append", help="Only this PlanningSession id (repeatable)")
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        session_ids = None
+        if options["layout_year"]:
+            session_ids = list(
+                PlanningSession.objects
+                .filter(scenario__layout_year_id=options["layout_year"])
+                .values_list("id", flat=True)
+            )
+        if options["session"]:
+            session_ids = (session_ids or []) + options["session"]
+
+        scope = "all sessions" if session_ids is None else f"{len(session_ids)} session(s)"
+        self.stdout.write(f"→ Rebuilding pivot for {scope}…")
+        n = rebuild_pivot(session_ids)
+        self.stdout.write(self.style.SUCCESS(f"   ● {n} pivot rows written"))
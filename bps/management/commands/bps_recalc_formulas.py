@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bps.models.models_layout import PlanningLayoutYear
+from bps.models.models_workflow import PlanningSession
+from bps.views.formula_compiler import FormulaError
+from bps.views.formula_graph import formula_graph, recalculate
+
+
+class Command(BaseCommand):
+    help = "Run a layout-year's formulas in dependency order (all sessions, or one)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--layout-year", type=int, required=True)
+        parser.add_argument("--session", type=int, help="Only this planning session")
+        parser.add_argument("--show", action="store_true", help="Print the run order and exit")
+
+    def handle(self, *args, **options):
+        try:
+            ly = PlanningLayoutYear.objects.select_related("layout").get(pk=options["layout_year"])
+        except PlanningLayoutYear.DoesNotExist:
+            raise CommandError(f"Layout-year {options['layout_year']} not found")
+        try:
+            graph = formula_graph(ly.layout)
+        except FormulaError as exc:
+            raise CommandError(str(exc))
+
+        for i, node in enumerate(graph.order, 1):
+            reads = "any" if node.reads is None else ", ".join(sorted(node.reads)) or "-"
+            self.stdout.write(f"   {i}. {node.formula.name}: {reads} → {node.writes}")
+        if options["show"] or not graph.order:
+            return
+
+        sessions = PlanningSession.objects.filter(scenario__layout_year=ly)
+        if options["session"]:
+            sessions = sessions.filter(pk=options["session"])
+        with transaction.atomic():
+            runs = recalculate(ly, [(sid, None, None) for sid in sessions.values_list("pk", flat=True)])
+        self.stdout.write(self.style.SUCCESS(f"✅ {runs} formula run(s)"))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bps.models.models import Formula
+from bps.models.models_workflow import PlanningSession
+from bps.views.formula_runner import BACKENDS, run_formula_parallel
+
+
+class Command(BaseCommand):
+    help = "Run a formula for every planning session of its layout, in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--formula", type=int, required=True)
+        parser.add_argument("--period", default="01", help="Period code, or ALL for one vectorized run")
+        parser.add_argument("--layout-year", type=int, help="Only sessions of this layout-year")
+        parser.add_argument("--workers", type=int, help="Default: BPS_FORMULA_WORKERS or CPU count")
+        parser.add_argument("--backend", choices=BACKENDS, default="process")
+        parser.add_argument("--by", choices=["session", "org_unit"], default="session")
+        parser.add_argument("--preview", action="store_true")
+        parser.add_argument("--profile", action="store_true",
+                            help="Record timings and query/row counts on each FormulaRun")
+
+    def handle(self, *args, **options):
+        try:
+            formula = Formula.objects.get(pk=options["formula"])
+        except Formula.DoesNotExist:
+            raise CommandError(f"Formula {options['formula']} not found")
+
+        sessions = PlanningSession.objects.filter(scenario__layout_year__layout=formula.layout)
+        if options["layout_year"]:
+            sessions = sessions.filter(scenario__layout_year_id=options["layout_year"])
+        sessions = sessions.order_by("pk")
+        if not sessions.exists():
+            raise CommandError("No planning sessions for this formula's layout")
+
+        result = run_formula_parallel(
+            formula, sessions, options["period"],
+            workers=options["workers"], backend=options["backend"], by=options["by"],
+            preview=options["preview"], profile=options["profile"] or None,
+        )
+        for r in result["sessions"]:
+            if r["error"]:
+                self.stderr.write(f"   ✖ session {r['session']} ({r['org_unit']}): {r['error']}")
+            else:
+                self.stdout.write(f"   ● session {r['session']} ({r['org_unit']}): "
+                                  f"{r['entries']} entries in {r['seconds']}s")
+        style = self.style.SUCCESS if not result["failed"] else self.style.WARNING
+        self.stdout.write(style(
+            f"✅ {result['ok']} session(s) ok, {result['failed']} failed, {result['entries']} entries, "
+            f"{result['seconds']}s on {result['workers']} worker(s)"
+        ))
@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from bps.models.models_workflow import PlanningScenario
+from bps.views.pipeline_runner import pipeline_groups, run_pipeline
+
+
+class Command(BaseCommand):
+    help = "Run a scenario's planning functions (ScenarioFunction order) across its sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", required=True, help="Scenario code")
+        parser.add_argument("--session", type=int, action="append", help="Only these sessions")
+        parser.add_argument("--workers", type=int, help="Concurrent workers (default BPS_PIPELINE_WORKERS)")
+        parser.add_argument("--retries", type=int, help="Retries per step (default BPS_PIPELINE_RETRIES)")
+        parser.add_argument("--continue-on-error", action="store_true",
+                            help="Run later stages even when a step failed")
+        parser.add_argument("--user", help="Username recorded as started_by")
+        parser.add_argument("--show", action="store_true", help="Print the pipeline and exit")
+
+    def handle(self, *args, **options):
+        try:
+            scenario = PlanningScenario.objects.get(code=options["scenario"])
+        except PlanningScenario.DoesNotExist:
+            raise CommandError(f"Scenario {options['scenario']} not found")
+
+        groups = pipeline_groups(scenario)
+        for stage, functions in groups:
+            mode = "parallel" if stage and stage.can_run_in_parallel else "sequential"
+            self.stdout.write(f"   {stage.code if stage else '-'} ({mode}): "
+                              + ", ".join(f"{sf.order}. {sf.function.name}" for sf in functions))
+        if options["show"] or not groups:
+            return
+
+        user = None
+        if options["user"]:
+            user = get_user_model().objects.filter(username=options["user"]).first()
+        sessions = scenario.sessions.all()
+        if options["session"]:
+            sessions = sessions.filter(pk__in=options["session"])
+        run = run_pipeline(scenario, sessions=sessions, workers=options["workers"],
+                           retries=options["retries"], user=user,
+                           continue_on_error=options["continue_on_error"])
+        for step in run.steps:
+            if step.get("error"):
+                self.stderr.write(f"   ❌ {step['function']} @ {step['org_unit']}: {step['error']} "
+                                  f"({step['attempts']} attempt(s))")
+        style = self.style.SUCCESS if run.status == run.Status.SUCCEEDED else self.style.WARNING
+        self.stdout.write(style(
+            f"{'✅' if run.status == run.Status.SUCCEEDED else '⚠️'} pipeline #{run.pk} {run.status}: "
+            f"{run.steps_ok} ok, {run.steps_failed} failed, {run.steps_skipped} skipped "
+            f"on {run.workers} worker(s) in {run.seconds:.2f}s"
+        ))
@@ -0,0 +1,52 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from bps.utils.job_queue import work, worker_name
+
+
+def _child(stop, poll, burst):
+    # the parent handles Ctrl-C / SIGTERM and sets `stop`; children finish their job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    work(stop, poll=poll, burst=burst, name=worker_name())
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (bps_job table) in N worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", "-n", type=int, default=1)
+        parser.add_argument("--poll", type=float, help="Seconds between polls of an empty queue "
+                                                       "(default BPS_JOB_POLL_SECONDS)")
+        parser.add_argument("--burst", action="store_true", help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        n = max(1, options["processes"])
+        ctx = multiprocessing.get_context("fork")
+        stop = ctx.Event() if n > 1 else threading.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping workers after their current job…")
+            stop.set()
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        if n == 1:
+            done = work(stop, poll=options["poll"], burst=options["burst"])
+            self.stdout.write(self.style.SUCCESS(f"✅ {done} job(s) run"))
+            return
+
+        # forked children must open their own connections
+        connections.close_all()
+        procs = [ctx.Process(target=_child, args=(stop, options["poll"], options["burst"]),
+                             name=f"bps-worker-{i}") for i in range(n)]
+        for p in procs:
+            p.start()
+        self.stdout.write(f"🚀 {n} worker process(es) started")
+        for p in procs:
+            p.join()
+        self.stdout.write(self.style.SUCCESS("✅ workers stopped"))
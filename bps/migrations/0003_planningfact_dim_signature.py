@@ -0,0 +1,79 @@
+# Generated by Django 5.2.5 on 2025-08-25 09:12
+
+from django.db import migrations, models
+
+# Frozen copy of models_extras.SIGNATURE_SQL at the time of this migration.
+BACKFILL_SQL = """
+UPDATE bps_planningfact f SET dim_signature = md5(coalesce((
+    SELECT string_agg(e.key_id::text || ':' || e.object_id::text, '|' ORDER BY e.key_id)
+      FROM bps_planningfactextra e
+     WHERE e.fact_id = f.id
+), ''));
+"""
+
+# Keep the newest fact of every duplicated cell; dependants go first because
+# Django's CASCADE is emulated in Python, not declared in the database.
+# FK checks run immediately so no trigger events are left pending for the
+# ALTER TABLE that adds the constraint.
+DEDUPE_SQL = """
+SET CONSTRAINTS ALL IMMEDIATE;
+
+CREATE TEMP TABLE bps_dup_facts ON COMMIT DROP AS
+SELECT id FROM (
+    SELECT id, row_number() OVER (
+        PARTITION BY session_id, period_id, key_figure_id, org_unit_id,
+                     service_id, account_id, dim_signature
+        ORDER BY id DESC
+    ) AS rn
+    FROM bps_planningfact
+) ranked
+WHERE rn > 1;
+
+DELETE FROM bps_planningfactextra     WHERE fact_id   IN (SELECT id FROM bps_dup_facts);
+DELETE FROM bps_planningfactdimension WHERE fact_id   IN (SELECT id FROM bps_dup_facts);
+DELETE FROM bps_datarequestlog        WHERE fact_id   IN (SELECT id FROM bps_dup_facts);
+DELETE FROM bps_formularunentry       WHERE record_id IN (SELECT id FROM bps_dup_facts);
+DELETE FROM bps_planningfact          WHERE id        IN (SELECT id FROM bps_dup_facts);
+
+SET CONSTRAINTS ALL DEFERRED;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bps", "0002_dimensionkey_is_active"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="planningfact",
+            name="dim_signature",
+            field=models.CharField(
+                default="d41d8cd98f00b204e9800998ecf8427e",
+                editable=False,
+                max_length=32,
+            ),
+        ),
+        migrations.RunSQL(
+            sql=BACKFILL_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(sql=DEDUPE_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name="planningfact",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "session",
+                    "period",
+                    "key_figure",
+                    "org_unit",
+                    "service",
+                    "account",
+                    "dim_signature",
+                ),
+                name="uniq_fact_cell",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
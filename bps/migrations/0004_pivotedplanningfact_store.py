@@ -0,0 +1,268 @@
+# Generated by Django 5.2.5 on 2025-09-02 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Frozen copy of the pivot maintenance objects; keep in sync with
+# bps.models.models_view.pivot_select_sql() when changing columns.
+CELL_TYPE_SQL = """
+CREATE TYPE bps_pivot_cell AS (
+    session_id    bigint,
+    org_unit_id   bigint,
+    service_id    bigint,
+    account_id    bigint,
+    key_figure_id bigint,
+    dim_signature varchar(32)
+);
+"""
+
+REFRESH_SQL = """
+CREATE OR REPLACE FUNCTION bps_pivot_refresh(cells bps_pivot_cell[]) RETURNS void
+LANGUAGE sql AS $$
+    DELETE FROM pivoted_planningfact p
+    USING unnest(cells) c
+    WHERE p.session_id = c.session_id
+      AND p.org_unit_id = c.org_unit_id
+      AND p.key_figure_id = c.key_figure_id
+      AND p.dim_signature = c.dim_signature
+      AND p.service_id IS NOT DISTINCT FROM c.service_id
+      AND p.account_id IS NOT DISTINCT FROM c.account_id;
+
+    INSERT INTO pivoted_planningfact (session_id, org_unit_id, service_id, account_id, key_figure_id, dim_signature, version_id, year_id, extras, v01, v02, v03, v04, v05, v06, v07, v08, v09, v10, v11, v12, r01, r02, r03, r04, r05, r06, r07, r08, r09, r10, r11, r12, year_value, year_reference, total_value, total_reference)
+    SELECT g.session_id, g.org_unit_id, g.service_id, g.account_id, g.key_figure_id, g.dim_signature, g.version_id, g.year_id,
+           coalesce((SELECT jsonb_object_agg(lower(dk.key), e.object_id)
+                     FROM bps_planningfactextra e
+                     JOIN bps_dimensionkey dk ON dk.id = e.key_id
+                     WHERE e.fact_id = g.any_fact_id), '{}'::jsonb),
+           g.v01, g.v02, g.v03, g.v04, g.v05, g.v06, g.v07, g.v08, g.v09, g.v10, g.v11, g.v12, g.r01, g.r02, g.r03, g.r04, g.r05, g.r06, g.r07, g.r08, g.r09, g.r10, g.r11, g.r12, g.year_value, g.year_reference, g.total_value, g.total_reference
+    FROM (
+        SELECT f.session_id, f.org_unit_id, f.service_id, f.account_id, f.key_figure_id, f.dim_signature,
+               max(f.version_id) AS version_id, max(f.year_id) AS year_id, min(f.id) AS any_fact_id,
+               sum(f.value) FILTER (WHERE per.code = '01') AS v01,
+               sum(f.value) FILTER (WHERE per.code = '02') AS v02,
+               sum(f.value) FILTER (WHERE per.code = '03') AS v03,
+               sum(f.value) FILTER (WHERE per.code = '04') AS v04,
+               sum(f.value) FILTER (WHERE per.code = '05') AS v05,
+               sum(f.value) FILTER (WHERE per.code = '06') AS v06,
+               sum(f.value) FILTER (WHERE per.code = '07') AS v07,
+               sum(f.value) FILTER (WHERE per.code = '08') AS v08,
+               sum(f.value) FILTER (WHERE per.code = '09') AS v09,
+               sum(f.value) FILTER (WHERE per.code = '10') AS v10,
+               sum(f.value) FILTER (WHERE per.code = '11') AS v11,
+               sum(f.value) FILTER (WHERE per.code = '12') AS v12,
+               sum(f.ref_value) FILTER (WHERE per.code = '01') AS r01,
+               sum(f.ref_value) FILTER (WHERE per.code = '02') AS r02,
+               sum(f.ref_value) FILTER (WHERE per.code = '03') AS r03,
+               sum(f.ref_value) FILTER (WHERE per.code = '04') AS r04,
+               sum(f.ref_value) FILTER (WHERE per.code = '05') AS r05,
+               sum(f.ref_value) FILTER (WHERE per.code = '06') AS r06,
+               sum(f.ref_value) FILTER (WHERE per.code = '07') AS r07,
+               sum(f.ref_value) FILTER (WHERE per.code = '08') AS r08,
+               sum(f.ref_value) FILTER (WHERE per.code = '09') AS r09,
+               sum(f.ref_value) FILTER (WHERE per.code = '10') AS r10,
+               sum(f.ref_value) FILTER (WHERE per.code = '11') AS r11,
+               sum(f.ref_value) FILTER (WHERE per.code = '12') AS r12,
+               sum(f.value)     FILTER (WHERE f.period_id IS NULL)     AS year_value,
+               sum(f.ref_value) FILTER (WHERE f.period_id IS NULL)     AS year_reference,
+               sum(f.value)     FILTER (WHERE f.period_id IS NOT NULL) AS total_value,
+               sum(f.ref_value) FILTER (WHERE f.period_id IS NOT NULL) AS total_reference
+        FROM (SELECT DISTINCT * FROM unnest(cells)) c
+        JOIN bps_planningfact f
+          ON f.session_id = c.session_id
+         AND f.org_unit_id = c.org_unit_id
+         AND f.key_figure_id = c.key_figure_id
+         AND f.dim_signature = c.dim_signature
+         AND f.service_id IS NOT DISTINCT FROM c.service_id
+         AND f.account_id IS NOT DISTINCT FROM c.account_id
+        LEFT JOIN bps_period per ON per.id = f.period_id
+        GROUP BY f.session_id, f.org_unit_id, f.service_id, f.account_id, f.key_figure_id, f.dim_signature
+    ) g;
+$$;
+"""
+
+TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION bps_pivot_sync_facts() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bps_pivot_refresh(ARRAY(
+            SELECT DISTINCT ROW(n.session_id, n.org_unit_id, n.service_id, n.account_id,
+                                n.key_figure_id, n.dim_signature)::bps_pivot_cell
+            FROM new_rows n));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM bps_pivot_refresh(ARRAY(
+            SELECT DISTINCT ROW(o.session_id, o.org_unit_id, o.service_id, o.account_id,
+                                o.key_figure_id, o.dim_signature)::bps_pivot_cell
+            FROM old_rows o));
+    ELSE
+        -- only rows whose cell or values moved; request-only updates (re-post) are skipped
+        PERFORM bps_pivot_refresh(ARRAY(
+            SELECT DISTINCT x.cell FROM (
+                SELECT ROW(o.session_id, o.org_unit_id, o.service_id, o.account_id,
+                           o.key_figure_id, o.dim_signature)::bps_pivot_cell AS cell
+                FROM old_rows o JOIN new_rows n ON n.id = o.id
+                WHERE (o.session_id, o.org_unit_id, o.service_id, o.account_id, o.key_figure_id,
+                       o.dim_signature, o.period_id, o.version_id, o.year_id, o.value, o.ref_value)
+                      IS DISTINCT FROM
+                      (n.session_id, n.org_unit_id, n.service_id, n.account_id, n.key_figure_id,
+                       n.dim_signature, n.period_id, n.version_id, n.year_id, n.value, n.ref_value)
+                UNION ALL
+                SELECT ROW(n.session_id, n.org_unit_id, n.service_id, n.account_id,
+                           n.key_figure_id, n.dim_signature)::bps_pivot_cell
+                FROM old_rows o JOIN new_rows n ON n.id = o.id
+                WHERE (o.session_id, o.org_unit_id, o.service_id, o.account_id, o.key_figure_id,
+                       o.dim_signature, o.period_id, o.version_id, o.year_id, o.value, o.ref_value)
+                      IS DISTINCT FROM
+                      (n.session_id, n.org_unit_id, n.service_id, n.account_id, n.key_figure_id,
+                       n.dim_signature, n.period_id, n.version_id, n.year_id, n.value, n.ref_value)
+            ) x));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION bps_pivot_sync_extras() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bps_pivot_refresh(ARRAY(
+            SELECT DISTINCT ROW(f.session_id, f.org_unit_id, f.service_id, f.account_id,
+                                f.key_figure_id, f.dim_signature)::bps_pivot_cell
+            FROM new_rows e JOIN bps_planningfact f ON f.id = e.fact_id));
+    ELSE
+        PERFORM bps_pivot_refresh(ARRAY(
+            SELECT DISTINCT ROW(f.session_id, f.org_unit_id, f.service_id, f.account_id,
+                                f.key_figure_id, f.dim_signature)::bps_pivot_cell
+            FROM old_rows e JOIN bps_planningfact f ON f.id = e.fact_id));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION bps_pivot_truncate() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE pivoted_planningfact;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER bps_pivot_facts_ins AFTER INSERT ON bps_planningfact
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_pivot_sync_facts();
+CREATE TRIGGER bps_pivot_facts_upd AFTER UPDATE ON bps_planningfact
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_pivot_sync_facts();
+CREATE TRIGGER bps_pivot_facts_del AFTER DELETE ON bps_planningfact
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_pivot_sync_facts();
+CREATE TRIGGER bps_pivot_facts_trunc AFTER TRUNCATE ON bps_planningfact
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_pivot_truncate();
+
+CREATE TRIGGER bps_pivot_extras_ins AFTER INSERT ON bps_planningfactextra
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_pivot_sync_extras();
+CREATE TRIGGER bps_pivot_extras_del AFTER DELETE ON bps_planningfactextra
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_pivot_sync_extras();
+"""
+
+DROP_SQL = """
+DROP TRIGGER IF EXISTS bps_pivot_extras_del ON bps_planningfactextra;
+DROP TRIGGER IF EXISTS bps_pivot_extras_ins ON bps_planningfactextra;
+DROP TRIGGER IF EXISTS bps_pivot_facts_trunc ON bps_planningfact;
+DROP TRIGGER IF EXISTS bps_pivot_facts_del ON bps_planningfact;
+DROP TRIGGER IF EXISTS bps_pivot_facts_upd ON bps_planningfact;
+DROP TRIGGER IF EXISTS bps_pivot_facts_ins ON bps_planningfact;
+DROP FUNCTION IF EXISTS bps_pivot_truncate();
+DROP FUNCTION IF EXISTS bps_pivot_sync_extras();
+DROP FUNCTION IF EXISTS bps_pivot_sync_facts();
+DROP FUNCTION IF EXISTS bps_pivot_refresh(bps_pivot_cell[]);
+DROP TYPE IF EXISTS bps_pivot_cell;
+"""
+
+# initial load: every cell of every session
+BACKFILL_SQL = """
+SELECT bps_pivot_refresh(ARRAY(
+    SELECT DISTINCT ROW(session_id, org_unit_id, service_id, account_id,
+                        key_figure_id, dim_signature)::bps_pivot_cell
+    FROM bps_planningfact));
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0003_planningfact_dim_signature'),
+    ]
+
+    operations = [
+        # the old definition was an unmanaged model over a (never enabled) view
+        migrations.DeleteModel(
+            name='PivotedPlanningFact',
+        ),
+        migrations.RunSQL(
+            "DROP VIEW IF EXISTS pivoted_planningfact;",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.CreateModel(
+            name='PivotedPlanningFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dim_signature', models.CharField(max_length=32)),
+                ('extras', models.JSONField(default=dict)),
+                ('v01', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v02', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v03', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v04', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v05', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v06', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v07', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v08', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v09', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v10', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v11', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('v12', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r01', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r02', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r03', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r04', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r05', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r06', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r07', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r08', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r09', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r10', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r11', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('r12', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('year_value', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('year_reference', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('total_value', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('total_reference', models.DecimalField(blank=True, decimal_places=2, max_digits=18, null=True)),
+                ('account', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.account')),
+                ('key_figure', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.keyfigure')),
+                ('org_unit', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.orgunit')),
+                ('service', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.service')),
+                ('session', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.planningsession')),
+                ('version', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.version')),
+                ('year', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.year')),
+            ],
+            options={
+                'db_table': 'pivoted_planningfact',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pivotedplanningfact',
+            index=models.Index(fields=['version', 'year'], name='pivoted_pla_version_75bb91_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='pivotedplanningfact',
+            constraint=models.UniqueConstraint(fields=('session', 'org_unit', 'key_figure', 'dim_signature', 'service', 'account'), name='uniq_pivot_cell', nulls_distinct=False),
+        ),
+        migrations.RunSQL(
+            CELL_TYPE_SQL + REFRESH_SQL + TRIGGERS_SQL,
+            reverse_sql=DROP_SQL,
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
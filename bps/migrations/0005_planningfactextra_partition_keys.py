@@ -0,0 +1,59 @@
+# Generated by Django 5.2.5 on 2025-09-08 14:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BACKFILL_SQL = """
+UPDATE bps_planningfactextra e
+   SET year_id = f.year_id,
+       version_id = f.version_id
+  FROM bps_planningfact f
+ WHERE f.id = e.fact_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0004_pivotedplanningfact_store'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='planningfact',
+            name='uniq_fact_cell',
+        ),
+        migrations.RemoveConstraint(
+            model_name='planningfactextra',
+            name='uniq_fact_key',
+        ),
+        migrations.AddField(
+            model_name='planningfactextra',
+            name='version',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='bps.version'),
+        ),
+        migrations.AddField(
+            model_name='planningfactextra',
+            name='year',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='bps.year'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='planningfactextra',
+            name='version',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='bps.version'),
+        ),
+        migrations.AlterField(
+            model_name='planningfactextra',
+            name='year',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='bps.year'),
+        ),
+        migrations.AddConstraint(
+            model_name='planningfact',
+            constraint=models.UniqueConstraint(fields=('session', 'period', 'key_figure', 'org_unit', 'service', 'account', 'dim_signature', 'year', 'version'), name='uniq_fact_cell', nulls_distinct=False),
+        ),
+        migrations.AddConstraint(
+            model_name='planningfactextra',
+            constraint=models.UniqueConstraint(fields=('fact', 'key', 'year', 'version'), name='uniq_fact_key'),
+        ),
+    ]
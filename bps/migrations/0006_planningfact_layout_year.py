@@ -0,0 +1,123 @@
+# Generated by Django 5.2.5 on 2025-09-10 08:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BACKFILL_FACTS_SQL = """
+UPDATE bps_planningfact f
+   SET layout_year_id = sc.layout_year_id
+  FROM bps_planningsession s
+  JOIN bps_planningscenario sc ON sc.id = s.scenario_id
+ WHERE s.id = f.session_id
+   AND f.layout_year_id IS NULL;
+"""
+
+BACKFILL_PIVOT_SQL = """
+UPDATE pivoted_planningfact p
+   SET layout_year_id = sc.layout_year_id
+  FROM bps_planningsession s
+  JOIN bps_planningscenario sc ON sc.id = s.scenario_id
+ WHERE s.id = p.session_id;
+"""
+
+# Frozen copy of bps_pivot_refresh with the layout_year_id column
+# (bps.models.models_view.pivot_select_sql at the time of this migration).
+REFRESH_SQL = """
+CREATE OR REPLACE FUNCTION bps_pivot_refresh(cells bps_pivot_cell[]) RETURNS void
+LANGUAGE sql AS $$
+    DELETE FROM pivoted_planningfact p
+    USING unnest(cells) c
+    WHERE p.session_id = c.session_id
+      AND p.org_unit_id = c.org_unit_id
+      AND p.key_figure_id = c.key_figure_id
+      AND p.dim_signature = c.dim_signature
+      AND p.service_id IS NOT DISTINCT FROM c.service_id
+      AND p.account_id IS NOT DISTINCT FROM c.account_id;
+
+    INSERT INTO pivoted_planningfact (session_id, org_unit_id, service_id, account_id, key_figure_id, dim_signature, version_id, year_id, layout_year_id, extras, v01, v02, v03, v04, v05, v06, v07, v08, v09, v10, v11, v12, r01, r02, r03, r04, r05, r06, r07, r08, r09, r10, r11, r12, year_value, year_reference, total_value, total_reference)
+    SELECT g.session_id, g.org_unit_id, g.service_id, g.account_id, g.key_figure_id, g.dim_signature, g.version_id, g.year_id,
+           (SELECT sc.layout_year_id
+              FROM bps_planningsession s
+              JOIN bps_planningscenario sc ON sc.id = s.scenario_id
+             WHERE s.id = g.session_id),
+           coalesce((SELECT jsonb_object_agg(lower(dk.key), e.object_id)
+                     FROM bps_planningfactextra e
+                     JOIN bps_dimensionkey dk ON dk.id = e.key_id
+                     WHERE e.fact_id = g.any_fact_id), '{}'::jsonb),
+           g.v01, g.v02, g.v03, g.v04, g.v05, g.v06, g.v07, g.v08, g.v09, g.v10, g.v11, g.v12, g.r01, g.r02, g.r03, g.r04, g.r05, g.r06, g.r07, g.r08, g.r09, g.r10, g.r11, g.r12, g.year_value, g.year_reference, g.total_value, g.total_reference
+    FROM (
+        SELECT f.session_id, f.org_unit_id, f.service_id, f.account_id, f.key_figure_id, f.dim_signature,
+               max(f.version_id) AS version_id, max(f.year_id) AS year_id, min(f.id) AS any_fact_id,
+               sum(f.value) FILTER (WHERE per.code = '01') AS v01,
+               sum(f.value) FILTER (WHERE per.code = '02') AS v02,
+               sum(f.value) FILTER (WHERE per.code = '03') AS v03,
+               sum(f.value) FILTER (WHERE per.code = '04') AS v04,
+               sum(f.value) FILTER (WHERE per.code = '05') AS v05,
+               sum(f.value) FILTER (WHERE per.code = '06') AS v06,
+               sum(f.value) FILTER (WHERE per.code = '07') AS v07,
+               sum(f.value) FILTER (WHERE per.code = '08') AS v08,
+               sum(f.value) FILTER (WHERE per.code = '09') AS v09,
+               sum(f.value) FILTER (WHERE per.code = '10') AS v10,
+               sum(f.value) FILTER (WHERE per.code = '11') AS v11,
+               sum(f.value) FILTER (WHERE per.code = '12') AS v12,
+               sum(f.ref_value) FILTER (WHERE per.code = '01') AS r01,
+               sum(f.ref_value) FILTER (WHERE per.code = '02') AS r02,
+               sum(f.ref_value) FILTER (WHERE per.code = '03') AS r03,
+               sum(f.ref_value) FILTER (WHERE per.code = '04') AS r04,
+               sum(f.ref_value) FILTER (WHERE per.code = '05') AS r05,
+               sum(f.ref_value) FILTER (WHERE per.code = '06') AS r06,
+               sum(f.ref_value) FILTER (WHERE per.code = '07') AS r07,
+               sum(f.ref_value) FILTER (WHERE per.code = '08') AS r08,
+               sum(f.ref_value) FILTER (WHERE per.code = '09') AS r09,
+               sum(f.ref_value) FILTER (WHERE per.code = '10') AS r10,
+               sum(f.ref_value) FILTER (WHERE per.code = '11') AS r11,
+               sum(f.ref_value) FILTER (WHERE per.code = '12') AS r12,
+               sum(f.value)     FILTER (WHERE f.period_id IS NULL)     AS year_value,
+               sum(f.ref_value) FILTER (WHERE f.period_id IS NULL)     AS year_reference,
+               sum(f.value)     FILTER (WHERE f.period_id IS NOT NULL) AS total_value,
+               sum(f.ref_value) FILTER (WHERE f.period_id IS NOT NULL) AS total_reference
+        FROM (SELECT DISTINCT * FROM unnest(cells)) c
+        JOIN bps_planningfact f
+          ON f.session_id = c.session_id
+         AND f.org_unit_id = c.org_unit_id
+         AND f.key_figure_id = c.key_figure_id
+         AND f.dim_signature = c.dim_signature
+         AND f.service_id IS NOT DISTINCT FROM c.service_id
+         AND f.account_id IS NOT DISTINCT FROM c.account_id
+        LEFT JOIN bps_period per ON per.id = f.period_id
+        GROUP BY f.session_id, f.org_unit_id, f.service_id, f.account_id, f.key_figure_id, f.dim_signature
+    ) g;
+$$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0005_planningfactextra_partition_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='planningfact',
+            name='layout_year',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='facts', to='bps.planninglayoutyear'),
+        ),
+        # request/layout_year-only updates do not touch the pivot triggers' cell columns
+        migrations.RunSQL(BACKFILL_FACTS_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='planningfact',
+            index=models.Index(fields=['layout_year', 'org_unit', 'period', 'key_figure'], name='bps_fact_ly_org_per_kf_idx'),
+        ),
+        migrations.AddField(
+            model_name='pivotedplanningfact',
+            name='layout_year',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.planninglayoutyear'),
+        ),
+        migrations.RunSQL(BACKFILL_PIVOT_SQL, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='pivotedplanningfact',
+            index=models.Index(fields=['layout_year', 'org_unit'], name='pivoted_pla_ly_org_idx'),
+        ),
+        migrations.RunSQL(REFRESH_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.2.5 on 2025-09-11 10:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+STAMP_SQL = """
+CREATE OR REPLACE FUNCTION bps_touch_sessions(ids bigint[]) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO bps_factchangestamp (session_id, layout_year_id, counter, changed_at)
+    SELECT s.id, sc.layout_year_id, 1, now()
+      FROM bps_planningsession s
+      JOIN bps_planningscenario sc ON sc.id = s.scenario_id
+     WHERE s.id = ANY(ids)
+     ORDER BY s.id  -- fixed lock order for concurrent writers
+    ON CONFLICT (session_id) DO UPDATE
+       SET counter = bps_factchangestamp.counter + 1,
+           changed_at = EXCLUDED.changed_at,
+           layout_year_id = EXCLUDED.layout_year_id;
+$$;
+
+CREATE OR REPLACE FUNCTION bps_stamp_facts() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bps_touch_sessions(ARRAY(SELECT DISTINCT session_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM bps_touch_sessions(ARRAY(SELECT DISTINCT session_id FROM old_rows));
+    ELSE
+        PERFORM bps_touch_sessions(ARRAY(
+            SELECT session_id FROM old_rows UNION SELECT session_id FROM new_rows));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION bps_stamp_extras() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bps_touch_sessions(ARRAY(
+            SELECT DISTINCT f.session_id FROM new_rows e JOIN bps_planningfact f ON f.id = e.fact_id));
+    ELSE
+        PERFORM bps_touch_sessions(ARRAY(
+            SELECT DISTINCT f.session_id FROM old_rows e JOIN bps_planningfact f ON f.id = e.fact_id));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION bps_stamp_truncate() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE bps_factchangestamp SET counter = counter + 1, changed_at = now();
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER bps_stamp_facts_ins AFTER INSERT ON bps_planningfact
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_stamp_facts();
+CREATE TRIGGER bps_stamp_facts_upd AFTER UPDATE ON bps_planningfact
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_stamp_facts();
+CREATE TRIGGER bps_stamp_facts_del AFTER DELETE ON bps_planningfact
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_stamp_facts();
+CREATE TRIGGER bps_stamp_facts_trunc AFTER TRUNCATE ON bps_planningfact
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_stamp_truncate();
+
+CREATE TRIGGER bps_stamp_extras_ins AFTER INSERT ON bps_planningfactextra
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_stamp_extras();
+CREATE TRIGGER bps_stamp_extras_del AFTER DELETE ON bps_planningfactextra
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bps_stamp_extras();
+"""
+
+DROP_SQL = """
+DROP TRIGGER IF EXISTS bps_stamp_extras_del ON bps_planningfactextra;
+DROP TRIGGER IF EXISTS bps_stamp_extras_ins ON bps_planningfactextra;
+DROP TRIGGER IF EXISTS bps_stamp_facts_trunc ON bps_planningfact;
+DROP TRIGGER IF EXISTS bps_stamp_facts_del ON bps_planningfact;
+DROP TRIGGER IF EXISTS bps_stamp_facts_upd ON bps_planningfact;
+DROP TRIGGER IF EXISTS bps_stamp_facts_ins ON bps_planningfact;
+DROP FUNCTION IF EXISTS bps_stamp_truncate();
+DROP FUNCTION IF EXISTS bps_stamp_extras();
+DROP FUNCTION IF EXISTS bps_stamp_facts();
+DROP FUNCTION IF EXISTS bps_touch_sessions(bigint[]);
+"""
+
+# one stamp per existing session
+BACKFILL_SQL = "SELECT bps_touch_sessions(ARRAY(SELECT id FROM bps_planningsession));"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0006_planningfact_layout_year'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FactChangeStamp',
+            fields=[
+                ('session', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='bps.planningsession')),
+                ('counter', models.BigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField()),
+                ('layout_year', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.planninglayoutyear')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='factchangestamp',
+            index=models.Index(fields=['layout_year', 'changed_at'], name='bps_stamp_ly_changed_idx'),
+        ),
+        migrations.RunSQL(STAMP_SQL, reverse_sql=DROP_SQL),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,156 @@
+# Generated by Django 5.2.5 on 2025-09-12 09:24
+
+from importlib import import_module
+
+import django.db.models.deletion
+import django.db.models.expressions
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+# bps_pivot_refresh as in 0006, with the DELETE tombstoning the grid row keys
+# it removes (frozen copy; see bps.models.models_view).
+REFRESH_SQL = """
+CREATE OR REPLACE FUNCTION bps_pivot_refresh(cells bps_pivot_cell[]) RETURNS void
+LANGUAGE sql AS $$
+    WITH gone AS (
+        DELETE FROM pivoted_planningfact p
+        USING unnest(cells) c
+        WHERE p.session_id = c.session_id
+          AND p.org_unit_id = c.org_unit_id
+          AND p.key_figure_id = c.key_figure_id
+          AND p.dim_signature = c.dim_signature
+          AND p.service_id IS NOT DISTINCT FROM c.service_id
+          AND p.account_id IS NOT DISTINCT FROM c.account_id
+        RETURNING p.layout_year_id, p.org_unit_id, p.service_id, p.extras
+    )
+    INSERT INTO bps_pivottombstone (layout_year_id, org_unit_id, service_id, extras)
+    SELECT DISTINCT layout_year_id, org_unit_id, service_id, extras FROM gone;
+
+    INSERT INTO pivoted_planningfact (session_id, org_unit_id, service_id, account_id, key_figure_id, dim_signature, version_id, year_id, layout_year_id, extras, v01, v02, v03, v04, v05, v06, v07, v08, v09, v10, v11, v12, r01, r02, r03, r04, r05, r06, r07, r08, r09, r10, r11, r12, year_value, year_reference, total_value, total_reference)
+    SELECT g.session_id, g.org_unit_id, g.service_id, g.account_id, g.key_figure_id, g.dim_signature, g.version_id, g.year_id,
+           (SELECT sc.layout_year_id
+              FROM bps_planningsession s
+              JOIN bps_planningscenario sc ON sc.id = s.scenario_id
+             WHERE s.id = g.session_id),
+           coalesce((SELECT jsonb_object_agg(lower(dk.key), e.object_id)
+                     FROM bps_planningfactextra e
+                     JOIN bps_dimensionkey dk ON dk.id = e.key_id
+                     WHERE e.fact_id = g.any_fact_id), '{}'::jsonb),
+           g.v01, g.v02, g.v03, g.v04, g.v05, g.v06, g.v07, g.v08, g.v09, g.v10, g.v11, g.v12, g.r01, g.r02, g.r03, g.r04, g.r05, g.r06, g.r07, g.r08, g.r09, g.r10, g.r11, g.r12, g.year_value, g.year_reference, g.total_value, g.total_reference
+    FROM (
+        SELECT f.session_id, f.org_unit_id, f.service_id, f.account_id, f.key_figure_id, f.dim_signature,
+               max(f.version_id) AS version_id, max(f.year_id) AS year_id, min(f.id) AS any_fact_id,
+               sum(f.value) FILTER (WHERE per.code = '01') AS v01,
+               sum(f.value) FILTER (WHERE per.code = '02') AS v02,
+               sum(f.value) FILTER (WHERE per.code = '03') AS v03,
+               sum(f.value) FILTER (WHERE per.code = '04') AS v04,
+               sum(f.value) FILTER (WHERE per.code = '05') AS v05,
+               sum(f.value) FILTER (WHERE per.code = '06') AS v06,
+               sum(f.value) FILTER (WHERE per.code = '07') AS v07,
+               sum(f.value) FILTER (WHERE per.code = '08') AS v08,
+               sum(f.value) FILTER (WHERE per.code = '09') AS v09,
+               sum(f.value) FILTER (WHERE per.code = '10') AS v10,
+               sum(f.value) FILTER (WHERE per.code = '11') AS v11,
+               sum(f.value) FILTER (WHERE per.code = '12') AS v12,
+               sum(f.ref_value) FILTER (WHERE per.code = '01') AS r01,
+               sum(f.ref_value) FILTER (WHERE per.code = '02') AS r02,
+               sum(f.ref_value) FILTER (WHERE per.code = '03') AS r03,
+               sum(f.ref_value) FILTER (WHERE per.code = '04') AS r04,
+               sum(f.ref_value) FILTER (WHERE per.code = '05') AS r05,
+               sum(f.ref_value) FILTER (WHERE per.code = '06') AS r06,
+               sum(f.ref_value) FILTER (WHERE per.code = '07') AS r07,
+               sum(f.ref_value) FILTER (WHERE per.code = '08') AS r08,
+               sum(f.ref_value) FILTER (WHERE per.code = '09') AS r09,
+               sum(f.ref_value) FILTER (WHERE per.code = '10') AS r10,
+               sum(f.ref_value) FILTER (WHERE per.code = '11') AS r11,
+               sum(f.ref_value) FILTER (WHERE per.code = '12') AS r12,
+               sum(f.value)     FILTER (WHERE f.period_id IS NULL)     AS year_value,
+               sum(f.ref_value) FILTER (WHERE f.period_id IS NULL)     AS year_reference,
+               sum(f.value)     FILTER (WHERE f.period_id IS NOT NULL) AS total_value,
+               sum(f.ref_value) FILTER (WHERE f.period_id IS NOT NULL) AS total_reference
+        FROM (SELECT DISTINCT * FROM unnest(cells)) c
+        JOIN bps_planningfact f
+          ON f.session_id = c.session_id
+         AND f.org_unit_id = c.org_unit_id
+         AND f.key_figure_id = c.key_figure_id
+         AND f.dim_signature = c.dim_signature
+         AND f.service_id IS NOT DISTINCT FROM c.service_id
+         AND f.account_id IS NOT DISTINCT FROM c.account_id
+        LEFT JOIN bps_period per ON per.id = f.period_id
+        GROUP BY f.session_id, f.org_unit_id, f.service_id, f.account_id, f.key_figure_id, f.dim_signature
+    ) g;
+$$;
+
+CREATE OR REPLACE FUNCTION bps_pivot_truncate() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE pivoted_planningfact;
+    INSERT INTO bps_pivottombstone (layout_year_id, extras) VALUES (NULL, '{}');
+    RETURN NULL;
+END
+$$;
+"""
+
+# previous bodies, restored on reverse
+REVERT_SQL = import_module('bps.migrations.0006_planningfact_layout_year').REFRESH_SQL + """
+CREATE OR REPLACE FUNCTION bps_pivot_truncate() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE pivoted_planningfact;
+    RETURN NULL;
+END
+$$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0007_factchangestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PivotTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('txid', models.BigIntegerField(db_default=django.db.models.expressions.RawSQL('pg_current_xact_id()::text::bigint', []))),
+                ('extras', models.JSONField(default=dict)),
+                ('deleted_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pivotedplanningfact',
+            name='txid',
+            field=models.BigIntegerField(db_default=django.db.models.expressions.RawSQL('pg_current_xact_id()::text::bigint', []), editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='pivotedplanningfact',
+            index=models.Index(fields=['layout_year', 'txid'], name='pivoted_pla_ly_txid_idx'),
+        ),
+        migrations.AddField(
+            model_name='pivottombstone',
+            name='layout_year',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.planninglayoutyear'),
+        ),
+        migrations.AddField(
+            model_name='pivottombstone',
+            name='org_unit',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.orgunit'),
+        ),
+        migrations.AddField(
+            model_name='pivottombstone',
+            name='service',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bps.service'),
+        ),
+        migrations.AddIndex(
+            model_name='pivottombstone',
+            index=models.Index(fields=['layout_year', 'txid'], name='bps_tomb_ly_txid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pivottombstone',
+            index=models.Index(fields=['deleted_at'], name='bps_tomb_deleted_idx'),
+        ),
+        # pivot_select_sql is unchanged; txid takes its column default
+        migrations.RunSQL(REFRESH_SQL, reverse_sql=REVERT_SQL),
+    ]
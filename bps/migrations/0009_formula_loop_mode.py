@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2025-09-13 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0008_pivot_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formula',
+            name='loop_mode',
+            field=models.CharField(choices=[('ALL', 'All members (cartesian product)'), ('DATA', 'Combinations present in referenced facts'), ('ALLOWED', 'Layout-year allowed values')], default='ALL', help_text="Domain of the FOREACH loop over the formula's dimensions", max_length=8),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2025-09-14 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0009_formula_loop_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formularun',
+            name='combinations',
+            field=models.PositiveIntegerField(blank=True, help_text='Loop combinations evaluated', null=True),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='profile_data',
+            field=models.BinaryField(blank=True, help_text='marshalled cProfile stats (pstats)', null=True),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='profiled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='query_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='query_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='rows_read',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='rows_written',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='slow_expressions',
+            field=models.JSONField(blank=True, default=list, help_text='Slowest sub-expressions: [{expr, calls, seconds}]'),
+        ),
+        migrations.AddField(
+            model_name='formularun',
+            name='wall_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
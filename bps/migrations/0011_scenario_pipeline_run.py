@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2025-09-15 10:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bps', '0010_formula_run_profile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scenariofunction',
+            name='stage',
+            field=models.ForeignKey(blank=True, help_text='Stage this function belongs to (pipeline grouping)', null=True, on_delete=django.db.models.deletion.SET_NULL, to='bps.planningstage'),
+        ),
+        migrations.CreateModel(
+            name='ScenarioPipelineRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('PARTIAL', 'Partially failed'), ('FAILED', 'Failed')], default='RUNNING', max_length=10)),
+                ('workers', models.PositiveSmallIntegerField(default=1)),
+                ('retries', models.PositiveSmallIntegerField(default=0)),
+                ('seconds', models.FloatField(blank=True, null=True)),
+                ('steps_ok', models.PositiveIntegerField(default=0)),
+                ('steps_failed', models.PositiveIntegerField(default=0)),
+                ('steps_skipped', models.PositiveIntegerField(default=0)),
+                ('steps', models.JSONField(blank=True, default=list)),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pipeline_runs', to='bps.planningscenario')),
+                ('started_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -1,7 +1,7 @@
 # bps/models.py
 
 from uuid import uuid4
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.contrib.postgres.fields import JSONField
 from django.shortcuts import get_object_or_404
 from django.db.models import Sum
@@ -100,6 +100,7 @@ from .models_workflow import *
 
 
 # ── 5. Fact & EAV (as before) ───────────────────────────────────────────────
+from .models_extras import EMPTY_SIGNATURE, dimension_signature
 
 class DataRequest(TimestampModel):
     ACTION_CHOICES = [
@@ -131,6 +132,9 @@ class PlanningFact(models.Model):
     """
     request     = models.ForeignKey(DataRequest, on_delete=models.PROTECT)    # move to ReqeustLogs
     session     = models.ForeignKey(PlanningSession, on_delete=models.CASCADE)
+    # denormalized session.scenario.layout_year: grid reads hit one table, no session/scenario join
+    layout_year = models.ForeignKey(PlanningLayoutYear, on_delete=models.CASCADE, null=True, blank=True,
+                                    editable=False, related_name='facts')
     version     = models.ForeignKey(Version, on_delete=models.PROTECT)
 
     year        = models.ForeignKey(Year, on_delete=models.PROTECT)
@@ -152,34 +156,71 @@ class PlanningFact(models.Model):
     ref_value   = models.DecimalField(max_digits=18, decimal_places=2, default=0)
     ref_uom     = models.ForeignKey(UnitOfMeasure, on_delete=models.PROTECT, related_name='+', null=True)
 
+    # md5 of the (key, object_id) pairs in PlanningFactExtra, see models_extras.dimension_signature
+    dim_signature = models.CharField(max_length=32, default=EMPTY_SIGNATURE, editable=False)
+
     class Meta:
         # unique_together = ('version', 'year', 'period', 'org_unit', 'service', 'account', 'key_figure', 'extra_dimensions_json')
         indexes = [
             models.Index(fields=['session','period']),
             models.Index(fields=['session','org_unit','period']),
             models.Index(fields=['key_figure']),
+            models.Index(fields=['layout_year', 'org_unit', 'period', 'key_figure'], name='bps_fact_ly_org_per_kf_idx'),
+        ]
+        constraints = [
+            # one fact per planning cell; NULL period/service/account count as a value.
+            # year/version follow from session but are part of the key so the
+            # constraint survives partitioning (bps.utils.partitioning)
+            models.UniqueConstraint(
+                fields=['session', 'period', 'key_figure', 'org_unit', 'service', 'account', 'dim_signature',
+                        'year', 'version'],
+                name='uniq_fact_cell',
+                nulls_distinct=False,
+            ),
         ]
     def __str__(self):
         return f"{self.key_figure}={self.value} | {self.service} | {self.period} | {self.org_unit}"        
 
+    def save(self, *args, **kwargs):
+        if self.layout_year_id is None and self.session_id:
+            self.layout_year_id = (
+                PlanningSession.objects.filter(pk=self.session_id)
+                .values_list("scenario__layout_year_id", flat=True).first()
+            )
+        super().save(*args, **kwargs)
+
+    def refresh_signature(self, save=True):
+        """
+        Recompute dim_signature from this fact's PlanningFactExtra rows.
+        """
+        self.dim_signature = dimension_signature(self.extras.values_list("key_id", "object_id"))
+        if save:
+            self.save(update_fields=["dim_signature"])
+        return self.dim_signature
+
     def get_value_in(self, target_uom_code):
         """
-        Return self.value converted into the unit target_uom_code.
+        Return self.value converted into the unit target_uom_code, using the
+        cached conversion matrix (direct, inverse or chained rates).
         """
-        if not self.uom:
+        from bps.utils.conversion_rates import conversion_matrix
+
+        if not self.uom_id:
             return None
-        if self.uom.code == target_uom_code:
-            return self.value
-        to_uom = UnitOfMeasure.objects.get(code=target_uom_code, is_base=True)
-        rate  = ConversionRate.objects.get(
-            from_uom=self.uom,
-            to_uom=to_uom
-        ).factor
-        return round(self.value * rate, 2)
+        rates = conversion_matrix()
+        to_uom_id = rates.by_code.get(target_uom_code)
+        if to_uom_id is None:
+            raise UnitOfMeasure.DoesNotExist(f"Unit {target_uom_code} does not exist")
+        value = rates.convert(self.value, self.uom_id, to_uom_id)
+        if value is None:
+            raise ConversionRate.DoesNotExist(
+                f"No conversion rate from {rates.codes.get(self.uom_id)} to {target_uom_code}")
+        return value
 
 # ── 6. Pivoted Planning Fact View ───────────────────────────────────────────
 from .models_view import *
 from .models_extras import *  
+from .models_jobs import *
 
 """ duplicate with extra_dimensions_json, obsolete model
 """
@@ -216,6 +257,65 @@ class DataRequestLog(TimestampModel):
         return f"{self.fact}: {self.old_value} → {self.new_value}"
 
 
+# PlanningFunction._distribute: one statement over the session's slices.
+# weight = reference amount of the cell's `by` member / cells sharing it;
+# value = target * weight / sum of weights in the slice, residue to rank 1.
+DISTRIBUTE_SQL = """
+WITH cells AS (
+    SELECT f.id, f.period_id, f.key_figure_id, f.value, {member} AS member
+    FROM bps_planningfact f
+    WHERE f.session_id = %s AND f.year_id = %s AND f.version_id = %s
+      AND f.period_id IS NOT NULL{filters}
+),
+ref AS (
+    SELECT f.period_id, f.key_figure_id, {member} AS member, SUM(f.value) AS amount
+    FROM bps_planningfact f
+    WHERE f.version_id = %s AND f.year_id = %s AND f.period_id IS NOT NULL{ref_filter}
+    GROUP BY 1, 2, 3
+),
+targets AS (
+    SELECT * FROM unnest(%s::bigint[], %s::numeric[]) AS t(period_id, amount)
+),
+weighted AS (
+    SELECT c.id, c.period_id, c.key_figure_id,
+           COALESCE(t.amount, SUM(c.value) OVER slice) AS target,
+           COALESCE(ref.amount, 0)
+             / COUNT(*) OVER (PARTITION BY c.period_id, c.key_figure_id, c.member) AS weight
+    FROM cells c
+    LEFT JOIN ref ON ref.period_id = c.period_id {ref_kf_join}
+                 AND ref.member IS NOT DISTINCT FROM c.member
+    LEFT JOIN targets t ON t.period_id = c.period_id
+    WINDOW slice AS (PARTITION BY c.period_id, c.key_figure_id)
+),
+shares AS (
+    SELECT id, period_id, key_figure_id, target,
+           round(target * weight / NULLIF(SUM(weight) OVER slice, 0), 2) AS value,
+           row_number() OVER (PARTITION BY period_id, key_figure_id ORDER BY weight DESC, id) AS rank
+    FROM weighted
+    WINDOW slice AS (PARTITION BY period_id, key_figure_id)
+),
+settled AS (
+    SELECT id, value + CASE WHEN rank = 1
+                            THEN target - SUM(value) OVER (PARTITION BY period_id, key_figure_id)
+                            ELSE 0 END AS value
+    FROM shares
+    WHERE value IS NOT NULL
+)
+UPDATE bps_planningfact f
+SET value = s.value, request_id = %s
+FROM settled s
+WHERE f.id = s.id AND f.year_id = %s AND f.version_id = %s
+"""
+
+
+# Revalue a session's facts into one unit: r holds (from_uom_id, factor) pairs.
+CURRENCY_CONVERT_SQL = """
+UPDATE bps_planningfact f
+SET value = round(f.value * r.factor, 2), uom_id = %s
+FROM unnest(%s::bigint[], %s::numeric[]) AS r(uom_id, factor)
+WHERE f.uom_id = r.uom_id AND f.session_id = %s AND f.year_id = %s AND f.version_id = %s
+"""
+
 class PlanningFunction(models.Model):
     FUNCTION_CHOICES = [
         ('COPY', 'Copy'),
@@ -224,6 +324,9 @@ class PlanningFunction(models.Model):
         ('REPOST',     'Re-Post'),   
         ('RESET_SLICE',     'Reset Slice'),    
     ]
+    # types that change values in the session they run on (COPY writes
+    # another version, REPOST only moves facts between requests)
+    RECALC_TYPES = {'DISTRIBUTE', 'CURRENCY_CONVERT', 'RESET_SLICE'}
     layout      = models.ForeignKey(PlanningLayout, on_delete=models.CASCADE)
     name        = models.CharField(max_length=50)
     function_type = models.CharField(choices=FUNCTION_CHOICES, max_length=20)
@@ -239,136 +342,176 @@ class PlanningFunction(models.Model):
     )
     def execute(self, session):
         """
-        Dispatch to the correct implementation.
+        Dispatch to the correct implementation, re-run dependent formulas,
+        then drop cached grid responses of the session's layout-year.
         """
-        if self.function_type == 'COPY':
-            return self._copy_data(session)
-        if self.function_type == 'DISTRIBUTE':
-            return self._distribute(session)
-        if self.function_type == 'REPOST':
-            return self._repost(session)        
-        if self.function_type == 'CURRENCY_CONVERT':
-            return self._currency_convert(session)
-        if self.function_type == 'RESET_SLICE':
-            return self._reset_slice(session)
-
-        # Unknown type
-        return 0
+        from bps.api.cache import invalidate_layout_year
+
+        handler = {
+            'COPY':             self._copy_data,
+            'DISTRIBUTE':       self._distribute,
+            'REPOST':           self._repost,
+            'CURRENCY_CONVERT': self._currency_convert,
+            'RESET_SLICE':      self._reset_slice,
+        }.get(self.function_type)
+        if handler is None:
+            # Unknown type
+            return 0
+        result = handler(session)
+        if self.function_type in self.RECALC_TYPES:
+            from bps.views.formula_graph import auto_recalculate
+            auto_recalculate(session.scenario.layout_year, [(session.pk, None, None)])
+        invalidate_layout_year(session.scenario.layout_year_id)
+        return result
         
     def _copy_data(self, session: PlanningSession) -> int:
         """
-        Copy all facts from this session to a new version within same layout/year.
+        Copy this session's facts and their extras into another version/year
+        of the same layout, inside the database (bps.utils.fact_copy).
+        parameters = { "to_version": <id|code>, "to_year": <id|code>,        # year optional
+                       "scope": "session" | "scenario",                      # default session
+                       "to_scenario": <code>, "key_figures": [codes], "periods": [codes],
+                       "overwrite": true }
         """
+        from bps.api.cache import invalidate_layout_year
+        from bps.utils.fact_copy import copy_sessions
+
         params = self.parameters
-        src_version = session.layout_year.version
-        tgt_version = get_object_or_404(Version, pk=params['to_version'])
-        # find or create the target layout-year & session
-        tgt_ly, _ = PlanningLayoutYear.objects.get_or_create(
-            layout=session.layout_year.layout,
-            year=session.layout_year.year,
-            version=tgt_version,
-        )
-        tgt_sess, _ = PlanningSession.objects.get_or_create(
-            layout_year=tgt_ly,
-            org_unit=session.org_unit,
+        periods = params.get('periods') or ([params['period']] if params.get('period') else None)
+        sessions = [session]
+        if params.get('scope') == 'scenario':
+            sessions = list(PlanningSession.objects.filter(scenario=session.scenario)
+                            .select_related('scenario__layout_year'))
+        result = copy_sessions(
+            sessions,
+            to_version=params['to_version'],
+            to_year=params.get('to_year') or params.get('year'),
+            to_scenario=params.get('to_scenario'),
+            key_figures=params.get('key_figures'),
+            periods=periods,
+            overwrite=params.get('overwrite', True),
+            description=f"{self.name}: copy from {session.scenario.layout_year}",
         )
-        # create a new DataRequest to hold the copied facts
-        new_req = DataRequest.objects.create(
-            session=tgt_sess,
-            description=f"Copy from v{src_version.code}"
-        )
-
-        # bulk copy
-        new_facts = []
-        for fact in PlanningFact.objects.filter(session=session).iterator():
-            new_facts.append(PlanningFact(
-                request    = new_req,
-                session    = tgt_sess,
-                version    = tgt_version,
-                year       = fact.year,
-                period     = fact.period,
-                org_unit   = fact.org_unit,
-                service    = fact.service,
-                account    = fact.account,
-                extra_dimensions_json= fact.extra_dimensions_json,
-                key_figure = fact.key_figure,
-                value      = fact.value,
-                uom        = fact.uom,
-                ref_value  = fact.ref_value,
-                ref_uom    = fact.ref_uom,
-            ))
-        PlanningFact.objects.bulk_create(new_facts)
-        return len(new_facts)
+        if result['layout_year']:
+            invalidate_layout_year(result['layout_year'])
+        return result['facts']
 
     def _distribute(self, session: PlanningSession) -> int:
         """
-        Distribute top-level reference total down into each fact by proportion.
+        Top-down distribution by reference proportions, in one UPDATE.
+
+        Per slice (period x key figure) of the session, the target total - the
+        `total` parameter (a number, or {period code: number}), else the slice's
+        current sum - is spread over the slice's cells in proportion to the
+        reference data's amounts per `by` member (same period; same key figure
+        unless `reference_key_figure` is given). Cells sharing a member split its
+        share evenly; rounding residue goes to the largest share. Slices without
+        reference amounts are left alone.
+        Optional filters: `key_figure` (code or list), `periods` (codes).
         """
-        by     = self.parameters['by']                # e.g. "org_unit"
-        ref_nm = self.parameters['reference_data']    # e.g. "2024 Actuals"
-        ref    = get_object_or_404(ReferenceData, name=ref_nm)
-
-        total = ref.fetch_reference_fact(**{by: None})['value__sum'] or 0
-        if total == 0:
-            return 0
-
-        updated = 0
-        with transaction.atomic():
-            for fact in PlanningFact.objects.filter(session=session):
-                proportion = fact.value / total
-                fact.value = proportion * total
-                fact.save(update_fields=['value'])
-                updated += 1
-
+        params = self.parameters
+        ref = get_object_or_404(ReferenceData, name=params['reference_data'])
+        ly = session.scenario.layout_year
+        by_sql, by_args = self._distribute_member(params['by'])
+
+        filters, filter_args = "", []
+        kf_codes = params.get('key_figure')
+        if kf_codes:
+            kf_codes = [kf_codes] if isinstance(kf_codes, str) else list(kf_codes)
+            filters += " AND f.key_figure_id IN (SELECT id FROM bps_keyfigure WHERE code = ANY(%s))"
+            filter_args.append(kf_codes)
+        if params.get('periods'):
+            filters += " AND f.period_id IN (SELECT id FROM bps_period WHERE code = ANY(%s))"
+            filter_args.append(list(params['periods']))
+
+        ref_kf = params.get('reference_key_figure')
+        ref_filter, ref_args, ref_kf_join = "", [], "AND ref.key_figure_id = c.key_figure_id"
+        if ref_kf:
+            ref_filter = " AND f.key_figure_id = (SELECT id FROM bps_keyfigure WHERE code = %s)"
+            ref_args, ref_kf_join = [ref_kf], ""
+
+        total = params.get('total')
+        if isinstance(total, dict):
+            periods = dict(Period.objects.filter(code__in=total).values_list('code', 'pk'))
+            targets = [(periods[c], Decimal(str(v))) for c, v in total.items() if c in periods]
+        elif total is not None:
+            targets = [(pk, Decimal(str(total))) for pk in Period.objects.values_list('pk', flat=True)]
+        else:
+            targets = []
+
+        request = DataRequest.objects.create(session=session, description=f"Distribute {self.name}")
+        sql = DISTRIBUTE_SQL.format(
+            member=by_sql.format(f="f"), filters=filters, ref_filter=ref_filter,
+            ref_kf_join=ref_kf_join,
+        )
+        args = (
+            by_args + [session.pk, ly.year_id, ly.version_id] + filter_args
+            + by_args + [ref.source_version_id, ref.source_year_id] + ref_args
+            + [[p for p, _ in targets], [v for _, v in targets]]
+            + [request.pk, ly.year_id, ly.version_id]
+        )
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.execute(sql, args)
+            updated = cur.rowcount
+        if not updated:
+            request.delete()
         return updated
 
+    @staticmethod
+    def _distribute_member(by: str):
+        """SQL expression (over fact alias {f}) for the `by` member, and its args."""
+        column = {'orgunit': 'org_unit_id', 'org_unit': 'org_unit_id',
+                  'service': 'service_id', 'account': 'account_id'}.get(by.lower())
+        if column:
+            return f"{{f}}.{column}", []
+        if not DimensionKey.objects.filter(key__iexact=by).exists():
+            raise ValueError(f"DISTRIBUTE: unknown dimension '{by}'")
+        return (
+            "(SELECT x.object_id FROM bps_planningfactextra x"
+            " JOIN bps_dimensionkey k ON k.id = x.key_id"
+            " WHERE x.fact_id = {f}.id AND x.year_id = {f}.year_id"
+            " AND x.version_id = {f}.version_id AND lower(k.key) = lower(%s) LIMIT 1)"
+        ), [by]
+
     def _currency_convert(self, session: PlanningSession) -> int:
         """
-        Revalue all facts in this session to a new UoM using ConversionRate.
+        Revalue all facts in this session to a new UoM with one UPDATE ... FROM
+        over the conversion matrix (direct, inverse and chained rates).
+        parameters = { "target_uom": "USD" }
         """
+        from bps.utils.conversion_rates import conversion_matrix
+
         tgt_code = self.parameters['target_uom']
         tgt_uom  = get_object_or_404(UnitOfMeasure, code=tgt_code)
-        conv_map = {
-            (c.from_uom_id, c.to_uom_id): c.factor
-            for c in ConversionRate.objects.filter(to_uom=tgt_uom)
-        }
-
-        updated = 0
-        with transaction.atomic():
-            for fact in PlanningFact.objects.filter(session=session):
-                key = (fact.uom_id, tgt_uom.id)
-                if key not in conv_map:
-                    continue
-                fact.value = round(fact.value * conv_map[key], 4)
-                fact.uom   = tgt_uom
-                fact.save(update_fields=['value','uom'])
-                updated += 1
-
-        return updated
+        sources  = conversion_matrix().sources(tgt_uom.id)
+        if not sources:
+            return 0
+        ly = session.scenario.layout_year
+        with connection.cursor() as cur:
+            cur.execute(CURRENCY_CONVERT_SQL, [
+                tgt_uom.id, [u for u, _ in sources], [str(f) for _, f in sources],
+                session.pk, ly.year_id, ly.version_id,
+            ])
+            return cur.rowcount
 
     def _repost(self, session: PlanningSession) -> int:
         """
-        Clone the last DataRequest + its facts, so you can "repost" identical data.
+        Re-post the last DataRequest's facts under a new DataRequest.
+        Cells are unique per session, so the facts are re-pointed, not cloned.
         """
         last_dr = session.requests.order_by('-created_at').first()
         if not last_dr:
             return 0
 
-        new_dr = DataRequest.objects.create(
-            session     = session,
-            description = f"Re-Post of {last_dr.id}",
-            created_by  = last_dr.created_by,
-        )
-
-        created = 0
         with transaction.atomic():
-            for fact in PlanningFact.objects.filter(request=last_dr):
-                fact.pk      = None
-                fact.request = new_dr
-                fact.save()
-                created += 1
+            new_dr = DataRequest.objects.create(
+                session     = session,
+                description = f"Re-Post of {last_dr.id}",
+                created_by  = last_dr.created_by,
+            )
+            moved = PlanningFact.objects.filter(request=last_dr).update(request=new_dr)
 
-        return created
+        return moved
 
     def _reset_slice(self, session: PlanningSession) -> int:
         """
@@ -393,13 +536,22 @@ class ReferenceData(models.Model):
     source_year = models.ForeignKey('Year', on_delete=models.CASCADE)
     description = models.TextField(blank=True)
     
-    def fetch_reference_fact(self, **filters):
+    def fetch_reference_fact(self, *conditions, **filters):
         return PlanningFact.objects.filter(
-            session__scenario__layout_year__version=self.source_version,
-            session__scenario__layout_year__year=self.source_year,
+            *conditions,
+            version=self.source_version,
+            year=self.source_year,
             **filters
         ).aggregate(Sum('value'))
 
+    def snapshot(self, dims=()):
+        """
+        In-memory source totals grouped by period, key figure and `dims`
+        (see bps.utils.reference_snapshot); use it for per-cell reads.
+        """
+        from bps.utils.reference_snapshot import reference_snapshot
+        return reference_snapshot(self, dims)
+
 class GlobalVariable(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
@@ -471,6 +623,14 @@ class Formula(models.Model):
     dimensions = models.ManyToManyField(ContentType, help_text="Multiple dimensions for looping")
     reference_version = models.ForeignKey('Version', null=True, blank=True, on_delete=models.SET_NULL)
     reference_year = models.ForeignKey('Year', null=True, blank=True, on_delete=models.SET_NULL)
+
+    class LoopMode(models.TextChoices):
+        ALL     = 'ALL', 'All members (cartesian product)'
+        DATA    = 'DATA', 'Combinations present in referenced facts'
+        ALLOWED = 'ALLOWED', 'Layout-year allowed values'
+    loop_mode = models.CharField(
+        max_length=8, choices=LoopMode.choices, default=LoopMode.ALL,
+        help_text="Domain of the FOREACH loop over the formula's dimensions")
     
     def __str__(self):
         return f"{self.name} ({self.layout})"
@@ -485,6 +645,20 @@ class FormulaRun(models.Model):
     run_by    = models.ForeignKey(settings.AUTH_USER_MODEL,
                                   null=True, on_delete=models.SET_NULL)
 
+    # profiling (FormulaExecutor(profile=True) / BPS_FORMULA_PROFILE); empty otherwise
+    profiled      = models.BooleanField(default=False)
+    wall_seconds  = models.FloatField(null=True, blank=True)
+    combinations  = models.PositiveIntegerField(null=True, blank=True,
+                                                help_text="Loop combinations evaluated")
+    query_count   = models.PositiveIntegerField(null=True, blank=True)
+    query_seconds = models.FloatField(null=True, blank=True)
+    rows_read     = models.PositiveIntegerField(null=True, blank=True)
+    rows_written  = models.PositiveIntegerField(null=True, blank=True)
+    slow_expressions = models.JSONField(default=list, blank=True,
+                                        help_text="Slowest sub-expressions: [{expr, calls, seconds}]")
+    profile_data  = models.BinaryField(null=True, blank=True, editable=False,
+                                       help_text="marshalled cProfile stats (pstats)")
+
     def __str__(self): return f"Run #{self.pk} of {self.formula.name} @ {self.run_at}"
 
 
@@ -1,9 +1,53 @@
 # models_extras.py
-from django.db import models
+import hashlib
+
+from django.db import models, connection
+from django.db.models.functions import Lower
 from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
+
+def dimension_signature(pairs) -> str:
+    """
+    Canonical hash of a fact's extra dimensions.
+    `pairs` is an iterable of (DimensionKey id, object_id); order does not matter.
+    Must produce the same value as SIGNATURE_SQL.
+    """
+    canon = "|".join(f"{k}:{v}" for k, v in sorted((int(k), int(v)) for k, v in pairs))
+    return hashlib.md5(canon.encode("utf-8")).hexdigest()
+
+
+EMPTY_SIGNATURE = dimension_signature(())
+
+# SQL twin of dimension_signature(), correlated on the fact alias "f".
+SIGNATURE_SQL = """
+md5(coalesce((
+    SELECT string_agg(e.key_id::text || ':' || e.object_id::text, '|' ORDER BY e.key_id)
+      FROM bps_planningfactextra e
+     WHERE e.fact_id = f.id
+), ''))
+"""
+
+
+def refresh_dimension_signatures(fact_ids=None) -> int:
+    """
+    Recompute PlanningFact.dim_signature from the stored PlanningFactExtra rows.
+    Used after raw/bulk extra writes and for backfills; returns rows touched.
+    """
+    sql = f"UPDATE bps_planningfact f SET dim_signature = {SIGNATURE_SQL}"
+    params = []
+    if fact_ids is not None:
+        fact_ids = list(fact_ids)
+        if not fact_ids:
+            return 0
+        sql += " WHERE f.id = ANY(%s)"
+        params.append(fact_ids)
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.rowcount
+
+
 class DimensionKey(models.Model):
     """
     Registry of allowed extra dimension keys and which model they must point to.
@@ -21,6 +65,10 @@ class PlanningFactExtra(models.Model):
     """
     One row per (fact, key) pair. Value is a Generic FK to the specific
     dimension row, enforced via DimensionKey.content_type.
+    The owning fact's dim_signature is derived from these rows; writers set it
+    up front, refresh_dimension_signatures() re-syncs it after raw edits.
+    year/version mirror the fact's so both tables can be partitioned alike
+    (see bps.utils.partitioning); save() fills them, bulk writers set them.
     """
     fact = models.ForeignKey(
         "bps.PlanningFact",
@@ -37,10 +85,15 @@ class PlanningFactExtra(models.Model):
     object_id    = models.PositiveIntegerField()
     value_obj    = GenericForeignKey("content_type", "object_id")
 
+    # partition keys, copied from the fact
+    year    = models.ForeignKey("bps.Year", on_delete=models.PROTECT, related_name="+", editable=False)
+    version = models.ForeignKey("bps.Version", on_delete=models.PROTECT, related_name="+", editable=False)
+
     class Meta:
         # a fact can have at most one value for a given logical key
+        # (year/version are implied by the fact; included for partitioning)
         constraints = [
-            models.UniqueConstraint(fields=["fact", "key"], name="uniq_fact_key"),
+            models.UniqueConstraint(fields=["fact", "key", "year", "version"], name="uniq_fact_key"),
         ]
         indexes = [
             models.Index(
@@ -49,6 +102,11 @@ class PlanningFactExtra(models.Model):
             ),
         ]
 
+    def save(self, *args, **kwargs):
+        if self.fact_id and not (self.year_id and self.version_id):
+            self.year_id, self.version_id = self.fact.year_id, self.fact.version_id
+        super().save(*args, **kwargs)
+
     def clean(self):
         # Enforce the key points to the correct model type
         if self.key_id and self.content_type_id:
@@ -56,4 +114,53 @@ class PlanningFactExtra(models.Model):
                 from django.core.exceptions import ValidationError
                 raise ValidationError(
                     {"content_type": f"Key '{self.key.key}' must reference {self.key.content_type}."}
-                )
\ No newline at end of file
+                )
+
+class JSONBObjectAgg(models.Aggregate):
+    function = "jsonb_object_agg"
+    output_field = models.JSONField()
+
+
+def extras_map_subquery():
+    """
+    Correlated subquery giving {lower(DimensionKey.key): object_id} for the
+    outer PlanningFact, aggregated in SQL; annotate a values() queryset with
+    it instead of prefetching extras + their generic FKs.
+    """
+    maps = (
+        PlanningFactExtra.objects
+        .filter(
+            fact_id=models.OuterRef("pk"),
+            # partition keys, so the lookup prunes to the fact's leaf
+            year_id=models.OuterRef("year_id"),
+            version_id=models.OuterRef("version_id"),
+        )
+        .values("fact_id")
+        .annotate(m=JSONBObjectAgg(Lower("key__key"), "object_id"))
+        .values("m")[:1]
+    )
+    return models.Subquery(maps, output_field=models.JSONField())
+
+
+def dimension_label_maps(keys, pks=None):
+    """
+    {key: {object_id: label}} for extras-map keys (lower DimensionKey.key),
+    served by the dimension registry; `pks` ({key: ids}) limits the result.
+    Labels are the row's name, falling back to code, then id.
+    """
+    from bps.utils.dimension_registry import dimension_index
+
+    out = {}
+    for dk in DimensionKey.objects.select_related("content_type"):
+        key = dk.key.lower()
+        if key not in keys or key in out:
+            continue
+        Model = dk.content_type.model_class()
+        if Model is None:
+            out[key] = {}
+            continue
+        labels = dimension_index(Model).labels
+        if pks is not None:
+            labels = {pk: labels[pk] for pk in pks.get(key, ()) if pk in labels}
+        out[key] = labels
+    return out
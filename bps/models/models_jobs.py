@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+
+
+class Job(models.Model):
+    """
+    One unit of long-running planning work, queued in the database and run by
+    `manage.py bps_worker` (bps/utils/job_queue.py). Workers claim QUEUED rows
+    with SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can share
+    the table without a broker; `progress` / `message` are written while the
+    job runs, and `cancel_requested` asks a running job to stop.
+    """
+    class Status(models.TextChoices):
+        QUEUED    = 'QUEUED', 'Queued'
+        RUNNING   = 'RUNNING', 'Running'
+        SUCCEEDED = 'SUCCEEDED', 'Succeeded'
+        FAILED    = 'FAILED', 'Failed'
+        CANCELLED = 'CANCELLED', 'Cancelled'
+
+    FINISHED = (Status.SUCCEEDED, Status.FAILED, Status.CANCELLED)
+
+    kind        = models.CharField(max_length=30, help_text="Handler name, e.g. 'formula', 'function'")
+    params      = models.JSONField(default=dict, blank=True)
+    status      = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    progress    = models.PositiveSmallIntegerField(default=0, help_text="Percent done")
+    message     = models.CharField(max_length=255, blank=True)
+    result      = models.JSONField(null=True, blank=True)
+    error       = models.TextField(blank=True)
+    cancel_requested = models.BooleanField(default=False)
+    attempts    = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1,
+                                                    help_text="Runs allowed when a worker is lost")
+    worker      = models.CharField(max_length=100, blank=True)
+    created_by  = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+                                    null=True, blank=True, related_name='+')
+    created_at  = models.DateTimeField(auto_now_add=True)
+    started_at  = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # the claim query: oldest queued job first
+            models.Index(fields=['created_at', 'id'], condition=Q(status='QUEUED'),
+                         name='bps_job_queued'),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.pk} {self.kind} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED
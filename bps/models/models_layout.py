@@ -1,6 +1,7 @@
 from django.db import models, transaction
 from django.contrib.contenttypes.models import ContentType
 from .models_dimension import Year, Version, OrgUnit
+from bps.utils.partitioning import ensure_partition
 # from .models import KeyFigure
 
 SHORT_LABELS = {
@@ -79,6 +80,11 @@ class PlanningLayoutYear(models.Model):
     def __str__(self):
         return f"{self.layout.name} – {self.year.code} / {self.version.code}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # facts of a new year/version need their partition (no-op unless partitioned)
+        ensure_partition(self.year_id, self.version_id)
+
     def header_defaults(self):
         base = dict(self.header_dims or {})
         # if you use per-dimension overrides, merge them here as needed
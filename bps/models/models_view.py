@@ -1,44 +1,312 @@
 # bps/models/models_view.py
-from django.db import models
+from django.db import models, connection
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Now
+
+MONTHS = [f"{m:02d}" for m in range(1, 13)]
+CURRENT_TXID_SQL = "pg_current_xact_id()::text::bigint"
+
 
 class PivotedPlanningFact(models.Model):
-    version = models.CharField(max_length=50)
-    year = models.IntegerField()
-    org_unit = models.CharField(max_length=50)
-    service = models.CharField(max_length=50)
-    account = models.CharField(max_length=50)
-    extra_dimensions_json = models.JSONField()
-    key_figure = models.CharField(max_length=50)
+    """
+    Period-pivoted copy of PlanningFact: one row per planning cell
+    (session, org unit, service, account, key figure, dim_signature) with the
+    twelve monthly values side by side.
+
+    The table is maintained by statement-level triggers on bps_planningfact and
+    bps_planningfactextra (see migration 0004), so every write path - ORM,
+    bulk_create, queryset.update() or raw SQL - keeps it current.
+    `rebuild_pivot()` / `manage.py bps_rebuild_pivot` re-derive it from scratch.
+    """
+    session = models.ForeignKey('bps.PlanningSession', on_delete=models.DO_NOTHING,
+                                db_constraint=False, related_name='+')
+    # session.scenario.layout_year, so grid reads need no join
+    layout_year = models.ForeignKey('bps.PlanningLayoutYear', on_delete=models.DO_NOTHING, null=True,
+                                    db_constraint=False, related_name='+')
+    version = models.ForeignKey('bps.Version', on_delete=models.DO_NOTHING,
+                                db_constraint=False, related_name='+')
+    year = models.ForeignKey('bps.Year', on_delete=models.DO_NOTHING,
+                             db_constraint=False, related_name='+')
+    org_unit = models.ForeignKey('bps.OrgUnit', on_delete=models.DO_NOTHING,
+                                 db_constraint=False, related_name='+')
+    service = models.ForeignKey('bps.Service', on_delete=models.DO_NOTHING, null=True, blank=True,
+                                db_constraint=False, related_name='+')
+    account = models.ForeignKey('bps.Account', on_delete=models.DO_NOTHING, null=True, blank=True,
+                                db_constraint=False, related_name='+')
+    key_figure = models.ForeignKey('bps.KeyFigure', on_delete=models.DO_NOTHING,
+                                   db_constraint=False, related_name='+')
+    dim_signature = models.CharField(max_length=32)
+    # {lower(DimensionKey.key): object_id}, e.g. {"position": 12, "skill": 3}
+    extras = models.JSONField(default=dict)
+    # id of the transaction that (re)wrote the row; compared against delta-sync cursors
+    txid = models.BigIntegerField(db_default=RawSQL(CURRENT_TXID_SQL, []), editable=False)
     # Value columns
-    v01 = models.FloatField(null=True, blank=True)
-    v02 = models.FloatField(null=True, blank=True)
-    v03 = models.FloatField(null=True, blank=True)
-    v04 = models.FloatField(null=True, blank=True)
-    v05 = models.FloatField(null=True, blank=True)
-    v06 = models.FloatField(null=True, blank=True)
-    v07 = models.FloatField(null=True, blank=True)
-    v08 = models.FloatField(null=True, blank=True)
-    v09 = models.FloatField(null=True, blank=True)
-    v10 = models.FloatField(null=True, blank=True)
-    v11 = models.FloatField(null=True, blank=True)
-    v12 = models.FloatField(null=True, blank=True)
+    v01 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v02 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v03 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v04 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v05 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v06 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v07 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v08 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v09 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v10 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v11 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    v12 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
     # Reference value columns
-    r01 = models.FloatField(null=True, blank=True)
-    r02 = models.FloatField(null=True, blank=True)
-    r03 = models.FloatField(null=True, blank=True)
-    r04 = models.FloatField(null=True, blank=True)
-    r05 = models.FloatField(null=True, blank=True)
-    r06 = models.FloatField(null=True, blank=True)
-    r07 = models.FloatField(null=True, blank=True)
-    r08 = models.FloatField(null=True, blank=True)
-    r09 = models.FloatField(null=True, blank=True)
-    r10 = models.FloatField(null=True, blank=True)
-    r11 = models.FloatField(null=True, blank=True)
-    r12 = models.FloatField(null=True, blank=True)
-    # Totals
-    total_value = models.FloatField(null=True, blank=True)
-    total_reference = models.FloatField(null=True, blank=True)
+    r01 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r02 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r03 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r04 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r05 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r06 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r07 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r08 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r09 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r10 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r11 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    r12 = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    # Year-dependent facts (period is NULL)
+    year_value = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    year_reference = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    # Totals over the monthly columns
+    total_value = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+    total_reference = models.DecimalField(max_digits=18, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        db_table = 'pivoted_planningfact'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['session', 'org_unit', 'key_figure', 'dim_signature', 'service', 'account'],
+                name='uniq_pivot_cell',
+                nulls_distinct=False,
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['version', 'year']),
+            models.Index(fields=['layout_year', 'org_unit'], name='pivoted_pla_ly_org_idx'),
+            models.Index(fields=['layout_year', 'txid'], name='pivoted_pla_ly_txid_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key_figure_id} | {self.org_unit_id} | {self.service_id} | {self.dim_signature}"
+
+    def month_values(self, reference=False):
+        """{'01': value, ..., '12': value} for this cell."""
+        prefix = 'r' if reference else 'v'
+        return {m: getattr(self, f"{prefix}{m}") for m in MONTHS}
+
+
+class PivotTombstone(models.Model):
+    """
+    Grid row keys (layout-year, org unit, service, extras) whose pivot rows
+    were deleted, so delta readers can tell removed rows from changed ones.
+    Written by bps_pivot_refresh (migration 0008), rebuild_pivot() and
+    partition detach. A marker row (org_unit NULL) means "deletes up to this
+    txid are no longer known" for its layout-year (all when NULL): cursors
+    not past it must reload. prune_pivot_tombstones() trims old rows.
+    """
+    txid = models.BigIntegerField(db_default=RawSQL(CURRENT_TXID_SQL, []))
+    layout_year = models.ForeignKey('bps.PlanningLayoutYear', on_delete=models.DO_NOTHING, null=True,
+                                    db_constraint=False, related_name='+')
+    org_unit = models.ForeignKey('bps.OrgUnit', on_delete=models.DO_NOTHING, null=True,
+                                 db_constraint=False, related_name='+')
+    service = models.ForeignKey('bps.Service', on_delete=models.DO_NOTHING, null=True,
+                                db_constraint=False, related_name='+')
+    extras = models.JSONField(default=dict)
+    deleted_at = models.DateTimeField(db_default=Now())
 
     class Meta:
-        managed = False  # Do not let Django manage the database schema
-        db_table = 'pivoted_planningfact'  # Match the view name
+        indexes = [
+            models.Index(fields=['layout_year', 'txid'], name='bps_tomb_ly_txid_idx'),
+            models.Index(fields=['deleted_at'], name='bps_tomb_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"@{self.txid} {self.layout_year_id} | {self.org_unit_id} | {self.service_id}"
+
+
+# Delete pivot rows matching `where` (alias p) and tombstone their grid row keys.
+PIVOT_DELETE_SQL = """
+WITH gone AS (
+    DELETE FROM pivoted_planningfact p WHERE {where}
+    RETURNING p.layout_year_id, p.org_unit_id, p.service_id, p.extras, p.session_id
+), keys AS (
+    INSERT INTO bps_pivottombstone (layout_year_id, org_unit_id, service_id, extras)
+    SELECT DISTINCT layout_year_id, org_unit_id, service_id, extras FROM gone
+)
+SELECT DISTINCT session_id FROM gone
+"""
+
+# Reset marker: cursors not past its txid must reload (layout_year NULL = all).
+PIVOT_RESET_SQL = "INSERT INTO bps_pivottombstone (layout_year_id, extras) VALUES (%s, '{}')"
+
+
+def pivot_cursor() -> int:
+    """
+    Delta-sync cursor: the oldest transaction still running as seen from the
+    current snapshot. Everything written by older transactions is visible
+    now, so a later `txid >= cursor` read misses nothing (it may repeat rows).
+    """
+    with connection.cursor() as cur:
+        cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+        return cur.fetchone()[0]
+
+
+def prune_pivot_tombstones(older_than) -> int:
+    """
+    Delete tombstones older than `older_than` (datetime), leaving a reset
+    marker at the newest pruned txid. Returns rows deleted.
+    """
+    with connection.cursor() as cur:
+        cur.execute(
+            "WITH gone AS (DELETE FROM bps_pivottombstone WHERE deleted_at < %s RETURNING txid) "
+            "SELECT count(*), max(txid) FROM gone",
+            [older_than],
+        )
+        n, max_txid = cur.fetchone()
+        if max_txid is not None:
+            cur.execute(
+                "INSERT INTO bps_pivottombstone (txid, extras) VALUES (%s, '{}')", [max_txid]
+            )
+    return n
+
+
+class FactChangeStamp(models.Model):
+    """
+    Per-session change counter for conditional GETs (ETag / Last-Modified).
+
+    Bumped by statement-level triggers on bps_planningfact and
+    bps_planningfactextra (migration 0007), so any fact write, delete or
+    planning-function run moves it; a layout-year's stamp is the aggregate
+    over its sessions. Readers check it instead of the fact table.
+    """
+    session = models.OneToOneField('bps.PlanningSession', on_delete=models.DO_NOTHING, primary_key=True,
+                                   db_constraint=False, related_name='+')
+    layout_year = models.ForeignKey('bps.PlanningLayoutYear', on_delete=models.DO_NOTHING,
+                                    db_constraint=False, related_name='+')
+    counter = models.BigIntegerField(default=0)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['layout_year', 'changed_at'], name='bps_stamp_ly_changed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.session_id} #{self.counter} @ {self.changed_at:%Y-%m-%d %H:%M:%S}"
+
+
+def touch_change_stamps(session_ids=None) -> None:
+    """Bump the stamps of `session_ids` (all sessions when None)."""
+    with connection.cursor() as cur:
+        if session_ids is None:
+            cur.execute("SELECT bps_touch_sessions(ARRAY(SELECT id FROM bps_planningsession))")
+        else:
+            cur.execute("SELECT bps_touch_sessions(%s::bigint[])", [list(session_ids)])
+
+
+def layout_year_stamp(layout_year_id):
+    """(stamp, changed_at) over all sessions of a layout-year, or None."""
+    agg = FactChangeStamp.objects.filter(layout_year_id=layout_year_id).aggregate(
+        counter=models.Sum('counter'), n=models.Count('pk'), changed_at=models.Max('changed_at'),
+    )
+    if agg['counter'] is None:
+        return None
+    # the session count keeps the sum monotonic when a session is added
+    return f"{agg['counter']}.{agg['n']}", agg['changed_at']
+
+
+def version_year_stamp(version_id, year_id):
+    """Stamp over every session planning `version`/`year` (reference-data sources), or None."""
+    agg = FactChangeStamp.objects.filter(
+        layout_year__version_id=version_id, layout_year__year_id=year_id,
+    ).aggregate(counter=models.Sum('counter'), n=models.Count('pk'))
+    if agg['counter'] is None:
+        return None
+    return f"{agg['counter']}.{agg['n']}"
+
+
+def session_stamp(session_id):
+    """(stamp, changed_at) of one session, or None."""
+    row = FactChangeStamp.objects.filter(pk=session_id).values_list('counter', 'changed_at').first()
+    return (str(row[0]), row[1]) if row else None
+
+
+PIVOT_CELL_COLUMNS = ["session_id", "org_unit_id", "service_id", "account_id", "key_figure_id", "dim_signature"]
+PIVOT_VALUE_COLUMNS = (
+    [f"v{m}" for m in MONTHS] + [f"r{m}" for m in MONTHS]
+    + ["year_value", "year_reference", "total_value", "total_reference"]
+)
+
+
+def pivot_select_sql(source: str) -> str:
+    """
+    SELECT producing pivot rows from the facts in `source`, which must expose
+    bps_planningfact as `f` (optionally joined/filtered). Columns come out in
+    PIVOT_CELL_COLUMNS, version_id, year_id, layout_year_id, extras,
+    PIVOT_VALUE_COLUMNS order.
+    """
+    month_cols = ",\n           ".join(
+        f"sum(f.value) FILTER (WHERE per.code = '{m}') AS v{m}" for m in MONTHS
+    )
+    ref_cols = ",\n           ".join(
+        f"sum(f.ref_value) FILTER (WHERE per.code = '{m}') AS r{m}" for m in MONTHS
+    )
+    cells = ", ".join(f"f.{c}" for c in PIVOT_CELL_COLUMNS)
+    return f"""
+SELECT {", ".join(f"g.{c}" for c in PIVOT_CELL_COLUMNS)}, g.version_id, g.year_id,
+       (SELECT sc.layout_year_id
+          FROM bps_planningsession s
+          JOIN bps_planningscenario sc ON sc.id = s.scenario_id
+         WHERE s.id = g.session_id),
+       coalesce((SELECT jsonb_object_agg(lower(dk.key), e.object_id)
+                 FROM bps_planningfactextra e
+                 JOIN bps_dimensionkey dk ON dk.id = e.key_id
+                 WHERE e.fact_id = g.any_fact_id), '{{}}'::jsonb),
+       {", ".join(f"g.{c}" for c in PIVOT_VALUE_COLUMNS)}
+FROM (
+    SELECT {cells},
+           max(f.version_id) AS version_id, max(f.year_id) AS year_id, min(f.id) AS any_fact_id,
+           {month_cols},
+           {ref_cols},
+           sum(f.value)     FILTER (WHERE f.period_id IS NULL)     AS year_value,
+           sum(f.ref_value) FILTER (WHERE f.period_id IS NULL)     AS year_reference,
+           sum(f.value)     FILTER (WHERE f.period_id IS NOT NULL) AS total_value,
+           sum(f.ref_value) FILTER (WHERE f.period_id IS NOT NULL) AS total_reference
+    FROM {source}
+    LEFT JOIN bps_period per ON per.id = f.period_id
+    GROUP BY {cells}
+) g"""
+
+
+PIVOT_INSERT_SQL = (
+    "INSERT INTO pivoted_planningfact ("
+    + ", ".join(PIVOT_CELL_COLUMNS + ["version_id", "year_id", "layout_year_id", "extras"] + PIVOT_VALUE_COLUMNS)
+    + ")"
+)
+
+
+def rebuild_pivot(session_ids=None) -> int:
+    """
+    Re-derive pivoted_planningfact from bps_planningfact, for all sessions or
+    only `session_ids`. Returns the number of pivot rows written.
+    """
+    ids = None if session_ids is None else list(session_ids)
+    with connection.cursor() as cur:
+        if ids is None:
+            cur.execute("TRUNCATE pivoted_planningfact")
+            cur.execute(PIVOT_RESET_SQL, [None])
+            cur.execute(PIVOT_INSERT_SQL + pivot_select_sql("bps_planningfact f"))
+            written = cur.rowcount
+        else:
+            cur.execute(PIVOT_DELETE_SQL.format(where="p.session_id = ANY(%s)"), [ids])
+            cur.execute(
+                PIVOT_INSERT_SQL + pivot_select_sql(
+                    "(SELECT * FROM bps_planningfact WHERE session_id = ANY(%s)) f"
+                ),
+                [ids],
+            )
+            written = cur.rowcount
+    touch_change_stamps(ids)
+    return written
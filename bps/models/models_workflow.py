@@ -79,9 +79,46 @@ class ScenarioFunction(models.Model):
     scenario  = models.ForeignKey(PlanningScenario, on_delete=models.CASCADE)
     function  = models.ForeignKey('bps.PlanningFunction', on_delete=models.CASCADE)
     order     = models.PositiveSmallIntegerField()
+    # consecutive functions of a parallel stage run side by side in the pipeline
+    stage     = models.ForeignKey(PlanningStage, on_delete=models.SET_NULL, null=True, blank=True,
+                                  help_text="Stage this function belongs to (pipeline grouping)")
     class Meta:
         unique_together = ('scenario','function')
         ordering = ['order']
+
+
+class ScenarioPipelineRun(models.Model):
+    """
+    Audit of one run of a scenario's function pipeline (bps.views.pipeline_runner):
+    one record for all steps, each step = one function on one session.
+    steps = [{"order", "function", "function_type", "stage", "session", "org_unit",
+              "result", "error", "attempts", "seconds"}, ...]
+    """
+    class Status(models.TextChoices):
+        RUNNING   = 'RUNNING', 'Running'
+        SUCCEEDED = 'SUCCEEDED', 'Succeeded'
+        PARTIAL   = 'PARTIAL', 'Partially failed'
+        FAILED    = 'FAILED', 'Failed'
+
+    scenario    = models.ForeignKey(PlanningScenario, on_delete=models.CASCADE, related_name='pipeline_runs')
+    started_by  = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
+                                    null=True, blank=True, related_name='+')
+    started_at  = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    status      = models.CharField(max_length=10, choices=Status.choices, default=Status.RUNNING)
+    workers     = models.PositiveSmallIntegerField(default=1)
+    retries     = models.PositiveSmallIntegerField(default=0)
+    seconds     = models.FloatField(null=True, blank=True)
+    steps_ok     = models.PositiveIntegerField(default=0)
+    steps_failed = models.PositiveIntegerField(default=0)
+    steps_skipped = models.PositiveIntegerField(default=0)
+    steps       = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"Pipeline #{self.pk} of {self.scenario.code} ({self.status})"
         
 class PlanningSession(models.Model):
     """
@@ -7,7 +7,7 @@ from .views.views import (
     PlanningSessionListView, PlanningSessionDetailView, AdvanceStageView,
     ConstantListView, SubFormulaListView, FormulaListView, FormulaRunView,
     CopyActualView, DistributeKeyView,
-    PlanningFunctionListView, RunPlanningFunctionView,
+    PlanningFunctionListView, RunPlanningFunctionView, RunScenarioPipelineView,
     ReferenceDataListView, DataRequestListView, DataRequestDetailView,
     FactListView, VariableListView,
 )
@@ -31,6 +31,7 @@ app_name = "bps"
 urlpatterns = [
     
     path("scenario/<slug:code>/", ScenarioDashboardView.as_view(), name="scenario_dashboard"),
+    path("scenario/<slug:code>/run-pipeline/", RunScenarioPipelineView.as_view(), name="run_scenario_pipeline"),
     path("session/", PlanningSessionListView.as_view(), name="session_list"),
     path("session/<int:pk>/", PlanningSessionDetailView.as_view(), name="session_detail"),
     path("session/<int:pk>/advance/", AdvanceStepView.as_view(), name="advance_step"),
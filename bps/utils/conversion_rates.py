@@ -0,0 +1,206 @@
+# bps/utils/conversion_rates.py
+"""
+Process-wide unit conversion matrix.
+
+RateMatrix holds a factor for every convertible (from_uom, to_uom) pair,
+built from two queries: the ConversionRate rows themselves, their inverses
+(1 / factor) where no reverse row exists, and chained rates through
+intermediate units (breadth-first, base units tried first), e.g.
+HRS -> MAN_MONTH -> HC. Lookups are dict hits.
+
+The matrix is versioned like the dimension registry: post_save/post_delete
+on ConversionRate and UnitOfMeasure bump its version in Django's cache, and
+readers rebuild when their copy is stale or older than
+settings.BPS_DIMENSION_REGISTRY_TTL seconds. Call invalidate_conversion_rates()
+after queryset.update()/bulk_create().
+
+DisplayFactors maps a layout-year's cells to factors into a display unit, so
+grid reads can show values in another unit without writing them.
+"""
+import threading
+import time
+from collections import deque
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = "bps:uomrates"
+ONE = Decimal("1")
+
+_lock = threading.Lock()
+_matrix: Optional["RateMatrix"] = None
+
+
+class RateMatrix:
+    """Every reachable conversion factor: value_in_to = factor * value_in_from."""
+
+    def __init__(self, version):
+        from bps.models.models import ConversionRate, UnitOfMeasure
+
+        self.version = version
+        self.loaded_at = time.monotonic()
+        units = list(UnitOfMeasure.objects.order_by("-is_base", "pk").values_list("pk", "code"))
+        self.by_code: Dict[str, int] = {code: pk for pk, code in units}
+        self.codes: Dict[int, str] = {pk: code for pk, code in units}
+
+        direct: Dict[Tuple[int, int], Decimal] = {
+            (f, t): factor
+            for f, t, factor in ConversionRate.objects.values_list("from_uom_id", "to_uom_id", "factor")
+            if factor
+        }
+        edges: Dict[int, Dict[int, Decimal]] = {pk: {} for pk, _ in units}
+        for (f, t), factor in direct.items():
+            edges[f][t] = factor
+        for (f, t), factor in direct.items():
+            edges[t].setdefault(f, ONE / factor)
+
+        # breadth-first from every unit: shortest chain wins; neighbours are
+        # visited in `units` order, i.e. base units first
+        order = {pk: i for i, (pk, _) in enumerate(units)}
+        self.rates: Dict[Tuple[int, int], Decimal] = {}
+        for start, _ in units:
+            seen = {start: ONE}
+            queue = deque([start])
+            while queue:
+                here = queue.popleft()
+                for there in sorted(edges[here], key=order.__getitem__):
+                    if there not in seen:
+                        seen[there] = seen[here] * edges[here][there]
+                        queue.append(there)
+            for target, factor in seen.items():
+                self.rates[(start, target)] = factor
+
+    def __contains__(self, pair):
+        return pair in self.rates
+
+    def rate(self, from_uom_id, to_uom_id) -> Optional[Decimal]:
+        """Factor from one unit (pk) to another, 1 for the same unit, None if unreachable."""
+        if from_uom_id == to_uom_id:
+            return ONE
+        return self.rates.get((from_uom_id, to_uom_id))
+
+    def convert(self, value, from_uom_id, to_uom_id, places: int = 2) -> Optional[Decimal]:
+        """`value` in `to_uom_id`, rounded to `places`; None if there is no rate."""
+        factor = self.rate(from_uom_id, to_uom_id)
+        if factor is None or value is None:
+            return None
+        return round(Decimal(value) * factor, places)
+
+    def sources(self, to_uom_id) -> List[Tuple[int, Decimal]]:
+        """(from_uom_id, factor) for every other unit convertible into `to_uom_id`."""
+        return [(f, factor) for (f, t), factor in self.rates.items() if t == to_uom_id and f != t]
+
+
+def rates_version():
+    """Current version of the conversion rates; part of every key of converted output."""
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def conversion_matrix() -> RateMatrix:
+    """Current RateMatrix, (re)built if stale."""
+    global _matrix
+    version = rates_version()
+    ttl = getattr(settings, "BPS_DIMENSION_REGISTRY_TTL", 300)
+    m = _matrix
+    if m is None or m.version != version or (ttl and time.monotonic() - m.loaded_at > ttl):
+        with _lock:
+            m = _matrix
+            if m is None or m.version != version or (ttl and time.monotonic() - m.loaded_at > ttl):
+                m = _matrix = RateMatrix(version)
+    return m
+
+
+class DisplayFactors:
+    """
+    Factors that show one layout-year's pivot cells in `display_uom`.
+
+    A pivot row carries no unit, so the units of each (session, key figure)
+    are read from its facts with one GROUP BY; `unit_column` is "uom_id" for
+    values, "ref_uom_id" for reference values. A pair whose facts mix units
+    (e.g. after a partial CURRENCY_CONVERT) sums values that no single
+    factor converts: it is left as stored and listed in `mixed`. Cells
+    without a unit or without a rate into `display_uom` keep their own unit
+    too; `unconverted` counts every pair left as stored.
+    """
+
+    def __init__(self, layout_year, display_uom, unit_column: str = "uom_id"):
+        from bps.models.models import PlanningFact
+
+        rates = conversion_matrix()
+        self.code = str(display_uom)
+        self.uom_id = rates.by_code.get(self.code) or rates.by_code.get(self.code.upper())
+        if self.uom_id is None:
+            raise ValueError(f"Unknown unit of measure {display_uom}")
+        units: Dict[Tuple[int, int], set] = {}
+        pairs = (
+            PlanningFact.objects
+            .filter(layout_year=layout_year, year_id=layout_year.year_id, version_id=layout_year.version_id)
+            .values_list("session_id", "key_figure_id", unit_column)
+            .distinct()
+        )
+        for session_id, kf_id, uom_id in pairs:
+            units.setdefault((session_id, kf_id), set()).add(uom_id)
+        self.factors: Dict[Tuple[int, int], Optional[Decimal]] = {}
+        self.mixed: set = set()
+        for pair, uoms in units.items():
+            factors = {rates.rate(u, self.uom_id) if u else None for u in uoms}
+            if len(factors) > 1:
+                self.mixed.add(pair)
+            self.factors[pair] = factors.pop() if len(factors) == 1 else None
+        self.unconverted = sum(1 for f in self.factors.values() if f is None)
+
+    def mixed_key_figures(self) -> List[str]:
+        """Codes of the key figures left unconverted somewhere because their units are mixed."""
+        from bps.models.models import KeyFigure
+        from bps.utils.dimension_registry import dimension_index
+
+        kfs = dimension_index(KeyFigure)
+        return sorted({kfs.code(kf_id) or str(kf_id) for _session, kf_id in self.mixed})
+
+    def annotate(self, response):
+        """Stamp X-Grid-Display-Uom (and X-Grid-Mixed-Uom, if any) on `response`."""
+        response["X-Grid-Display-Uom"] = self.code
+        if self.mixed:
+            response["X-Grid-Mixed-Uom"] = ",".join(self.mixed_key_figures())
+        return response
+
+    def factor(self, session_id, key_figure_id) -> Optional[Decimal]:
+        """Factor for a cell, None to leave it as stored."""
+        return self.factors.get((session_id, key_figure_id))
+
+    @staticmethod
+    def apply(value, factor):
+        """`value` (Decimal or None) times `factor`, rounded to cents, as float."""
+        if value is None:
+            return None
+        if factor is None or factor == ONE:
+            return float(value)
+        return float(round(value * factor, 2))
+
+
+def invalidate_conversion_rates():
+    """Drop the matrix in every process sharing the cache."""
+    global _matrix
+    if not cache.add(VERSION_KEY, 2, None):
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 2, None)
+    _matrix = None
+
+
+def _on_change(sender, **kwargs):
+    invalidate_conversion_rates()
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete
+
+    from bps.models.models import ConversionRate, UnitOfMeasure
+
+    for model in (ConversionRate, UnitOfMeasure):
+        uid = f"bps-uomrates-{model._meta.label_lower}"
+        post_save.connect(_on_change, sender=model, dispatch_uid=f"{uid}-save")
+        post_delete.connect(_on_change, sender=model, dispatch_uid=f"{uid}-delete")
@@ -0,0 +1,164 @@
+# bps/utils/dimension_registry.py
+"""
+Process-wide pk <-> code <-> label registry for dimension models.
+
+Each model gets an immutable DimensionIndex built with one values() query
+and reused across requests. Indexes are versioned: post_save/post_delete on
+a tracked model bump its version in Django's cache (shared between workers
+when the backend is), and readers rebuild when their copy is out of date or
+older than settings.BPS_DIMENSION_REGISTRY_TTL seconds (a backstop for
+queryset.update()/bulk_create(), which send no signals; call
+invalidate_dimension() after those).
+
+Tracked: InfoObject subclasses, Skill, KeyFigure and Period (connected in
+BpConfig.ready()). Any other model with an id/name/code shape works too, it
+is just never invalidated by signal.
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from bps.api.utils import parse_pk_or_code
+
+VERSION_KEY = "bps:dimreg:{}"
+
+_lock = threading.Lock()
+_indexes: Dict[str, "DimensionIndex"] = {}
+
+
+class DimensionIndex:
+    """Snapshot of one dimension table: O(1) pk/code/label lookups."""
+
+    def __init__(self, model, version):
+        self.model = model
+        self.version = version
+        self.loaded_at = time.monotonic()
+        names = {f.name for f in model._meta.get_fields()}
+        self.has_code = "code" in names
+        self.has_name = "name" in names
+        cols = ["pk"] + [c for c in ("code", "name") if c in names]
+
+        self.codes: Dict[int, str] = {}
+        self.names: Dict[int, str] = {}
+        self.labels: Dict[int, str] = {}
+        self.by_code: Dict[str, int] = {}
+        self.by_code_ci: Dict[str, int] = {}
+        self.rows = []   # (pk, code, name) in label order, for searches
+        for row in model.objects.order_by("pk").values(*cols):
+            pk, code, name = row["pk"], row.get("code"), row.get("name")
+            self.labels[pk] = str(name or code or pk)
+            self.names[pk] = name
+            if code is not None:
+                self.codes[pk] = code
+                self.by_code.setdefault(str(code), pk)
+                self.by_code_ci.setdefault(str(code).upper(), pk)
+            self.rows.append((pk, code, name))
+        self.rows.sort(key=lambda r: (str(r[2] or r[1] or "").casefold(), r[0]))
+
+    def __contains__(self, pk):
+        return pk in self.labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def label(self, pk, default=None):
+        return self.labels.get(pk, default)
+
+    def code(self, pk, default=None):
+        return self.codes.get(pk, default)
+
+    def pk_for_code(self, code, *, case_insensitive=False) -> Optional[int]:
+        if code is None:
+            return None
+        if case_insensitive:
+            return self.by_code_ci.get(str(code).upper())
+        return self.by_code.get(str(code))
+
+    def resolve(self, raw, *, case_insensitive=False) -> Optional[int]:
+        """pk for `raw` (an existing pk first, then a code) or None."""
+        kind, v = parse_pk_or_code(raw)
+        if kind == "PK":
+            if v in self.labels:
+                return v
+            return self.pk_for_code(v, case_insensitive=case_insensitive)
+        if kind == "CODE":
+            return self.pk_for_code(v, case_insensitive=case_insensitive)
+        return None
+
+    def instance(self, pk):
+        """
+        Model instance carrying only pk/code/name (other fields load lazily),
+        built without a query. Raises Model.DoesNotExist for unknown pks.
+        """
+        if pk not in self.labels:
+            raise self.model.DoesNotExist(f"{self.model.__name__} {pk} does not exist")
+        fields, values = ["id"], [pk]
+        if self.has_code:
+            fields.append("code")
+            values.append(self.codes.get(pk))
+        if self.has_name:
+            fields.append("name")
+            values.append(self.names[pk])
+        return self.model.from_db(None, fields, values)
+
+    def instances(self):
+        """All rows as lightweight instances, in pk order."""
+        return [self.instance(pk) for pk in sorted(self.labels)]
+
+
+def _version(model) -> int:
+    return cache.get_or_set(VERSION_KEY.format(model._meta.label_lower), 1, None)
+
+
+def dimension_index(model) -> DimensionIndex:
+    """Current DimensionIndex of `model`, (re)built if stale."""
+    label = model._meta.label_lower
+    version = _version(model)
+    ttl = getattr(settings, "BPS_DIMENSION_REGISTRY_TTL", 300)
+    idx = _indexes.get(label)
+    if idx is None or idx.version != version or (ttl and time.monotonic() - idx.loaded_at > ttl):
+        with _lock:
+            idx = _indexes.get(label)
+            if idx is None or idx.version != version or (ttl and time.monotonic() - idx.loaded_at > ttl):
+                idx = DimensionIndex(model, version)
+                _indexes[label] = idx
+    return idx
+
+
+def invalidate_dimension(model):
+    """Drop `model`'s index in every process sharing the cache."""
+    key = VERSION_KEY.format(model._meta.label_lower)
+    if not cache.add(key, 2, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, None)
+    _indexes.pop(model._meta.label_lower, None)
+
+
+def _on_change(sender, **kwargs):
+    invalidate_dimension(sender)
+
+
+def tracked_models():
+    from django.apps import apps
+    from bps.models.models_dimension import InfoObject
+    from bps.models.models_resource import Skill
+    from bps.models.models import KeyFigure, Period
+
+    return [
+        m for m in apps.get_app_config("bps").get_models()
+        if issubclass(m, InfoObject) or m in (Skill, KeyFigure, Period)
+    ]
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete
+
+    for model in tracked_models():
+        uid = f"bps-dimreg-{model._meta.label_lower}"
+        post_save.connect(_on_change, sender=model, dispatch_uid=f"{uid}-save")
+        post_delete.connect(_on_change, sender=model, dispatch_uid=f"{uid}-delete")
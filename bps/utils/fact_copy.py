@@ -0,0 +1,193 @@
+# bps/utils/fact_copy.py
+"""
+Server-side copy of planning facts and their extras.
+
+copy_facts() clones the facts of mapped source sessions into target
+sessions with one INSERT ... SELECT ... ON CONFLICT statement; a second,
+data-modifying CTE of the same statement copies the PlanningFactExtra rows
+of every written fact. No fact row passes through Python, so copying a
+whole version is bounded by the database, not the ORM.
+
+copy_sessions() resolves the targets first: the target layout-year (same
+layout, given version/year), a scenario on it per source scenario (a new
+one gets the source's steps, stages, org units and functions), a session
+per org unit, starting at the scenario's first step, and one DataRequest
+per target session.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from bps.models.models import DataRequest, KeyFigure, Period
+from bps.models.models_dimension import Version, Year
+from bps.models.models_layout import PlanningLayoutYear
+from bps.models.models_workflow import (
+    PlanningScenario, PlanningSession, ScenarioFunction, ScenarioOrgUnit, ScenarioStage, ScenarioStep,
+)
+from bps.utils.dimension_registry import dimension_index
+
+FACT_COLUMNS = ("period_id", "org_unit_id", "service_id", "account_id", "key_figure_id",
+                "value", "uom_id", "ref_value", "ref_uom_id", "dim_signature")
+
+COPY_SQL = """
+WITH m AS (
+    SELECT * FROM unnest(%s::bigint[], %s::bigint[], %s::bigint[], %s::uuid[])
+        AS m(src, tgt, ly, req)
+),
+facts AS (
+    INSERT INTO bps_planningfact
+        (request_id, session_id, layout_year_id, year_id, version_id, {columns})
+    SELECT m.req, m.tgt, m.ly, %s, %s, {source_columns}
+    FROM bps_planningfact f
+    JOIN m ON m.src = f.session_id
+    WHERE f.year_id = %s AND f.version_id = %s{filters}
+    ON CONFLICT ON CONSTRAINT uniq_fact_cell DO {on_conflict}
+    RETURNING id, session_id, period_id, key_figure_id, org_unit_id, service_id,
+              account_id, dim_signature, year_id, version_id
+),
+extras AS (
+    INSERT INTO bps_planningfactextra (fact_id, key_id, content_type_id, object_id, year_id, version_id)
+    SELECT t.id, x.key_id, x.content_type_id, x.object_id, t.year_id, t.version_id
+    FROM facts t
+    JOIN m ON m.tgt = t.session_id
+    JOIN bps_planningfact f
+      ON f.session_id = m.src AND f.year_id = %s AND f.version_id = %s
+     AND f.key_figure_id = t.key_figure_id AND f.org_unit_id = t.org_unit_id
+     AND f.period_id IS NOT DISTINCT FROM t.period_id
+     AND f.service_id IS NOT DISTINCT FROM t.service_id
+     AND f.account_id IS NOT DISTINCT FROM t.account_id
+     AND f.dim_signature = t.dim_signature
+    JOIN bps_planningfactextra x
+      ON x.fact_id = f.id AND x.year_id = f.year_id AND x.version_id = f.version_id
+    WHERE t.dim_signature <> %s
+    ON CONFLICT ON CONSTRAINT uniq_fact_key DO NOTHING
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM facts), (SELECT count(*) FROM extras)
+"""
+
+
+def copy_facts(session_map: Iterable[Tuple[int, int, int, object]], *,
+               from_year_id: int, from_version_id: int, to_year_id: int, to_version_id: int,
+               key_figures: Optional[List[str]] = None, periods: Optional[List[str]] = None,
+               overwrite: bool = True) -> Tuple[int, int]:
+    """
+    Copy facts of (source session, target session, target layout-year, request id)
+    pairs from `from_year/version` to `to_year/version`, optionally only some key
+    figure / period codes. Existing target cells are overwritten (or kept when
+    `overwrite` is False). Returns (facts written, extras copied).
+    """
+    from bps.models.models_extras import EMPTY_SIGNATURE
+
+    session_map = list(session_map)
+    if not session_map:
+        return 0, 0
+    filters, filter_args = "", []
+    if key_figures:
+        ids = [pk for pk in map(dimension_index(KeyFigure).pk_for_code, key_figures) if pk]
+        filters += " AND f.key_figure_id = ANY(%s)"
+        filter_args.append(ids)
+    if periods:
+        ids = [pk for pk in map(dimension_index(Period).pk_for_code, periods) if pk]
+        filters += " AND f.period_id = ANY(%s)"
+        filter_args.append(ids)
+    on_conflict = "NOTHING"
+    if overwrite:
+        on_conflict = ("UPDATE SET request_id = EXCLUDED.request_id, value = EXCLUDED.value, "
+                       "uom_id = EXCLUDED.uom_id, ref_value = EXCLUDED.ref_value, "
+                       "ref_uom_id = EXCLUDED.ref_uom_id")
+    sql = COPY_SQL.format(
+        columns=", ".join(FACT_COLUMNS),
+        source_columns=", ".join(f"f.{c}" for c in FACT_COLUMNS),
+        filters=filters, on_conflict=on_conflict,
+    )
+    src, tgt, lys, reqs = (list(col) for col in zip(*session_map))
+    args = ([src, tgt, lys, [str(r) for r in reqs], to_year_id, to_version_id,
+             from_year_id, from_version_id] + filter_args
+            + [from_year_id, from_version_id, EMPTY_SIGNATURE])
+    with connection.cursor() as cur:
+        cur.execute(sql, args)
+        facts, extras = cur.fetchone()
+    return facts, extras
+
+
+def _scenario_for(source: PlanningScenario, layout_year: PlanningLayoutYear,
+                  to_scenario: Optional[str]) -> PlanningScenario:
+    if to_scenario:
+        return PlanningScenario.objects.get(code=to_scenario, layout_year=layout_year)
+    existing = PlanningScenario.objects.filter(layout_year=layout_year).order_by("-is_active", "pk").first()
+    if existing:
+        return existing
+    scenario = PlanningScenario.objects.create(
+        code=f"{source.code}-{layout_year.version.code}-{layout_year.year.code}"[:50],
+        name=f"{source.name} ({layout_year.version.code} {layout_year.year.code})",
+        layout_year=layout_year,
+    )
+    # same workflow as the source: steps, stages, org units and functions
+    for model in (ScenarioStep, ScenarioStage, ScenarioOrgUnit, ScenarioFunction):
+        rows = list(model.objects.filter(scenario=source))
+        for row in rows:
+            row.pk, row.scenario = None, scenario
+        model.objects.bulk_create(rows)
+    return scenario
+
+
+def _first_step(scenario: PlanningScenario) -> ScenarioStep:
+    step = ScenarioStep.objects.filter(scenario=scenario).order_by("order").first()
+    if step is None:
+        raise ValueError(f"copy_sessions: target scenario {scenario.code} has no steps configured")
+    return step
+
+
+def copy_sessions(sessions: Iterable[PlanningSession], *, to_version, to_year=None,
+                  to_scenario: Optional[str] = None, key_figures=None, periods=None,
+                  overwrite: bool = True, user=None, description: str = "") -> Dict[str, int]:
+    """
+    Copy the facts (with extras) of `sessions` - all on one layout-year - into
+    the same layout under `to_version` / `to_year` (pk or code; year defaults to
+    the source's). Target scenario, sessions and DataRequests are created as
+    needed; ValueError if a session must be created on a scenario without
+    steps. Returns {"facts", "extras", "sessions", "layout_year"}.
+    """
+    sessions = list(sessions)
+    if not sessions:
+        return {"facts": 0, "extras": 0, "sessions": 0, "layout_year": None}
+    src_ly = sessions[0].scenario.layout_year
+    if any(s.scenario.layout_year_id != src_ly.pk for s in sessions):
+        raise ValueError("copy_sessions: sessions must share one layout-year")
+    version_id = dimension_index(Version).resolve(to_version)
+    year_id = dimension_index(Year).resolve(to_year) if to_year is not None else src_ly.year_id
+    if version_id is None or year_id is None:
+        raise ValueError(f"copy_sessions: unknown target version/year {to_version}/{to_year}")
+    if (version_id, year_id) == (src_ly.version_id, src_ly.year_id):
+        raise ValueError("copy_sessions: target version/year equals the source")
+
+    with transaction.atomic():
+        tgt_ly, _ = PlanningLayoutYear.objects.get_or_create(
+            layout_id=src_ly.layout_id, year_id=year_id, version_id=version_id)
+        scenarios = {}
+        first_steps = {}
+        session_map = []
+        for s in sessions:
+            if s.scenario_id not in scenarios:
+                scenarios[s.scenario_id] = _scenario_for(s.scenario, tgt_ly, to_scenario)
+            scenario = scenarios[s.scenario_id]
+            tgt = PlanningSession.objects.filter(scenario=scenario, org_unit_id=s.org_unit_id).first()
+            if tgt is None:
+                if scenario.pk not in first_steps:
+                    first_steps[scenario.pk] = _first_step(scenario)
+                tgt = PlanningSession.objects.create(
+                    scenario=scenario, org_unit_id=s.org_unit_id,
+                    created_by=user, current_step=first_steps[scenario.pk])
+            session_map.append((s.pk, tgt))
+        requests = DataRequest.objects.bulk_create([
+            DataRequest(session=tgt, description=description or f"Copy from {src_ly}", created_by=user)
+            for _src, tgt in session_map
+        ])
+        facts, extras = copy_facts(
+            [(src, tgt.pk, tgt_ly.pk, req.pk) for (src, tgt), req in zip(session_map, requests)],
+            from_year_id=src_ly.year_id, from_version_id=src_ly.version_id,
+            to_year_id=year_id, to_version_id=version_id,
+            key_figures=key_figures, periods=periods, overwrite=overwrite,
+        )
+    return {"facts": facts, "extras": extras, "sessions": len(session_map), "layout_year": tgt_ly.pk}
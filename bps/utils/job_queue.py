@@ -0,0 +1,227 @@
+# bps/utils/job_queue.py
+"""
+Database-backed background jobs: no broker, just the bps_job table.
+
+enqueue() inserts a QUEUED Job; `manage.py bps_worker` processes claim the
+oldest one with SELECT ... FOR UPDATE SKIP LOCKED (concurrent workers never
+block on, or double-run, a job), mark it RUNNING and call the handler
+registered for its kind. While it runs, a heartbeat thread stamps
+`heartbeat_at` and watches `cancel_requested`; handlers report progress
+through JobContext.progress(), which raises JobCancelled once cancellation
+was requested. A RUNNING job whose heartbeat is older than
+BPS_JOB_STALE_SECONDS lost its worker: it is queued again while attempts
+remain, failed otherwise.
+
+Handlers own their transactions, so progress writes are visible to pollers
+immediately. With settings.BPS_JOBS_EAGER the job runs inside enqueue()
+(development without a worker).
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bps.models.models_jobs import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS: Dict[str, Callable[["JobContext"], Any]] = {}
+
+
+class JobCancelled(Exception):
+    """Raised to stop a cancelled job; `result` is kept for work already done."""
+    def __init__(self, message="", result=None):
+        super().__init__(message)
+        self.result = result
+
+
+def job_handler(kind: str):
+    """Register `fn(ctx) -> JSON-able result` as the handler of `kind` jobs."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class JobContext:
+    """What a handler sees: the job, its params and the progress/cancel hooks."""
+
+    def __init__(self, job: Job):
+        self.job = job
+        self.params = job.params or {}
+        self.cancelled = threading.Event()
+
+    def progress(self, percent, message: str = None):
+        """Record `percent` done (0-100); raises JobCancelled if cancellation was requested."""
+        fields = {"progress": max(0, min(100, int(percent))), "heartbeat_at": timezone.now()}
+        if message is not None:
+            fields["message"] = str(message)[:255]
+        Job.objects.filter(pk=self.job.pk).update(**fields)
+        if self.cancelled.is_set() or Job.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            self.cancelled.set()
+            raise JobCancelled(f"Job {self.job.pk} cancelled")
+
+    def reporter(self, message: str = None):
+        """`on_progress(done, total)` callback for the runners; returns False once cancelled."""
+        def report(done, total):
+            try:
+                self.progress(100 * done / total if total else 100, message)
+            except JobCancelled:
+                return False
+            return True
+        return report
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, ctx: JobContext, interval: float):
+        super().__init__(name=f"bps-job-{ctx.job.pk}-heartbeat", daemon=True)
+        self.ctx = ctx
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                Job.objects.filter(pk=self.ctx.job.pk).update(heartbeat_at=timezone.now())
+                if Job.objects.filter(pk=self.ctx.job.pk, cancel_requested=True).exists():
+                    self.ctx.cancelled.set()
+        finally:
+            connection.close()
+
+
+# ── queue operations ────────────────────────────────────────────────────────
+
+def enqueue(kind: str, params: Dict[str, Any] = None, *, user=None, max_attempts: int = 1) -> Job:
+    """Queue a `kind` job (runs it right away under BPS_JOBS_EAGER)."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}; one of {', '.join(sorted(HANDLERS))}")
+    job = Job.objects.create(kind=kind, params=params or {}, created_by=user,
+                             max_attempts=max(1, max_attempts))
+    if _setting("BPS_JOBS_EAGER", False):
+        transaction.on_commit(lambda: run_job(claim(worker="eager", pk=job.pk)))
+    return job
+
+
+def claim(worker: str = None, pk: int = None) -> Optional[Job]:
+    """Take the oldest queued job (or job `pk`) for `worker`; None if there is none."""
+    with transaction.atomic():
+        qs = Job.objects.select_for_update(skip_locked=True).filter(status=Job.Status.QUEUED)
+        if pk is not None:
+            qs = qs.filter(pk=pk)
+        job = qs.order_by("created_at", "pk").first()
+        if job is None:
+            return None
+        now = timezone.now()
+        job.status = Job.Status.RUNNING
+        job.worker = (worker or worker_name())[:100]
+        job.started_at = job.heartbeat_at = now
+        job.attempts += 1
+        job.save(update_fields=["status", "worker", "started_at", "heartbeat_at", "attempts"])
+    return job
+
+
+def run_job(job: Optional[Job]) -> Optional[Job]:
+    """Run a claimed job to completion and record the outcome."""
+    if job is None:
+        return None
+    ctx = JobContext(job)
+    beat = _Heartbeat(ctx, _setting("BPS_JOB_HEARTBEAT_SECONDS", 10))
+    beat.start()
+    status, result, error = Job.Status.SUCCEEDED, None, ""
+    try:
+        if job.cancel_requested:
+            raise JobCancelled(f"Job {job.pk} cancelled")
+        result = HANDLERS[job.kind](ctx)
+    except JobCancelled as exc:
+        status, result = Job.Status.CANCELLED, exc.result
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        status, error = Job.Status.FAILED, f"{type(exc).__name__}: {exc}"
+    finally:
+        beat.stopped.set()
+        beat.join()
+    fields = {"status": status, "result": result, "error": error,
+              "finished_at": timezone.now(), "heartbeat_at": timezone.now()}
+    if status == Job.Status.SUCCEEDED:
+        fields.update(progress=100)
+    Job.objects.filter(pk=job.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return job
+
+
+def cancel(job: Job) -> Job:
+    """Cancel a queued job now; ask a running one to stop at its next progress report."""
+    with transaction.atomic():
+        job = Job.objects.select_for_update().get(pk=job.pk)
+        if job.is_finished:
+            return job
+        if job.status == Job.Status.QUEUED:
+            job.status = Job.Status.CANCELLED
+            job.finished_at = timezone.now()
+        job.cancel_requested = True
+        job.save(update_fields=["status", "finished_at", "cancel_requested"])
+    return job
+
+
+def requeue_stale() -> int:
+    """Queue again (or fail) RUNNING jobs whose worker stopped sending heartbeats."""
+    cutoff = timezone.now() - timedelta(seconds=_setting("BPS_JOB_STALE_SECONDS", 120))
+    touched = 0
+    with transaction.atomic():
+        stale = (Job.objects.select_for_update(skip_locked=True)
+                 .filter(status=Job.Status.RUNNING, heartbeat_at__lt=cutoff))
+        for job in stale:
+            if job.attempts < job.max_attempts and not job.cancel_requested:
+                job.status, job.message = Job.Status.QUEUED, f"Re-queued: worker {job.worker} lost"
+            else:
+                job.status, job.finished_at = Job.Status.FAILED, timezone.now()
+                job.error = f"Worker {job.worker} lost"
+            job.save(update_fields=["status", "message", "error", "finished_at"])
+            touched += 1
+    return touched
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def work(stop: threading.Event = None, *, poll: float = None, burst: bool = False,
+         name: str = None) -> int:
+    """
+    Worker loop: claim and run jobs until `stop` is set (or, with `burst`,
+    until the queue is empty). Returns the number of jobs run.
+    """
+    poll = poll if poll is not None else _setting("BPS_JOB_POLL_SECONDS", 1.0)
+    name = name or worker_name()
+    done, last_sweep = 0, 0.0
+    try:
+        while stop is None or not stop.is_set():
+            if time.monotonic() - last_sweep > 30:
+                requeue_stale()
+                last_sweep = time.monotonic()
+            job = claim(worker=name)
+            if job is None:
+                if burst:
+                    break
+                if stop is not None:
+                    stop.wait(poll)
+                else:
+                    time.sleep(poll)
+                continue
+            run_job(job)
+            done += 1
+    finally:
+        connection.close()
+    return done
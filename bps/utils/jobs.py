@@ -0,0 +1,150 @@
+# bps/utils/jobs.py
+"""
+Built-in background job handlers (bps/utils/job_queue.py), registered when
+the app is ready:
+
+  formula   {"formula", "session" | "sessions": [..], "period", "mode"}
+  function  {"function", "session"}
+  pipeline  {"scenario", "sessions", "workers", "retries", "continue_on_error"}
+  copy      {"layout_year", "to_version", "to_year", "to_scenario", "sessions",
+             "key_figures", "periods", "overwrite"}
+  export    {"layout_year", "session", "search"}  -> CSV in default_storage,
+            limited to the creator's org units unless an enterprise planner
+"""
+import csv
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+
+from .job_queue import JobCancelled, job_handler
+
+EXPORT_DIR = "bps/exports"
+EXPORT_HEADER = ['ID', 'OrgUnit', 'Service', 'Period', 'KeyFigure', 'Value', 'RefValue']
+
+
+@job_handler("formula")
+def run_formula(ctx):
+    from bps.models.models import Formula
+    from bps.models.models_workflow import PlanningSession
+    from bps.views.formula_executor import FormulaExecutor
+    from bps.views.formula_runner import run_formula_parallel
+
+    p = ctx.params
+    formula = Formula.objects.get(pk=p["formula"])
+    period = p.get("period", "01")
+    mode = p.get("mode", "slice")
+    if p.get("sessions"):
+        sessions = PlanningSession.objects.filter(pk__in=p["sessions"]).select_related(
+            "org_unit", "scenario__layout_year")
+        out = run_formula_parallel(formula, sessions, period, mode=mode,
+                                   on_progress=ctx.reporter(f"{formula.name}: sessions"))
+        return {k: out[k] for k in ("ok", "failed", "entries", "seconds")}
+
+    session = PlanningSession.objects.select_related(
+        "org_unit", "scenario__layout_year").get(pk=p["session"])
+    ctx.progress(0, f"{formula.name} on {session}")
+    with transaction.atomic():
+        executor = FormulaExecutor(formula, session, period, mode=mode)
+        entries = executor.execute().count()
+    return {"run": executor.run.pk if executor.run else None, "entries": entries}
+
+
+@job_handler("function")
+def run_function(ctx):
+    from bps.models.models import PlanningFunction
+    from bps.models.models_workflow import PlanningSession
+
+    func = PlanningFunction.objects.get(pk=ctx.params["function"])
+    session = PlanningSession.objects.select_related(
+        "org_unit", "scenario__layout_year").get(pk=ctx.params["session"])
+    ctx.progress(0, f"{func.name} on {session}")
+    with transaction.atomic():
+        result = func.execute(session)
+    return {"result": result if isinstance(result, (int, float, str, type(None))) else str(result)}
+
+
+@job_handler("pipeline")
+def run_scenario_pipeline(ctx):
+    from bps.api.utils import parse_pk_or_code
+    from bps.models.models_workflow import PlanningScenario
+    from bps.views.pipeline_runner import run_pipeline
+
+    p = ctx.params
+    kind, v = parse_pk_or_code(p["scenario"])
+    scenario = PlanningScenario.objects.get(**({"pk": v} if kind == "PK" else {"code": v}))
+    sessions = scenario.sessions.all()
+    if p.get("sessions"):
+        sessions = sessions.filter(pk__in=p["sessions"])
+    run = run_pipeline(scenario, sessions=sessions, workers=p.get("workers"), retries=p.get("retries"),
+                       user=ctx.job.created_by, continue_on_error=p.get("continue_on_error", False),
+                       on_progress=ctx.reporter(f"Pipeline {scenario.code}"))
+    result = {"pipeline_run": run.pk, "status": str(run.status), "steps_ok": run.steps_ok,
+              "steps_failed": run.steps_failed, "steps_skipped": run.steps_skipped,
+              "seconds": run.seconds}
+    if ctx.cancelled.is_set() and run.steps_skipped:
+        raise JobCancelled(f"Pipeline {scenario.code} cancelled", result=result)
+    return result
+
+
+@job_handler("copy")
+def run_copy(ctx):
+    from bps.api.cache import invalidate_layout_year
+    from bps.models.models_workflow import PlanningSession
+    from .fact_copy import copy_sessions
+
+    p = ctx.params
+    sessions = PlanningSession.objects.filter(scenario__layout_year_id=p["layout_year"]).select_related(
+        "scenario__layout_year")
+    if p.get("sessions"):
+        sessions = sessions.filter(pk__in=p["sessions"])
+    ctx.progress(0, f"Copy of layout-year {p['layout_year']}")
+    result = copy_sessions(
+        sessions.order_by("pk"), to_version=p["to_version"], to_year=p.get("to_year"),
+        to_scenario=p.get("to_scenario"), key_figures=p.get("key_figures"), periods=p.get("periods"),
+        overwrite=p.get("overwrite", True), user=ctx.job.created_by,
+        description=f"Copy job #{ctx.job.pk}",
+    )
+    if result["layout_year"]:
+        invalidate_layout_year(result["layout_year"])
+    return result
+
+
+@job_handler("export")
+def run_export(ctx):
+    from bps.access import allowed_orgunits_qs, is_enterprise_planner
+    from bps.models.models import PlanningFact
+
+    p = ctx.params
+    qs = PlanningFact.objects.select_related('org_unit', 'service', 'period', 'key_figure')
+    user = ctx.job.created_by
+    if user is not None and not is_enterprise_planner(user):
+        # only the org units the requesting user may see
+        qs = qs.filter(org_unit__in=allowed_orgunits_qs(user))
+    if p.get("layout_year"):
+        qs = qs.filter(layout_year_id=p["layout_year"])
+    if p.get("session"):
+        qs = qs.filter(session_id=p["session"])
+    if p.get("search"):
+        qs = qs.filter(Q(org_unit__name__icontains=p["search"]) | Q(service__name__icontains=p["search"]))
+    total = qs.count()
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_HEADER)
+    for i, f in enumerate(qs.order_by("pk").iterator(chunk_size=5000), 1):
+        writer.writerow([
+            f.id,
+            f.org_unit.name,
+            f.service.name if f.service else '',
+            f.period.code if f.period else '',
+            f.key_figure.code,
+            f.value,
+            f.ref_value,
+        ])
+        if i % 20000 == 0:
+            ctx.progress(100 * i / total, f"{i} of {total} facts")
+    name = default_storage.save(f"{EXPORT_DIR}/facts-job{ctx.job.pk}.csv",
+                                ContentFile(buf.getvalue().encode()))
+    return {"file": name, "rows": total}
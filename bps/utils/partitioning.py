@@ -0,0 +1,279 @@
+# bps/utils/partitioning.py
+"""
+Optional declarative partitioning of bps_planningfact / bps_planningfactextra.
+
+Layout (PostgreSQL LIST partitioning, two levels):
+
+    bps_planningfact                    PARTITION BY LIST (year_id)
+      bps_planningfact_y<year>          PARTITION BY LIST (version_id)
+        bps_planningfact_y<year>_v<ver>
+    (bps_planningfactextra mirrors it)
+
+Queries that filter on year_id/version_id (every layout-year read does) are
+pruned to one leaf. A closed version is removed by detaching its leaves
+(constant time) instead of a bulk DELETE, and can be attached back later.
+
+Partitioning is off until `manage.py bps_partitions enable` converts the
+tables in place; everything else here is a no-op on a plain table.
+"""
+from django.db import connection, transaction
+
+FACT_TABLE = "bps_planningfact"
+EXTRA_TABLE = "bps_planningfactextra"
+TABLES = (FACT_TABLE, EXTRA_TABLE)
+ARCHIVE_SCHEMA = "bps_archive"
+EXTRA_FACT_FK = "bps_planningfactextra_fact_part_fk"
+
+
+def year_partition(table, year_id):
+    return f"{table}_y{int(year_id)}"
+
+
+def leaf_partition(table, year_id, version_id):
+    return f"{table}_y{int(year_id)}_v{int(version_id)}"
+
+
+def is_partitioned(table=FACT_TABLE) -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT c.relkind = 'p' FROM pg_class c "
+            "WHERE c.oid = to_regclass(%s)",
+            [table],
+        )
+        row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def list_partitions():
+    """[(table, year_id, version_id, rows_estimate)] for every attached leaf."""
+    out = []
+    with connection.cursor() as cur:
+        for table in TABLES:
+            cur.execute(
+                """
+                SELECT leaf.relname, leaf.reltuples::bigint
+                  FROM pg_inherits i1
+                  JOIN pg_class mid  ON mid.oid = i1.inhrelid
+                  JOIN pg_inherits i2 ON i2.inhparent = mid.oid
+                  JOIN pg_class leaf ON leaf.oid = i2.inhrelid
+                 WHERE i1.inhparent = to_regclass(%s)
+                 ORDER BY leaf.relname
+                """,
+                [table],
+            )
+            for name, rows in cur.fetchall():
+                y, v = name[len(table) + 2:].split("_v")
+                out.append((table, int(y), int(v), max(rows, 0)))
+    return out
+
+
+def ensure_partition(year_id, version_id):
+    """Create the year / year+version partitions for both tables if missing."""
+    if not is_partitioned():
+        return False
+    with connection.cursor() as cur:
+        for table in TABLES:
+            ypart = year_partition(table, year_id)
+            cur.execute(
+                f'CREATE TABLE IF NOT EXISTS "{ypart}" PARTITION OF "{table}" '
+                f"FOR VALUES IN ({int(year_id)}) PARTITION BY LIST (version_id)"
+            )
+            cur.execute(
+                f'CREATE TABLE IF NOT EXISTS "{leaf_partition(table, year_id, version_id)}" '
+                f'PARTITION OF "{ypart}" FOR VALUES IN ({int(version_id)})'
+            )
+    return True
+
+
+def _capture(cur, table):
+    """DDL needed to rebuild `table` as a partitioned table."""
+    cur.execute(
+        """
+        SELECT pg_get_indexdef(i.indexrelid)
+          FROM pg_index i
+         WHERE i.indrelid = %s::regclass
+           AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+        """,
+        [table],
+    )
+    indexes = [r[0] for r in cur.fetchall()]
+    cur.execute(
+        """
+        SELECT conname, contype, pg_get_constraintdef(oid), confrelid::regclass::text
+          FROM pg_constraint
+         WHERE conrelid = %s::regclass AND contype IN ('u', 'f', 'c')
+        """,
+        [table],
+    )
+    constraints = cur.fetchall()
+    cur.execute(
+        "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal",
+        [table],
+    )
+    triggers = [r[0] for r in cur.fetchall()]
+    cur.execute(
+        """
+        SELECT conrelid::regclass::text, conname
+          FROM pg_constraint
+         WHERE confrelid = %s::regclass AND contype = 'f' AND conrelid <> confrelid
+        """,
+        [table],
+    )
+    incoming = cur.fetchall()
+    return indexes, constraints, triggers, incoming
+
+
+@transaction.atomic
+def enable_partitioning(stdout=None):
+    """
+    Convert bps_planningfact and bps_planningfactextra into partitioned
+    tables, copying all rows. Foreign keys from other tables into
+    bps_planningfact (DataRequestLog, FormulaRunEntry, PlanningFactDimension)
+    cannot target a partitioned table by id alone and are dropped; Django
+    still cascades deletes through them. Returns the dropped FK names.
+    """
+    def say(msg):
+        if stdout:
+            stdout.write(msg)
+
+    if is_partitioned():
+        say("already partitioned")
+        return []
+
+    with connection.cursor() as cur:
+        cur.execute(f'LOCK TABLE "{FACT_TABLE}", "{EXTRA_TABLE}" IN ACCESS EXCLUSIVE MODE')
+        captured = {t: _capture(cur, t) for t in TABLES}
+
+        cur.execute(
+            f"SELECT DISTINCT year_id, version_id FROM {FACT_TABLE} "
+            "UNION SELECT year_id, version_id FROM bps_planninglayoutyear"
+        )
+        pairs = cur.fetchall()
+
+        for table in TABLES:
+            cur.execute(f'ALTER TABLE "{table}" RENAME TO "{table}_unpartitioned"')
+            cur.execute(
+                f'CREATE TABLE "{table}" (LIKE "{table}_unpartitioned" INCLUDING DEFAULTS) '
+                "PARTITION BY LIST (year_id)"
+            )
+
+        for year_id, version_id in pairs:
+            ensure_partition(year_id, version_id)
+
+        for table in TABLES:
+            cur.execute(f'INSERT INTO "{table}" SELECT * FROM "{table}_unpartitioned"')
+            say(f"{table}: {cur.rowcount} rows copied")
+
+        dropped = []
+        for table in TABLES:
+            dropped += [f"{t}.{name}" for t, name in captured[table][3] if t not in TABLES]
+        cur.execute(f'DROP TABLE "{EXTRA_TABLE}_unpartitioned", "{FACT_TABLE}_unpartitioned" CASCADE')
+
+        for table in TABLES:
+            indexes, constraints, triggers, _incoming = captured[table]
+            seq = f"{table}_id_seq"
+            cur.execute(f'CREATE SEQUENCE IF NOT EXISTS "{seq}" OWNED BY "{table}".id')
+            cur.execute(f"SELECT setval('{seq}', coalesce((SELECT max(id) FROM \"{table}\"), 0) + 1, false)")
+            cur.execute(f"ALTER TABLE \"{table}\" ALTER COLUMN id SET DEFAULT nextval('{seq}')")
+            cur.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY (id, year_id, version_id)')
+
+            for name, contype, definition, target in constraints:
+                if contype == "f" and target == FACT_TABLE:
+                    # fact_id alone cannot reference a partitioned table
+                    continue
+                cur.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}')
+            for ddl in indexes:
+                cur.execute(ddl)
+            for ddl in triggers:
+                cur.execute(ddl)
+
+        cur.execute(
+            f'ALTER TABLE "{EXTRA_TABLE}" ADD CONSTRAINT "{EXTRA_FACT_FK}" '
+            "FOREIGN KEY (fact_id, year_id, version_id) "
+            f'REFERENCES "{FACT_TABLE}" (id, year_id, version_id) DEFERRABLE INITIALLY DEFERRED'
+        )
+    for fk in dropped:
+        say(f"dropped foreign key {fk}")
+    return dropped
+
+
+def _drop_fact_fk(cur, relname, schema="public"):
+    """Drop FKs of a detached extras leaf that point at the fact table."""
+    cur.execute(
+        """
+        SELECT c.conname FROM pg_constraint c
+         WHERE c.conrelid = to_regclass(%s) AND c.contype = 'f'
+           AND c.confrelid = to_regclass(%s)
+        """,
+        [f'"{schema}"."{relname}"', FACT_TABLE],
+    )
+    for (name,) in cur.fetchall():
+        cur.execute(f'ALTER TABLE "{schema}"."{relname}" DROP CONSTRAINT "{name}"')
+
+
+@transaction.atomic
+def detach_partition(year_id, version_id, *, archive=True, drop=False):
+    """
+    Detach the year/version leaves of both tables. With `archive` they move
+    to the bps_archive schema; with `drop` they are dropped. Pivot rows of the
+    detached cells are removed (tombstoned) and their change stamps bumped
+    (no DELETE triggers fire on detach). Returns the sessions affected.
+    """
+    from bps.models.models_view import PIVOT_DELETE_SQL, touch_change_stamps
+
+    if not is_partitioned():
+        raise RuntimeError("bps_planningfact is not partitioned; run 'bps_partitions enable' first")
+    with connection.cursor() as cur:
+        if archive and not drop:
+            cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{ARCHIVE_SCHEMA}"')
+        # extras first: they reference the fact leaf
+        for table in (EXTRA_TABLE, FACT_TABLE):
+            leaf = leaf_partition(table, year_id, version_id)
+            cur.execute(
+                f'ALTER TABLE "{year_partition(table, year_id)}" DETACH PARTITION "{leaf}"'
+            )
+            if table == EXTRA_TABLE:
+                _drop_fact_fk(cur, leaf)
+            if drop:
+                cur.execute(f'DROP TABLE "{leaf}"')
+            elif archive:
+                cur.execute(f'ALTER TABLE "{leaf}" SET SCHEMA "{ARCHIVE_SCHEMA}"')
+        cur.execute(
+            PIVOT_DELETE_SQL.format(where="p.year_id = %s AND p.version_id = %s"),
+            [year_id, version_id],
+        )
+        session_ids = [r[0] for r in cur.fetchall()]
+    touch_change_stamps(session_ids)
+    return len(session_ids)
+
+
+@transaction.atomic
+def attach_partition(year_id, version_id):
+    """
+    Re-attach previously detached (or archived) leaves and rebuild their
+    pivot rows.
+    """
+    from bps.models.models_view import rebuild_pivot
+
+    if not is_partitioned():
+        raise RuntimeError("bps_planningfact is not partitioned; run 'bps_partitions enable' first")
+    with connection.cursor() as cur:
+        for table in (FACT_TABLE, EXTRA_TABLE):
+            leaf = leaf_partition(table, year_id, version_id)
+            cur.execute("SELECT to_regclass(%s) IS NULL", [f'"{ARCHIVE_SCHEMA}"."{leaf}"'])
+            if not cur.fetchone()[0]:
+                cur.execute(f'ALTER TABLE "{ARCHIVE_SCHEMA}"."{leaf}" SET SCHEMA public')
+            ypart = year_partition(table, year_id)
+            cur.execute(
+                f'CREATE TABLE IF NOT EXISTS "{ypart}" PARTITION OF "{table}" '
+                f"FOR VALUES IN ({int(year_id)}) PARTITION BY LIST (version_id)"
+            )
+            cur.execute(f'ALTER TABLE "{ypart}" ATTACH PARTITION "{leaf}" FOR VALUES IN ({int(version_id)})')
+        cur.execute(
+            f"SELECT DISTINCT session_id FROM {FACT_TABLE} WHERE year_id = %s AND version_id = %s",
+            [year_id, version_id],
+        )
+        session_ids = [r[0] for r in cur.fetchall()]
+    return rebuild_pivot(session_ids) if session_ids else 0
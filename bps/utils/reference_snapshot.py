@@ -0,0 +1,131 @@
+# bps/utils/reference_snapshot.py
+"""
+In-memory snapshots of ReferenceData sources for REF() and DISTRIBUTE.
+
+A ReferenceSnapshot sums the facts of a ReferenceData's source version/year
+with one GROUP BY query at the granularity the consumer asks for (period,
+key figure and a tuple of dimensions: fact columns or extras), and answers
+lookups from a dict. Period and key figure can be left open (None) to read
+totals across them.
+
+Snapshots are shared per process and keyed by reference, source
+version/year and dimensions; each carries the source's change stamp
+(FactChangeStamp over the sessions of that version/year), so a write to the
+source or repointing the ReferenceData at another version rebuilds it.
+Consumers that read many cells in one run should hold on to the snapshot
+instead of calling reference_snapshot() per cell.
+"""
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional
+
+from django.db.models import OuterRef, Subquery, Sum
+
+ZERO = Decimal("0")
+ANY = "*"           # key slot of totals across periods / key figures
+MAX_SNAPSHOTS = 32
+
+# ref dimension name -> PlanningFact column
+FACT_COLUMNS = {
+    "orgunit": "org_unit_id", "org_unit": "org_unit_id",
+    "service": "service_id", "account": "account_id",
+    "year": "year_id", "version": "version_id",
+}
+
+_lock = threading.Lock()
+_snapshots: "OrderedDict[tuple, ReferenceSnapshot]" = OrderedDict()
+
+
+class ReferenceSnapshot:
+    """Source totals of one ReferenceData keyed (period, kf, *dims); None = all."""
+
+    def __init__(self, ref, dims: Iterable[str], stamp=None):
+        from bps.models.models import PlanningFact
+        from bps.models.models_extras import PlanningFactExtra
+
+        self.ref = ref
+        self.dims = tuple(d.lower() for d in dims)
+        self.stamp = stamp
+        qs = PlanningFact.objects.filter(
+            version_id=ref.source_version_id, year_id=ref.source_year_id)
+        columns = []
+        for d in self.dims:
+            if d in FACT_COLUMNS:
+                columns.append(FACT_COLUMNS[d])
+                continue
+            alias = f"x_{d}"
+            qs = qs.annotate(**{alias: Subquery(
+                PlanningFactExtra.objects.filter(
+                    fact_id=OuterRef("pk"), key__key__iexact=d,
+                    year_id=OuterRef("year_id"), version_id=OuterRef("version_id"),
+                ).values("object_id")[:1])})
+            columns.append(alias)
+        rows = qs.values("period__code", "key_figure__code", *columns).annotate(total=Sum("value"))
+
+        self.totals: Dict[tuple, Decimal] = {}
+        for r in rows.order_by():
+            values = tuple(r[c] for c in columns)
+            total = r["total"] or ZERO
+            per, kf = r["period__code"], r["key_figure__code"]
+            for key in ((per, kf), (per, ANY), (ANY, kf), (ANY, ANY)):
+                key += values
+                self.totals[key] = self.totals.get(key, ZERO) + total
+
+    def __len__(self):
+        return len(self.totals)
+
+    def value(self, period: Optional[str] = None, kf: Optional[str] = None,
+              dims: Optional[Dict[str, Any]] = None) -> Decimal:
+        """Sum for `period` / `kf` (None = all) and `dims` (instances or pks, by name)."""
+        dims = {k.lower(): getattr(v, "pk", v) for k, v in (dims or {}).items()}
+        try:
+            values = tuple(dims[d] for d in self.dims)
+        except KeyError as exc:
+            raise KeyError(f"snapshot is grouped by {self.dims}, missing {exc}")
+        return self.totals.get((period or ANY, kf or ANY) + values, ZERO)
+
+    def total(self) -> Decimal:
+        """Grand total of the source (facts with any dimension values)."""
+        return sum((v for k, v in self.totals.items() if k[:2] == (ANY, ANY)), ZERO)
+
+
+def source_stamp(ref):
+    from bps.models.models_view import version_year_stamp
+
+    return version_year_stamp(ref.source_version_id, ref.source_year_id)
+
+
+def reference_snapshot(ref, dims: Iterable[str] = ()) -> ReferenceSnapshot:
+    """Current snapshot of `ref` grouped by `dims`, rebuilt if its source changed."""
+    dims = tuple(sorted(d.lower() for d in dims))
+    key = (ref.pk, ref.source_version_id, ref.source_year_id, dims)
+    stamp = source_stamp(ref)
+    snap = _snapshots.get(key)
+    if snap is None or snap.stamp != stamp:
+        snap = ReferenceSnapshot(ref, dims, stamp)
+        with _lock:
+            _snapshots[key] = snap
+            while len(_snapshots) > MAX_SNAPSHOTS:
+                _snapshots.popitem(last=False)
+    return snap
+
+
+def invalidate_references(ref_pk=None) -> None:
+    """Drop cached snapshots (of one ReferenceData, or all)."""
+    with _lock:
+        for key in [k for k in _snapshots if ref_pk is None or k[0] == ref_pk]:
+            del _snapshots[key]
+
+
+def _on_change(sender, instance, **kwargs):
+    invalidate_references(instance.pk)
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete
+
+    from bps.models.models import ReferenceData
+
+    post_save.connect(_on_change, sender=ReferenceData, dispatch_uid="bps-refsnap-save")
+    post_delete.connect(_on_change, sender=ReferenceData, dispatch_uid="bps-refsnap-delete")
@@ -87,7 +87,7 @@ class FormulaForm(forms.ModelForm):
 
     class Meta:
         model = Formula
-        fields = ['layout', 'name', 'loop_dimension', 'expression']
+        fields = ['layout', 'name', 'loop_dimension', 'loop_mode', 'expression']
         widgets = {
             'layout': ModelSelect2(url='bps:layout-autocomplete'),
             'expression': forms.Textarea(attrs={'rows':4}),
@@ -0,0 +1,367 @@
+# formula_compiler.py
+"""
+Compile a Formula once into closures the executor can call per loop combo.
+
+Compilation does all the text work up front - `$SUB` expansion, REF(...)
+rewriting, IF/CASE rewriting, splitting target and source, `ast.parse` -
+and inlines Constants as Decimals. Cell references ``[Dim=…]?.[KF]`` become
+RefTemplates whose `$LOOP` / `$Dim` slots are bound per combo, so the loop
+body only does value lookups and arithmetic.
+
+Compiled formulas are cached per process, keyed by formula pk and a version
+bumped (in Django's cache) whenever a Formula, SubFormula, Constant or
+PlanningKeyFigure is saved or deleted.
+"""
+import ast
+import operator
+import re
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+
+from django.apps import apps
+from django.core.cache import cache
+
+from bps.models.models import Formula, SubFormula, Constant
+from bps.utils.dimension_registry import dimension_index
+from .formula_periods import PERIOD_FUNCTIONS, is_vector, vand, vnot, vor, where
+
+VERSION_KEY = "bps:formula:version"
+
+_re_ref    = re.compile(r"\[([^\[\]]*)\](?:\?\.|\.\?)\[([^\[\]]*)\]")
+_re_subf   = re.compile(r"\$(\w+)")
+_re_refdata = re.compile(r"REF\('([^']+)'\s*(?:,\s*([^\)]*))?\)(?:\?\.\[([^\[\]]*)\])?")
+_re_assign = re.compile(r"\s*(\[[^\[\]]*\](?:\?\.|\.\?)\[[^\[\]]*\])\s*=(?!=)(.*)", re.S)
+_re_case   = re.compile(r"\bCASE\s+(.*?)\s+END\b", re.S)
+_re_arm    = re.compile(r"\bWHEN\s+(.*?)\s+THEN\s+(.*?)(?=\s+WHEN\b|\s+ELSE\b|$)", re.S)
+_re_else   = re.compile(r"\bELSE\s+(.*)$", re.S)
+
+_BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+_CMPOPS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+    ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+Evaluator = Callable[[Any, Dict[str, Any]], Any]   # (executor, dims_map) -> value
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def has_target(expression: str) -> bool:
+    """True if `expression` is a full '[dims]?.[KF] = …' assignment."""
+    return _re_assign.fullmatch(expression) is not None
+
+
+def key_figure_code(kf: str) -> str:
+    """'SUM:FTE' -> 'FTE'."""
+    return kf.split(":", 1)[1] if ":" in kf else kf
+
+
+class RefTemplate:
+    """`[Dim=val,…]?.[KF]` with loop slots left open."""
+    __slots__ = ("kf", "slots")
+
+    def __init__(self, dims: str, kf: str):
+        self.kf = kf.strip()
+        self.slots = []   # (dim, loop_key | None, model, pk | None)
+        for part in filter(None, (p.strip() for p in dims.split(","))):
+            if "=" not in part:
+                raise FormulaError(f"Bad dimension filter '{part}'")
+            name, val = (s.strip() for s in part.split("=", 1))
+            dim = name.lower()
+            model = apps.get_model("bps", name)
+            if val.startswith("$"):
+                loop_key = dim if val.upper() == "$LOOP" else val[1:].lower()
+                self.slots.append((dim, loop_key, model, None))
+            else:
+                pk = dimension_index(model).resolve(val)
+                if pk is None:
+                    raise FormulaError(f"Unknown {model.__name__} '{val}'")
+                self.slots.append((dim, None, model, pk))
+
+    def bind(self, dims_map: Dict[str, Any]) -> Dict[str, Any]:
+        out = {}
+        for dim, loop_key, model, pk in self.slots:
+            if loop_key is not None:
+                try:
+                    out[dim] = dims_map[loop_key]
+                except KeyError:
+                    raise FormulaError(f"${loop_key} is not a loop dimension of this formula")
+            else:
+                out[dim] = dimension_index(model).instance(pk)
+        return out
+
+
+class CompiledFormula:
+    def __init__(self, formula: Formula, version):
+        self.version = version
+        text = self._expand_subformulas(formula.expression, formula.layout_id)
+        m = _re_assign.fullmatch(text)
+        if not m:
+            raise FormulaError("Formula needs a '[dims]?.[key] = <expression>' form")
+        self.target = RefTemplate(*_re_ref.fullmatch(m.group(1)).groups())
+
+        # REF('name', Dim=…)?.[KF] -> __refdata__(i); [Dim=…]?.[KF] -> __ref__(i)
+        self.refdata: List[tuple] = []
+        self.refs: List[RefTemplate] = []
+        self._texts: Dict[str, str] = {}    # placeholder -> source text, for profiling labels
+        def refdata_repl(m):
+            self.refdata.append((m.group(1), RefTemplate(m.group(2) or "", m.group(3) or "")))
+            self._texts[f"__refdata__({len(self.refdata) - 1})"] = m.group(0)
+            return f"__refdata__({len(self.refdata) - 1})"
+        def ref_repl(m):
+            self.refs.append(RefTemplate(*m.groups()))
+            self._texts[f"__ref__({len(self.refs) - 1})"] = m.group(0)
+            return f"__ref__({len(self.refs) - 1})"
+        src = _re_refdata.sub(refdata_repl, m.group(2))
+        src = _re_ref.sub(ref_repl, src)
+        src = re.sub(r"\bIF\(", "__if__(", src)
+        src = _re_case.sub(self._case_call, src).strip()
+
+        # what the formula touches, for slice loading / dependency analysis
+        self.read_kfs = {key_figure_code(r.kf) for r in self.refs}
+        self.reads_any_kf = False    # SHIFT/LOOKUP with a computed key figure
+        self.uses_periods = False    # SHIFT/CUMSUM/... read every period of a cell
+
+        self.constants = {c.name: c.value for c in Constant.objects.all()}
+        try:
+            node = ast.parse(src, mode="eval").body
+        except SyntaxError as exc:
+            raise FormulaError(f"Syntax error in formula: {exc.msg}")
+        self.source = self._compile(node)
+
+    # ---- text stage ------------------------------------------------------
+    @staticmethod
+    def _expand_subformulas(expr: str, layout_id) -> str:
+        subs = dict(SubFormula.objects.filter(layout_id=layout_id).values_list("name", "expression"))
+
+        def expand(text, seen):
+            def repl(m):
+                name = m.group(1)
+                if name not in subs:      # $LOOP / $Dim slots
+                    return m.group(0)
+                if name in seen:
+                    raise FormulaError(f"Sub-formula ${name} references itself")
+                return f"({expand(subs[name], seen | {name})})"
+            return _re_subf.sub(repl, text)
+        return expand(expr, frozenset())
+
+    @staticmethod
+    def _case_call(m) -> str:
+        body = m.group(1)
+        args = []
+        for cond, val in _re_arm.findall(body):
+            args += [cond.strip(), val.strip()]
+        other = _re_else.search(body)
+        args.append(other.group(1).strip() if other else "0")
+        return f"__case__({', '.join(args)})"
+
+    # ---- AST -> closures ---------------------------------------------------
+    def _compile(self, n) -> Evaluator:
+        if isinstance(n, ast.Constant):
+            v = n.value if isinstance(n.value, str) else Decimal(str(n.value))
+            return lambda ex, dims: v
+        if isinstance(n, ast.Name):
+            if n.id not in self.constants:
+                raise FormulaError(f"Unknown constant '{n.id}'")
+            v = self.constants[n.id]
+            return lambda ex, dims: v
+        if isinstance(n, ast.BinOp):
+            op = _BINOPS.get(type(n.op))
+            if op is None:
+                raise FormulaError(f"Unsupported operator {type(n.op).__name__}")
+            left, right = self._compile(n.left), self._compile(n.right)
+            return lambda ex, dims: op(left(ex, dims), right(ex, dims))
+        if isinstance(n, ast.UnaryOp):
+            operand = self._compile(n.operand)
+            if isinstance(n.op, ast.Not):
+                return lambda ex, dims: vnot(operand(ex, dims))
+            if isinstance(n.op, ast.UAdd):
+                return operand
+            return lambda ex, dims: -operand(ex, dims)
+        if isinstance(n, ast.Compare):
+            first = self._compile(n.left)
+            if any(type(o) not in _CMPOPS for o in n.ops):
+                raise FormulaError("Unsupported comparison")
+            rest = [(_CMPOPS[type(o)], self._compile(c)) for o, c in zip(n.ops, n.comparators)]
+            def compare(ex, dims):
+                left, result = first(ex, dims), True
+                for op, fn in rest:
+                    right = fn(ex, dims)
+                    result = vand(result, op(left, right))
+                    left = right
+                return result
+            return compare
+        if isinstance(n, ast.BoolOp):
+            parts = [self._compile(v) for v in n.values]
+            join = vand if isinstance(n.op, ast.And) else vor
+            def boolop(ex, dims):
+                result = parts[0](ex, dims)
+                for p in parts[1:]:
+                    result = join(result, p(ex, dims))
+                return result
+            return boolop
+        if isinstance(n, ast.Call) and isinstance(n.func, ast.Name):
+            return self._timed(self._label(n), self._compile_call(n.func.id, n))
+        raise FormulaError(f"Unsupported expression: {ast.dump(n)[:60]}")
+
+    def _compile_call(self, name: str, n: ast.Call) -> Evaluator:
+        args = [self._compile(a) for a in n.args]
+        if name == "__ref__":
+            ref = self.refs[n.args[0].value]
+            return lambda ex, dims: ex._aggregate_or_fetch(ref.kf, ref.bind(dims))
+        if name == "__if__":
+            if len(args) != 3:
+                raise FormulaError("IF takes (condition, then, else)")
+            cond, then, other = args
+            def if_(ex, dims):
+                c = cond(ex, dims)
+                if is_vector(c):
+                    return where(c, then(ex, dims), other(ex, dims))
+                return then(ex, dims) if c else other(ex, dims)
+            return if_
+        if name == "__case__":
+            arms = list(zip(args[:-1:2], args[1:-1:2]))
+            other = args[-1]
+            def case(ex, dims):
+                result = other(ex, dims)
+                for cond, val in reversed(arms):
+                    c = cond(ex, dims)
+                    if is_vector(c):
+                        result = where(c, val(ex, dims), result)
+                    elif c:
+                        result = val(ex, dims)
+                return result
+            return case
+        if name in PERIOD_FUNCTIONS:
+            return self._compile_period_call(name, n, args)
+        if name == "LOOKUP":
+            self._note_kf_arg(n)
+            kf = args[0]
+            overrides = [(kw.arg, self._compile(kw.value)) for kw in n.keywords]
+            return lambda ex, dims: ex._lookup(
+                kf(ex, dims), dims, {k: fn(ex, dims) for k, fn in overrides})
+        if name == "__refdata__":
+            ref_name, ref = self.refdata[n.args[0].value]
+            return lambda ex, dims: ex._reference_value(ref_name, ref.kf, ref.bind(dims))
+        raise FormulaError(f"Unknown function '{name}'")
+
+    def _label(self, n) -> str:
+        text = ast.unparse(n)
+        for placeholder, source in self._texts.items():
+            text = text.replace(placeholder, source)
+        return text.replace("__if__(", "IF(").replace("__case__(", "CASE(")
+
+    @staticmethod
+    def _timed(label: str, fn: Evaluator) -> Evaluator:
+        """Accumulate inclusive time of `fn` into executor.timings while profiling."""
+        def timed(ex, dims):
+            timings = ex.timings
+            if timings is None:
+                return fn(ex, dims)
+            started = time.perf_counter()
+            try:
+                return fn(ex, dims)
+            finally:
+                slot = timings.setdefault(label, [0, 0.0])
+                slot[0] += 1
+                slot[1] += time.perf_counter() - started
+        return timed
+
+    def _note_kf_arg(self, n: ast.Call, i: int = 0):
+        arg = n.args[i] if len(n.args) > i else None
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            self.read_kfs.add(key_figure_code(arg.value))
+        elif not (isinstance(arg, ast.Call) and getattr(arg.func, "id", None) == "__ref__"):
+            self.reads_any_kf = True
+
+    def _compile_period_call(self, name: str, n: ast.Call, args) -> Evaluator:
+        """
+        SHIFT / CUMSUM / YTD / ROLLING_AVG / PERIOD_SPREAD: the series argument
+        (a key-figure code on the loop cell, or a cell reference) is read as a
+        period vector; the executor picks the run's period from the result.
+        """
+        fn, pos = PERIOD_FUNCTIONS[name]
+        self.uses_periods = True
+        if len(n.args) <= pos:
+            if name != "PERIOD_SPREAD":
+                raise FormulaError(f"{name} needs a key figure or cell reference")
+            total = args[0]
+            return lambda ex, dims: ex._at_period(fn(total(ex, dims), n=ex._period_count()))
+        self._note_kf_arg(n, pos)
+        arg = n.args[pos]
+        if isinstance(arg, ast.Call) and getattr(arg.func, "id", None) == "__ref__":
+            ref = self.refs[arg.args[0].value]
+            series = lambda ex, dims: ex._period_vector(ref.kf, ref.bind(dims))
+        else:
+            inner = args[pos]
+            series = lambda ex, dims: ex._as_vector(inner(ex, dims), dims)
+        others = [a for i, a in enumerate(args) if i != pos]
+        if pos == 0:
+            return lambda ex, dims: ex._at_period(fn(series(ex, dims), *(a(ex, dims) for a in others)))
+        return lambda ex, dims: ex._at_period(fn(others[0](ex, dims), series(ex, dims)))
+
+    # ---- per combo -----------------------------------------------------------
+    def evaluate(self, executor, dims_map: Dict[str, Any]):
+        """Decimal result, or a PeriodVector when the executor runs all periods."""
+        value = self.source(executor, dims_map)
+        if is_vector(value):
+            return value.map(lambda v: Decimal(str(round(v, 4))))
+        return Decimal(str(round(value, 4)))
+
+
+_lock = threading.Lock()
+_compiled: Dict[Any, CompiledFormula] = {}
+
+
+def formula_version() -> int:
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def compile_formula(formula: Formula, key=None) -> CompiledFormula:
+    """
+    Cached CompiledFormula for `formula` (recompiled after any formula/constant
+    edit). `key` names the cache slot of unsaved formulas; defaults to the pk.
+    """
+    key = formula.pk if key is None else key
+    version = (formula_version(), formula.expression)
+    hit = _compiled.get(key)
+    if hit is not None and hit.version == version:
+        return hit
+    with _lock:
+        hit = _compiled.get(key)
+        if hit is None or hit.version != version:
+            hit = CompiledFormula(formula, version)
+            if key is not None:
+                _compiled[key] = hit
+    return hit
+
+
+def invalidate_formulas(**kwargs):
+    if not cache.add(VERSION_KEY, 2, None):
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 2, None)
+    _compiled.clear()
+
+
+def connect_signals():
+    from django.db.models.signals import post_save, post_delete
+
+    from bps.models.models_layout import PlanningKeyFigure
+
+    for model in (Formula, SubFormula, Constant, PlanningKeyFigure):
+        uid = f"bps-formula-{model._meta.model_name}"
+        post_save.connect(invalidate_formulas, sender=model, dispatch_uid=f"{uid}-save")
+        post_delete.connect(invalidate_formulas, sender=model, dispatch_uid=f"{uid}-delete")
@@ -1,14 +1,25 @@
 # formula_executor.py
-import re, ast, operator, itertools
+import itertools
 from decimal import Decimal
-from typing import Any, Dict, List
+from typing import Any, Dict
 from django.apps import apps
+from django.conf import settings
 from django.db.models import Sum, Avg, Min, Max, Q
 from bps.models.models import (
-    PlanningFact, Formula, Constant, SubFormula,
+    PlanningFact, Formula,
     FormulaRun, FormulaRunEntry, ReferenceData, Period
 )
 from bps.models.models import KeyFigure, DataRequest
+from bps.models.models_layout import LayoutDimensionOverride
+from bps.models.models_extras import DimensionKey, PlanningFactExtra, dimension_signature
+from bps.models.models_view import session_stamp
+from bps.api.cache import invalidate_layout_year
+from bps.utils.dimension_registry import dimension_index
+from .formula_compiler import FormulaError, compile_formula
+from .formula_periods import PeriodVector, is_vector
+from .formula_profile import FormulaProfiler
+from .formula_preview import FormulaDiff
+from .formula_slice import FactSlice
 
 # Extendable aggregation functions
 _AGG_FUNCS = {
@@ -19,173 +30,267 @@ _AGG_FUNCS = {
 }
 
 class FormulaExecutor:
-    _re_refdata = re.compile(r"REF\('([^']+)'\s*,\s*([^\)]+)\)")
-    _re_subf   = re.compile(r"\$(\w+)")
-    _re_const  = re.compile(r"\b[A-Z_][A-Z0-9_]*\b")
-    _re_ref    = re.compile(r"\[(.*?)\]\.\?\[(.*?)\]")
+    """
+    Runs a Formula for one session/period over every combination of its
+    loop dimensions.
 
-    def __init__(self, formula: Formula, session, period: str, preview: bool=False):
+    mode="slice" (default) loads the facts the formula touches into a
+    FactSlice, evaluates all combinations in memory and writes the results
+    back in bulk; mode="row" reads and writes each cell with its own queries.
+
+    period=ALL_PERIODS evaluates the expression once per combination over
+    period vectors (every period of the cell at once) and writes all periods;
+    it always runs in slice mode.
+
+    preview=True writes nothing: execute() returns an in-memory FormulaDiff
+    (see formula_preview.py) whose commit() applies it later.
+
+    profile=True (default settings.BPS_FORMULA_PROFILE) records timings, query
+    and row counts and the slowest sub-expressions on the FormulaRun;
+    cprofile=True also stores a cProfile dump (formula_profile.py).
+    """
+    SLICE = "slice"
+    ROW = "row"
+    ALL_PERIODS = "ALL"
+    BATCH_SIZE = 2000
+
+    def __init__(self, formula: Formula, session, period: str, preview: bool=False, mode: str=SLICE,
+                 dimensions=None, compiled=None, profile: bool=None, cprofile: bool=False):
         self.formula = formula
         self.session = session
         self.period  = period
         self.preview = preview
+        self.vector  = period == self.ALL_PERIODS
+        self.mode    = self.SLICE if self.vector or preview else mode
         self.run     = None
-        # ContentType model abbreviations for looping dims
-        self.dim_cts = list(formula.dimensions.all())
+        # ContentType model abbreviations for looping dims (given for unsaved formulas)
+        self.dim_cts = list(dimensions) if dimensions is not None else list(formula.dimensions.all())
+        self._dim_keys = None
+        self.compiled = compiled or compile_formula(formula)
+        self.slice   = None
+        self._periods = None
+        self._references = {}   # (name, dims) -> ReferenceSnapshot, held for the run
+        if profile is None:
+            profile = getattr(settings, "BPS_FORMULA_PROFILE", False)
+        self.profiler = FormulaProfiler(cprofile=cprofile) if profile or cprofile else None
+        self.timings = self.profiler.timings if self.profiler else None
 
     def execute(self):
-        # create a FormulaRun record
-        self.run = FormulaRun.objects.create(formula=self.formula,
-                                             preview=self.preview)
-        # build loops over each dimension
-        loops = []
-        for ct in self.dim_cts:
-            Model = ct.model_class()
-            loops.append([(ct, obj) for obj in Model.objects.all()])
-
-        # iterate all combinations
-        for combo in itertools.product(*loops):
-            dims_map = {ct.model: inst for ct,inst in combo}
-            self._apply(dims_map)
+        # create a FormulaRun record (computed key figures have no Formula row to audit)
+        if self.formula.pk is not None and not self.preview:
+            self.run = FormulaRun.objects.create(formula=self.formula)
+        if self.profiler is None:
+            return self._execute()
+        with self.profiler:
+            result = self._execute()
+        if self.run is not None:
+            self.profiler.save(self.run)
+        return result
 
+    def _execute(self):
+        stamp = session_stamp(self.session.pk) if self.preview else None
+        if self.mode == self.SLICE:
+            c = self.compiled
+            self.slice = FactSlice(
+                self.session,
+                None if c.reads_any_kf else c.read_kfs | {c.target.kf},
+                None if c.uses_periods or self.vector else [self.period],
+            )
+            self._pending = {}   # (period, cell) -> (row, old value, extras pairs, new value)
+            if self.profiler:
+                self.profiler.rows_read += len(self.slice.cells)
+
+        # iterate all combinations of the loop domain
+        apply = self._apply_slice if self.slice is not None else self._apply
+        for dims_map in self._combinations():
+            apply(dims_map)
+            if self.profiler:
+                self.profiler.combinations += 1
+
+        if self.preview:
+            return FormulaDiff.from_pending(self, stamp)
+        if self.slice is not None:
+            self._flush()
+
+        invalidate_layout_year(self.session.scenario.layout_year_id)
+        if self.run is None:
+            return FormulaRunEntry.objects.none()
         return self.run.entries.all()
 
-    def _apply(self, dims_map: Dict[str,Any]):
-        # prepare expression
-        expr = self.formula.expression
-        expr = self._expand_subformulas(expr)
-        expr = self._replace_reference_data(expr, dims_map)
-        expr = self._replace_constants(expr)
-        expr = self._rewrite_conditionals(expr)
+    def _combinations(self):
+        """dims_map per loop combination, over the domain set by formula.loop_mode."""
+        keys = [ct.model for ct in self.dim_cts]
+        indexes = [dimension_index(ct.model_class()) for ct in self.dim_cts]
+        mode = self.formula.loop_mode
 
-        # split LHS and RHS
-        tgt, src = map(str.strip, expr.split('=',1))
-        key_fig, tgt_dims = self._parse_ref(tgt, dims_map)
+        if mode == Formula.LoopMode.DATA:
+            # sparse: only tuples that occur in the facts the formula reads
+            c = self.compiled
+            kfs = None if c.reads_any_kf else (c.read_kfs or {c.target.kf})
+            period = None if self.vector else self.period
+            source = self.slice or FactSlice(self.session, kfs, [self.period])
+            for values in sorted(source.combinations(kfs, period, keys)):
+                if all(pk in idx for pk, idx in zip(values, indexes)):
+                    yield {k: idx.instance(pk) for k, idx, pk in zip(keys, indexes, values)}
+            return
 
-        # replace inline refs and evaluate
-        src_eval = self._replace_refs_with_values(src, dims_map)
-        result   = self._safe_eval(src_eval, dims_map)
+        if mode == Formula.LoopMode.ALLOWED:
+            members = [self._allowed_members(ct, idx) for ct, idx in zip(self.dim_cts, indexes)]
+        else:
+            members = [sorted(idx.labels) for idx in indexes]
+        for values in itertools.product(*members):
+            yield {k: idx.instance(pk) for k, idx, pk in zip(keys, indexes, values)}
+
+    def _allowed_members(self, ct, index):
+        """Layout-year allowed values for one loop dimension (all members if unrestricted)."""
+        override = LayoutDimensionOverride.objects.filter(
+            layout_year_id=self.session.scenario.layout_year_id, dimension__content_type=ct,
+        ).first()
+        if override is None or not override.allowed_values:
+            return sorted(index.labels)
+        pks = (index.resolve(v) for v in override.allowed_values)
+        return sorted({pk for pk in pks if pk is not None})
+
+    def _apply(self, dims_map: Dict[str,Any]):
+        # compiled once per formula: only lookups and arithmetic per combo
+        result = self.compiled.evaluate(self, dims_map)
+        target = self.compiled.target
 
         # get or create target record
-        rec = self._get_record(key_fig, tgt_dims, create=not self.preview)
-        old = getattr(rec, key_fig, 0)
+        rec = self._get_record(target.kf, target.bind(dims_map), create=not self.preview)
+        old = rec.value
         if not self.preview:
-            setattr(rec, key_fig, result)
+            rec.value = result
             rec.save()
+            if self.profiler:
+                self.profiler.rows_written += 1
 
         # log entry
-        FormulaRunEntry.objects.create(
-            run=self.run, record=rec,
-            key=key_fig, old_value=old, new_value=result
+        if self.run is not None:
+            FormulaRunEntry.objects.create(
+                run=self.run, record=rec,
+                key=target.kf, old_value=old, new_value=result
+            )
+
+    def _apply_slice(self, dims_map: Dict[str,Any]):
+        result = self.compiled.evaluate(self, dims_map)
+        kf = self.compiled.target.kf
+        cell, pairs = self._target_cell(kf, self.compiled.target.bind(dims_map))
+        if not self.vector:
+            self._write_cell(self.period, kf, cell, pairs, result)
+            return
+        if not is_vector(result):
+            result = PeriodVector([result] * len(self._period_codes()))
+        for period, value in zip(self._period_codes(), result):
+            self._write_cell(period, kf, cell, pairs, value)
+
+    def _write_cell(self, period, kf, cell, pairs, result):
+        row = self.slice.cell(period, kf, *cell)
+        if row is None:
+            org, svc, acct, signature = cell
+            row = {"id": None, "org_unit": org, "service": svc, "account": acct,
+                   "signature": signature, "value": Decimal("0"),
+                   "extras": {dk.key.lower(): pk for dk, pk in pairs}}
+            self.slice.insert(period, kf, row)
+        key = (period, cell)
+        old = self._pending[key][1] if key in self._pending else row["value"]
+        if not self.preview:
+            row["value"] = result
+        self._pending[key] = (row, old, pairs, result)
+
+    def apply_changes(self, changes, user=None) -> FormulaRun:
+        """Write the changes of a committed FormulaDiff, with one FormulaRun."""
+        if self._dim_keys is None:
+            self._dim_keys = {dk.key.lower(): dk for dk in DimensionKey.objects.all()}
+        self._pending = {}
+        for c in changes:
+            org, svc, acct, signature = c["cell"]
+            row = {"id": c["record"], "org_unit": org, "service": svc, "account": acct,
+                   "signature": signature, "value": c["old"], "extras": c["extras"]}
+            pairs = [(self._dim_keys[k], pk) for k, pk in c["extras"].items()]
+            self._pending[(c["period"], (org, svc, acct, signature))] = (row, c["old"], pairs, c["new"])
+        self.run = FormulaRun.objects.create(formula=self.formula, run_by=user)
+        self._flush()
+        invalidate_layout_year(self.session.scenario.layout_year_id)
+        return self.run
+
+    def _flush(self):
+        """Write slice results and run entries back with bulk statements."""
+        if not self._pending:
+            return
+        ly = self.session.scenario.layout_year
+        kfs, periods = dimension_index(KeyFigure), dimension_index(Period)
+        kf_id = kfs.pk_for_code(self.compiled.target.kf)
+        if kf_id is None:
+            raise KeyFigure.DoesNotExist(f"KeyFigure {self.compiled.target.kf} does not exist")
+        per_ids = {}
+        for period, _cell in self._pending:
+            per_ids[period] = periods.pk_for_code(period)
+            if per_ids[period] is None:
+                raise Period.DoesNotExist(f"Period {period} does not exist")
+
+        facts_qs = PlanningFact.objects.filter(year_id=ly.year_id, version_id=ly.version_id)
+        request = DataRequest.objects.create(
+            session=self.session, description=f"Formula {self.formula.name}")
+        existing = [(row, new) for row, _old, _pairs, new in self._pending.values()
+                    if row["id"] is not None]
+        facts_qs.bulk_update(
+            [PlanningFact(id=row["id"], value=new, request=request) for row, new in existing],
+            ["request", "value"], batch_size=self.BATCH_SIZE,
         )
+        created = [(key, spec) for key, spec in self._pending.items() if spec[0]["id"] is None]
+        new_facts = [
+            PlanningFact(
+                request=request, session=self.session, layout_year_id=ly.pk,
+                period_id=per_ids[period], key_figure_id=kf_id,
+                org_unit_id=org, service_id=svc, account_id=acct,
+                year_id=ly.year_id, version_id=ly.version_id,
+                uom=None, ref_uom=None, value=new, ref_value=Decimal("0"),
+                dim_signature=signature,
+            )
+            for (period, (org, svc, acct, signature)), (_row, _old, _pairs, new) in created
+        ]
+        PlanningFact.objects.bulk_create(new_facts, batch_size=self.BATCH_SIZE)
+        PlanningFactExtra.objects.bulk_create([
+            PlanningFactExtra(fact_id=fact.pk, key=dk, content_type_id=dk.content_type_id,
+                              object_id=pk, year_id=fact.year_id, version_id=fact.version_id)
+            for fact, (_cell, (_row, _old, pairs, _new)) in zip(new_facts, created)
+            for dk, pk in pairs
+        ], batch_size=self.BATCH_SIZE)
+        for fact, (_cell, (row, *_rest)) in zip(new_facts, created):
+            row["id"] = fact.pk
+
+        if self.profiler:
+            self.profiler.rows_written += len(self._pending)
+        if self.run is None:
+            return
+        FormulaRunEntry.objects.bulk_create([
+            FormulaRunEntry(run=self.run, record_id=row["id"], key=self.compiled.target.kf,
+                            old_value=old, new_value=new)
+            for row, old, _pairs, new in self._pending.values()
+        ], batch_size=self.BATCH_SIZE)
+
+    @staticmethod
+    def _dim_instance(model_name: str, val):
+        index = dimension_index(apps.get_model('bps', model_name))
+        return index.instance(index.resolve(val))
 
-    def _expand_subformulas(self, expr: str) -> str:
-        def repl(m):
-            sub = SubFormula.objects.get(name=m.group(1),
-                                         layout=self.formula.layout)
-            return f"({self._expand_subformulas(sub.expression)})"
-        return self._re_subf.sub(repl, expr)
-
-    def _replace_constants(self, expr: str) -> str:
-        def repl(m):
-            val = Constant.objects.get(name=m.group(0)).value
-            return str(val)
-        return self._re_const.sub(repl, expr)
-
-    def _rewrite_conditionals(self, expr: str) -> str:
-        expr = re.sub(r"\bIF\(", "__if__(", expr)
-        def case_repl(m):
-            body = m.group(1)
-            return f"__case__([{body}])"
-        expr = re.sub(r"\bCASE\s+(.*?)\s+END", case_repl, expr, flags=re.S)
-        return expr
-
-    # conditional helpers
-    def __if__(self, cond, tval, fval):
-        return tval if cond else fval
-
-    def __case__(self, arms: List[str]):
-        for arm in arms:
-            text = arm.strip()
-            if text.upper().startswith("WHEN"):
-                _, cond, _, val = re.split(r"\s+", text, maxsplit=3)
-                if self._safe_eval(cond, {}):
-                    return self._safe_eval(val, {})
-            elif text.upper().startswith("ELSE"):
-                return self._safe_eval(text.split(None,1)[1], {})
-        return Decimal('0')
-
-    def _parse_ref(self, token: str, dims_map: Dict[str,Any]):
-        m = self._re_ref.match(token)
-        dims, kf = m.groups()
-        fldmap = {}
-        for d in dims.split(','):
-            name,val = d.split('=')
-            name,val = name.strip(), val.strip()
-            if val == '$LOOP':
-                inst = dims_map[name]
+    def _fact_filter(self, fkwargs: Dict[str,Any]) -> Q:
+        """Bound ref dims -> PlanningFact filter (FK columns or extras)."""
+        cond = Q()
+        for dim, inst in fkwargs.items():
+            if dim in ("orgunit", "org_unit"):  cond &= Q(org_unit=inst)
+            elif dim in ("service", "account"): cond &= Q(**{dim: inst})
+            elif dim in ("year", "version"):    cond &= Q(**{dim: inst})
             else:
-                inst = apps.get_model('bps',name).objects.get(pk=int(val))
-            fldmap[name.lower()] = inst
-        return kf, fldmap
-
-    def _replace_refs_with_values(self, expr: str, dims_map: Dict[str,Any]) -> str:
-        def repl(m):
-            dims, k = m.groups()
-            fkwargs = {}
-            for d in dims.split(','):
-                n,v = d.split('=')
-                n,v = n.strip(), v.strip()
-                if v == '$LOOP':
-                    inst = dims_map[n]
-                else:
-                    inst = apps.get_model('bps',n).objects.get(pk=int(v))
-                fkwargs[n.lower()] = inst
-            return f"__ref__('{k}',{fkwargs})"
-        return self._re_ref.sub(repl, expr)
-
-    def _safe_eval(self, expr: str, dims_map: Dict[str,Any]) -> Decimal:
-        # build namespace including new FOX functions
-        def shift_func(k, offset):
-            return self._shift(k, offset, dims_map)
-        def lookup_func(k, **overrides):
-            return self._lookup(k, dims_map, overrides)
-
-        ns = {
-            '__if__': self.__if__,
-            '__case__': self.__case__,
-            '__ref__': lambda k, kwargs: self._aggregate_or_fetch(k, kwargs),
-            'SHIFT': shift_func,
-            'LOOKUP': lookup_func,
-        }
-
-        node = ast.parse(expr, mode='eval').body
-        def _eval(n):
-            if isinstance(n, ast.Call):
-                func = _eval(n.func)
-                args = [_eval(a) for a in n.args]
-                kwargs = {kw.arg: _eval(kw.value) for kw in n.keywords}
-                return func(*args, **kwargs)
-            if isinstance(n, ast.BinOp):
-                return {
-                  ast.Add: operator.add,
-                  ast.Sub: operator.sub,
-                  ast.Mult: operator.mul,
-                  ast.Div: operator.truediv,
-                  ast.Pow: operator.pow,
-                }[type(n.op)](_eval(n.left), _eval(n.right))
-            if isinstance(n, ast.UnaryOp):
-                return operator.neg(_eval(n.operand))
-            if isinstance(n, ast.Name):
-                return ns[n.id]
-            if isinstance(n, ast.Constant):
-                return Decimal(str(n.value))
-            raise ValueError(f"Unsupported AST node: {n}")
-
-        return Decimal(str(round(_eval(node),4)))
-
-    def _aggregate_or_fetch(self, kf: str, fkwargs: Dict[str,Any]) -> Decimal:
-        # original aggregation or direct fetch
+                cond &= Q(pk__in=PlanningFactExtra.objects.filter(
+                    key__key__iexact=dim, object_id=inst.pk).values("fact_id"))
+        return cond
+
+    def _aggregate_or_fetch(self, kf: str, fkwargs: Dict[str,Any]):
+        # original aggregation or direct fetch (a period vector when running all periods)
+        if self.vector:
+            return self._period_vector(kf, fkwargs)
         return self._aggregate_or_fetch_for_period(kf, fkwargs, self.period)
 
     def _aggregate_or_fetch_for_period(self, kf: str, fkwargs: Dict[str,Any], period_code: str) -> Decimal:
@@ -193,78 +298,129 @@ class FormulaExecutor:
         for fn, aggfunc in _AGG_FUNCS.items():
             if kf.upper().startswith(fn + ':'):
                 real_kf = kf.split(':',1)[1]
+                if self.slice is not None:
+                    return self.slice.aggregate(fn, period_code, real_kf, fkwargs)
                 agg = aggfunc('value')
                 qs = PlanningFact.objects.filter(
+                    self._fact_filter(fkwargs),
                     session=self.session,
                     period__code=period_code,
                     key_figure__code=real_kf,
-                    **{dim:inst for dim,inst in fkwargs.items()}
                 ).aggregate(agg)
                 return Decimal(str(qs[f"value__{fn.lower()}"] or 0))
         # direct fetch
+        if self.slice is not None:
+            return self.slice.value(period_code, kf, fkwargs)
         rec = PlanningFact.objects.filter(
+            self._fact_filter(fkwargs),
             session=self.session,
             period__code=period_code,
             key_figure__code=kf,
-            **{dim:inst for dim,inst in fkwargs.items()}
         ).first()
+        if self.profiler and rec is not None:
+            self.profiler.rows_read += 1
         return rec.value if rec else Decimal('0')
 
-    def _shift(self, kf: str, offset: Any, dims_map: Dict[str,Any]) -> Decimal:
-        # shift the period by offset and fetch
-        all_codes = list(Period.objects.order_by('order').values_list('code', flat=True))
+    def _period_codes(self):
+        if self._periods is None:
+            self._periods = list(Period.objects.order_by('order').values_list('code', flat=True))
+        return self._periods
+
+    def _period_count(self) -> int:
+        return len(self._period_codes())
+
+    def _period_vector(self, kf: str, fkwargs: Dict[str,Any]) -> PeriodVector:
+        # one value per period, in period order
+        return PeriodVector(self._aggregate_or_fetch_for_period(kf, fkwargs, code)
+                            for code in self._period_codes())
+
+    def _as_vector(self, value, dims_map: Dict[str,Any]) -> PeriodVector:
+        # series argument of a period function: vector, or a key figure code on the loop cell
+        if is_vector(value):
+            return value
+        if isinstance(value, str):
+            return self._period_vector(value, dims_map)
+        if self.vector:
+            return PeriodVector([value] * self._period_count())
+        raise FormulaError("Period functions need a key figure or cell reference")
+
+    def _at_period(self, vec: PeriodVector):
+        # the run's period of a period-function result (all of it when vectorized)
+        if self.vector:
+            return vec
         try:
-            idx = all_codes.index(self.period)
+            return vec[self._period_codes().index(self.period)]
         except ValueError:
             return Decimal('0')
-        ni = idx + int(offset)
-        if ni < 0 or ni >= len(all_codes):
-            return Decimal('0')
-        new_period = all_codes[ni]
-        return self._aggregate_or_fetch_for_period(kf, dims_map, new_period)
 
     def _lookup(self, kf: str, base_dims: Dict[str,Any], overrides: Dict[str,Any]) -> Decimal:
         # override one or more dimensions, then fetch
         dims = base_dims.copy()
         for dim_name, val in overrides.items():
             try:
-                inst = apps.get_model('bps', dim_name).objects.get(pk=int(val))
-                dims[dim_name] = inst
+                dims[dim_name.lower()] = self._dim_instance(dim_name, val)
             except Exception:
                 continue
-        return self._aggregate_or_fetch_for_period(kf, dims, self.period)
+        return self._aggregate_or_fetch(kf, dims)
 
-    def _replace_reference_data(self, expr: str, _dims_map) -> str:
-        # REF('RefName', filters...) -> __refdata__('RefName', {...})
-        def repl(m):
-            name = m.group(1)
-            tail = m.group(2)
-            return f"__refdata__('{name}', {{{tail}}})"
-        return self._re_refdata.sub(repl, expr)
+    def _reference_value(self, name: str, kf: str, fkwargs: Dict[str,Any]):
+        # REF('RefName', Dim=…)?.[KF]: same cell in the reference version/year
+        key = (name, tuple(sorted(fkwargs)))
+        snap = self._references.get(key)
+        if snap is None:
+            snap = ReferenceData.objects.get(name=name).snapshot(key[1])
+            self._references[key] = snap
+        if self.vector:
+            return PeriodVector(snap.value(code, kf, fkwargs) for code in self._period_codes())
+        return snap.value(self.period, kf, fkwargs)
 
-    def _get_record(self, kf_code: str, dims: dict, create: bool):
-        period = Period.objects.get(code=self.period)
-        kf     = KeyFigure.objects.get(code=kf_code)
-        # Map known dims to explicit fields; everything else -> extra_dimensions_json
-        known = {}
+    def _target_cell(self, kf_code: str, dims: dict):
+        """((org, service, account, signature), extras pairs) of a target ref."""
+        # Map known dims to explicit fields; everything else -> PlanningFactExtra
+        known = {"org_unit": self.session.org_unit_id, "service": None, "account": None}
         extra = {}
         for k, inst in dims.items():
-            if k in ("orgunit", "org_unit"):   known["org_unit"] = inst
-            elif k in ("service",):            known["service"]  = inst
-            elif k in ("account",):            known["account"]  = inst
+            if k in ("orgunit", "org_unit"):   known["org_unit"] = inst.pk
+            elif k in ("service",):            known["service"]  = inst.pk
+            elif k in ("account",):            known["account"]  = inst.pk
             else:                              extra[k] = inst.pk
-        base = dict(session=self.session, period=period, key_figure=kf, **known)
-        fact = PlanningFact.objects.filter(**base, extra_dimensions_json=extra).first()
+        if self._dim_keys is None:
+            self._dim_keys = {dk.key.lower(): dk for dk in DimensionKey.objects.all()}
+        dim_keys = self._dim_keys
+        missing = [k for k in extra if k.lower() not in dim_keys]
+        if missing:
+            raise ValueError(f"Unknown dimension key(s): {', '.join(missing)}")
+        pairs = [(dim_keys[k.lower()], pk) for k, pk in extra.items()]
+        signature = dimension_signature((dk.id, pk) for dk, pk in pairs)
+        return (known["org_unit"], known["service"], known["account"], signature), pairs
+
+    def _get_record(self, kf_code: str, dims: dict, create: bool):
+        periods, kfs = dimension_index(Period), dimension_index(KeyFigure)
+        period = periods.instance(periods.pk_for_code(self.period))
+        kf     = kfs.instance(kfs.pk_for_code(kf_code))
+        (org, svc, acct, signature), pairs = self._target_cell(kf_code, dims)
+        base = dict(
+            session=self.session, period=period, key_figure=kf,
+            org_unit_id=org, service_id=svc, account_id=acct,
+        )
+        fact = PlanningFact.objects.filter(**base, dim_signature=signature).first()
         if fact:
             return fact
         if not create:
             # Return a synthetic, unsaved object for preview
-            return PlanningFact(**base, extra_dimensions_json=extra, value=Decimal("0"))
-        return PlanningFact.objects.create(
+            return PlanningFact(**base, dim_signature=signature, value=Decimal("0"))
+        fact = PlanningFact.objects.create(
             request=self.session.requests.order_by('-created_at').first() or
                     DataRequest.objects.create(session=self.session, description="Formula write"),
+            layout_year=self.session.layout_year,
             version=self.session.layout_year.version,
             year=self.session.layout_year.year,
             uom=None, ref_uom=None,
-            extra_dimensions_json=extra, **base
-        )
\ No newline at end of file
+            dim_signature=signature, **base
+        )
+        PlanningFactExtra.objects.bulk_create([
+            PlanningFactExtra(fact=fact, key=dk, content_type_id=dk.content_type_id, object_id=pk,
+                              year_id=fact.year_id, version_id=fact.version_id)
+            for dk, pk in pairs
+        ])
+        return fact
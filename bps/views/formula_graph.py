@@ -0,0 +1,197 @@
+# formula_graph.py
+"""
+Key-figure dependency graph of a layout's formulas, and incremental recalc.
+
+Each node is a Formula of the layout, or the `formula` of a computed
+PlanningKeyFigure. Nodes read the key figures referenced in their source
+expression and write their target key figure; an edge A -> B means B reads
+what A writes. `recalculate()` runs only the nodes downstream of changed
+(session, period, key figure) cells, in topological order, each on the
+affected session/period slice.
+"""
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from bps.models.models import Formula, KeyFigure, Period
+from bps.models.models_layout import PlanningKeyFigure, PlanningLayoutDimension
+from bps.models.models_workflow import PlanningSession
+from bps.utils.dimension_registry import dimension_index
+from .formula_compiler import FormulaError, compile_formula, formula_version, has_target
+
+log = logging.getLogger(__name__)
+
+
+class FormulaNode:
+    def __init__(self, formula: Formula, key, dimensions=None):
+        self.formula = formula
+        self.key = key
+        self.dimensions = dimensions        # loop cts of unsaved (computed) formulas
+        self.compiled = compile_formula(formula, key=key)
+        c = self.compiled
+        self.reads: Optional[Set[str]] = None if c.reads_any_kf else set(c.read_kfs)
+        self.writes = c.target.kf
+        self.uses_periods = c.uses_periods
+
+    def __repr__(self):
+        return f"<FormulaNode {self.formula.name}>"
+
+    def reads_any(self, kfs: Optional[Set[str]]) -> bool:
+        return kfs is None or self.reads is None or bool(self.reads & kfs)
+
+
+class FormulaGraph:
+    def __init__(self, layout):
+        self.nodes: List[FormulaNode] = []
+        for f in Formula.objects.filter(layout=layout).order_by("name", "pk"):
+            self._add(f, f.pk)
+
+        row_cts = [d.content_type for d in PlanningLayoutDimension.objects.filter(
+            layout=layout, is_row=True).select_related("content_type")]
+        computed = (PlanningKeyFigure.objects.filter(layout=layout, is_computed=True)
+                    .exclude(formula="").select_related("key_figure"))
+        for pkf in computed:
+            expr = pkf.formula.strip()
+            if not has_target(expr):
+                dims = ",".join(f"{ct.model}=$LOOP" for ct in row_cts)
+                expr = f"[{dims}]?.[{pkf.key_figure.code}] = {expr}"
+            f = Formula(layout=layout, name=f"{pkf.key_figure.code} (computed)",
+                        expression=expr, loop_mode=Formula.LoopMode.DATA)
+            self._add(f, ("kf", pkf.pk), dimensions=row_cts)
+
+        self.order = self._toposort()
+
+    def _add(self, formula, key, dimensions=None):
+        try:
+            self.nodes.append(FormulaNode(formula, key, dimensions))
+        except (FormulaError, LookupError) as exc:
+            log.warning("formula %s left out of the dependency graph: %s", formula.name, exc)
+
+    def edges(self):
+        """(writer, reader) pairs; a node reading its own target is not an edge."""
+        for a in self.nodes:
+            for b in self.nodes:
+                if a is not b and b.reads_any({a.writes}):
+                    yield a, b
+
+    def _toposort(self) -> List[FormulaNode]:
+        indeg = {n: 0 for n in self.nodes}
+        succ = defaultdict(list)
+        for a, b in self.edges():
+            succ[a].append(b)
+            indeg[b] += 1
+        ready = [n for n in self.nodes if not indeg[n]]
+        order = []
+        while ready:
+            n = ready.pop(0)
+            order.append(n)
+            for m in succ[n]:
+                indeg[m] -= 1
+                if not indeg[m]:
+                    ready.append(m)
+        if len(order) != len(self.nodes):
+            stuck = ", ".join(n.formula.name for n in self.nodes if indeg[n])
+            raise FormulaError(f"Formula dependency cycle among: {stuck}")
+        return order
+
+    def downstream(self, kfs: Optional[Set[str]]) -> List[FormulaNode]:
+        """Nodes affected by changes to `kfs` (None = anything), in run order."""
+        dirty = set(kfs) if kfs is not None else None
+        out = []
+        for n in self.order:
+            if n.reads_any(dirty):
+                out.append(n)
+                if dirty is not None:
+                    dirty.add(n.writes)
+        return out
+
+
+_lock = threading.Lock()
+_graphs: Dict[int, Tuple[int, FormulaGraph]] = {}
+
+
+def formula_graph(layout) -> FormulaGraph:
+    """Cached FormulaGraph of `layout`, rebuilt after any formula/constant edit."""
+    version = formula_version()
+    hit = _graphs.get(layout.pk)
+    if hit is None or hit[0] != version:
+        with _lock:
+            hit = _graphs.get(layout.pk)
+            if hit is None or hit[0] != version:
+                hit = (version, FormulaGraph(layout))
+                _graphs[layout.pk] = hit
+    return hit[1]
+
+
+def recalculate(layout_year, changes: Iterable[Tuple[int, Optional[int], Optional[int]]]) -> int:
+    """
+    Re-run the formulas downstream of `changes`: (session_id, period_id, key_figure_id)
+    triples where a None period / key figure means all of them. Returns the number
+    of formula runs.
+    """
+    from .formula_executor import FormulaExecutor
+
+    graph = formula_graph(layout_year.layout)
+    if not graph.nodes:
+        return 0
+    periods = dimension_index(Period)
+    kfs = dimension_index(KeyFigure)
+    all_periods = list(Period.objects.order_by("order").values_list("code", flat=True))
+
+    # session -> period code -> changed kf codes (None = all)
+    touched: Dict[int, Dict[str, Optional[Set[str]]]] = defaultdict(dict)
+    for sid, per_id, kf_id in changes:
+        codes = all_periods if per_id is None else [periods.code(per_id)]
+        for code in filter(None, codes):
+            have = touched[sid].get(code, set())
+            if kf_id is None or have is None:
+                touched[sid][code] = None
+            else:
+                touched[sid][code] = have | {kfs.code(kf_id)}
+
+    rank = {code: i for i, code in enumerate(all_periods + [FormulaExecutor.ALL_PERIODS])}
+    sessions = PlanningSession.objects.select_related("scenario__layout_year").in_bulk(touched)
+    runs = 0
+    for sid in sorted(touched):
+        if sid not in sessions:
+            continue
+        per_kfs = touched[sid]
+        affected = defaultdict(set)    # node -> periods
+        for code, changed in per_kfs.items():
+            for node in graph.downstream(changed):
+                # period functions see every period: one vectorized run covers them all
+                if node.uses_periods:
+                    affected[node] = {FormulaExecutor.ALL_PERIODS}
+                else:
+                    affected[node].add(code)
+        for node in graph.order:
+            for code in sorted(affected.get(node, ()), key=rank.get):
+                FormulaExecutor(node.formula, sessions[sid], code, dimensions=node.dimensions,
+                                compiled=node.compiled).execute()
+                runs += 1
+    return runs
+
+
+def auto_recalculate(layout_year, changes, errors: Optional[List[str]] = None) -> int:
+    """
+    recalculate() after grid edits / function runs, when BPS_FORMULA_AUTO_RECALC
+    is on. Runs in a savepoint: a failing formula rolls back the recalc only,
+    never the edit that triggered it; its message is appended to `errors`.
+    """
+    if not getattr(settings, "BPS_FORMULA_AUTO_RECALC", False):
+        return 0
+    try:
+        with transaction.atomic():
+            return recalculate(layout_year, changes)
+    except Exception as exc:
+        if isinstance(exc, FormulaError):
+            log.warning("formula recalculation skipped for layout-year %s: %s", layout_year.pk, exc)
+        else:
+            log.exception("formula recalculation failed for layout-year %s", layout_year.pk)
+        if errors is not None:
+            errors.append(f"{type(exc).__name__}: {exc}")
+        return 0
@@ -0,0 +1,148 @@
+# formula_periods.py
+"""
+Period vectors for formula time-series functions.
+
+A PeriodVector holds one Decimal per period (in Period.order) for a single
+cell. Arithmetic and comparisons work element-wise and broadcast plain
+scalars, so an expression evaluated over vectors computes all periods of a
+dimension tuple in one pass. Plain Python rather than NumPy: values stay
+Decimal (no float rounding in planning amounts) and the project does not
+depend on NumPy.
+"""
+import operator
+from decimal import Decimal
+from typing import Iterable
+
+ZERO = Decimal("0")
+
+
+class PeriodVector:
+    __slots__ = ("values",)
+
+    def __init__(self, values: Iterable):
+        self.values = tuple(values)
+
+    def __repr__(self):
+        return f"PeriodVector({list(self.values)})"
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __eq__(self, other):
+        return self._zip(other, operator.eq)
+
+    def __bool__(self):
+        raise TypeError("a period vector has no single truth value; use IF()")
+
+    __hash__ = None
+
+    def _zip(self, other, op):
+        if isinstance(other, PeriodVector):
+            return PeriodVector(op(a, b) for a, b in zip(self.values, other.values))
+        return PeriodVector(op(a, other) for a in self.values)
+
+    def _rzip(self, other, op):
+        return PeriodVector(op(other, a) for a in self.values)
+
+    def __add__(self, o):      return self._zip(o, operator.add)
+    def __radd__(self, o):     return self._rzip(o, operator.add)
+    def __sub__(self, o):      return self._zip(o, operator.sub)
+    def __rsub__(self, o):     return self._rzip(o, operator.sub)
+    def __mul__(self, o):      return self._zip(o, operator.mul)
+    def __rmul__(self, o):     return self._rzip(o, operator.mul)
+    def __truediv__(self, o):  return self._zip(o, operator.truediv)
+    def __rtruediv__(self, o): return self._rzip(o, operator.truediv)
+    def __pow__(self, o):      return self._zip(o, operator.pow)
+    def __rpow__(self, o):     return self._rzip(o, operator.pow)
+    def __ne__(self, o):       return self._zip(o, operator.ne)
+    def __lt__(self, o):       return self._zip(o, operator.lt)
+    def __le__(self, o):       return self._zip(o, operator.le)
+    def __gt__(self, o):       return self._zip(o, operator.gt)
+    def __ge__(self, o):       return self._zip(o, operator.ge)
+    def __neg__(self):         return PeriodVector(-a for a in self.values)
+
+    def map(self, fn):
+        return PeriodVector(fn(a) for a in self.values)
+
+
+# ---- element-wise logic (scalars pass through) ---------------------------
+def _lift(fn):
+    def lifted(*args):
+        vecs = [a for a in args if isinstance(a, PeriodVector)]
+        if not vecs:
+            return fn(*args)
+        n = len(vecs[0])
+        cols = [a.values if isinstance(a, PeriodVector) else (a,) * n for a in args]
+        return PeriodVector(fn(*row) for row in zip(*cols))
+    return lifted
+
+
+vnot = _lift(lambda a: not a)
+vand = _lift(lambda a, b: bool(a) and bool(b))
+vor = _lift(lambda a, b: bool(a) or bool(b))
+where = _lift(lambda cond, a, b: a if cond else b)
+
+
+def is_vector(v) -> bool:
+    return isinstance(v, PeriodVector)
+
+
+# ---- time-series functions ----------------------------------------------
+def shift(vec: PeriodVector, offset) -> PeriodVector:
+    """Value `offset` periods away (SHIFT(x, -1) = previous period); zero past the edges."""
+    n, k = len(vec), int(offset)
+    return PeriodVector(vec[i + k] if 0 <= i + k < n else ZERO for i in range(n))
+
+
+def cumsum(vec: PeriodVector) -> PeriodVector:
+    """Running total from the first period (year to date)."""
+    out, total = [], ZERO
+    for v in vec:
+        total += v
+        out.append(total)
+    return PeriodVector(out)
+
+
+def rolling_avg(vec: PeriodVector, window) -> PeriodVector:
+    """Trailing average over up to `window` periods ending at each period."""
+    w = int(window)
+    if w < 1:
+        raise ValueError("ROLLING_AVG window must be at least 1")
+    out, total = [], ZERO
+    for i, v in enumerate(vec):
+        total += v
+        if i >= w:
+            total -= vec[i - w]
+        out.append(total / min(i + 1, w))
+    return PeriodVector(out)
+
+
+def period_spread(total, weights: PeriodVector = None, n: int = 12) -> PeriodVector:
+    """
+    Spread `total` over the periods: evenly, or in proportion to `weights`
+    (evenly again when the weights sum to zero). A vector total is summed first.
+    """
+    if isinstance(total, PeriodVector):
+        total = sum(total.values, ZERO)
+    if weights is not None:
+        n = len(weights)
+        base = sum(weights.values, ZERO)
+        if base:
+            return PeriodVector(total * w / base for w in weights)
+    return PeriodVector(total / n for _ in range(n))
+
+
+# name -> (function, index of the vector argument or None)
+PERIOD_FUNCTIONS = {
+    "SHIFT": (shift, 0),
+    "CUMSUM": (cumsum, 0),
+    "YTD": (cumsum, 0),
+    "ROLLING_AVG": (rolling_avg, 0),
+    "PERIOD_SPREAD": (period_spread, 1),
+}
@@ -0,0 +1,197 @@
+# formula_preview.py
+"""
+In-memory old -> new diff of a formula preview run.
+
+A preview evaluates the formula on a FactSlice and keeps the resulting
+changes here instead of writing a FormulaRun and per-cell FormulaRunEntry
+rows. The diff is summarized (counts, totals, top-N changes) and paged /
+sorted for the UI, parked under a token between requests as a file in
+default_storage (MEDIA_ROOT), so every web worker process finds it, and only
+`commit()` writes: the previewed values plus one FormulaRun and one bulk
+insert of its entries. Commit refuses when the session's facts changed
+since the preview (FactChangeStamp), so stale values are never written.
+"""
+import math
+import pickle
+import re
+import secrets
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from bps.models.models import Formula
+from bps.models.models_dimension import Account, OrgUnit, Service
+from bps.models.models_view import session_stamp
+from bps.models.models_workflow import PlanningSession
+from bps.utils.dimension_registry import dimension_index
+from .formula_compiler import FormulaError
+
+PREVIEW_DIR = "bps/previews"
+TOKEN = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+# sort name -> key over a change dict
+SORTS = {
+    "delta": lambda c: c["delta"],
+    "abs_delta": lambda c: abs(c["delta"]),
+    "old": lambda c: c["old"],
+    "new": lambda c: c["new"],
+    "cell": lambda c: (c["period"], c["org_unit"] or "", c["service"] or "", c["account"] or ""),
+}
+
+
+def _timeout():
+    return getattr(settings, "BPS_FORMULA_PREVIEW_TIMEOUT", 900)
+
+
+def _path(token: str) -> Optional[str]:
+    return f"{PREVIEW_DIR}/{token}.pickle" if token and TOKEN.fullmatch(token) else None
+
+
+def _expired(name: str) -> bool:
+    cutoff = timezone.now() - timedelta(seconds=_timeout())
+    return default_storage.get_modified_time(name) < cutoff
+
+
+def purge_expired() -> int:
+    """Delete preview files older than BPS_FORMULA_PREVIEW_TIMEOUT."""
+    try:
+        _dirs, files = default_storage.listdir(PREVIEW_DIR)
+    except FileNotFoundError:
+        return 0
+    dropped = 0
+    for filename in files:
+        name = f"{PREVIEW_DIR}/{filename}"
+        try:
+            if _expired(name):
+                default_storage.delete(name)
+                dropped += 1
+        except FileNotFoundError:
+            pass    # dropped by another process
+    return dropped
+
+
+class FormulaDiff:
+    """Changes a preview run would write; one dict per target cell."""
+
+    def __init__(self, formula_id: int, session_id: int, period: str,
+                 changes: List[Dict[str, Any]], stamp=None):
+        self.formula_id = formula_id
+        self.session_id = session_id
+        self.period = period
+        self.changes = changes
+        self.stamp = stamp
+        self.token = None
+
+    @classmethod
+    def from_pending(cls, executor, stamp=None) -> "FormulaDiff":
+        """Build from a preview executor's evaluated slice cells."""
+        orgs, svcs = dimension_index(OrgUnit), dimension_index(Service)
+        accts = dimension_index(Account)
+        changes = []
+        for (period, (org, svc, acct, signature)), (row, old, _pairs, new) in executor._pending.items():
+            changes.append({
+                "period": period,
+                "record": row["id"],
+                "org_unit": orgs.label(org) if org else None,
+                "service": svcs.label(svc) if svc else None,
+                "account": accts.label(acct) if acct else None,
+                "cell": [org, svc, acct, signature],
+                "extras": dict(row["extras"]),
+                "old": old,
+                "new": new,
+                "delta": new - old,
+            })
+        return cls(executor.formula.pk, executor.session.pk, executor.period, changes, stamp)
+
+    # ---- reading -------------------------------------------------------------
+    def __len__(self):
+        return len(self.changes)
+
+    def __iter__(self):
+        return iter(self.changes)
+
+    def count(self) -> int:
+        return len(self.changes)
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        zero = Decimal("0")
+        changed = [c for c in self.changes if c["delta"]]
+        return {
+            "cells": len(self.changes),
+            "changed": len(changed),
+            "unchanged": len(self.changes) - len(changed),
+            "new_cells": sum(1 for c in self.changes if c["record"] is None),
+            "total_old": sum((c["old"] for c in self.changes), zero),
+            "total_new": sum((c["new"] for c in self.changes), zero),
+            "total_delta": sum((c["delta"] for c in self.changes), zero),
+            "top": [self._public(c) for c in
+                    sorted(changed, key=SORTS["abs_delta"], reverse=True)[:max(top, 0)]],
+        }
+
+    def page(self, number: int = 1, size: int = 50, sort: str = "-abs_delta",
+             changed_only: bool = False) -> Dict[str, Any]:
+        """One page of changes; `sort` is a SORTS name, '-' prefix for descending."""
+        name = sort.lstrip("-")
+        if name not in SORTS:
+            raise ValueError(f"sort must be one of {', '.join(SORTS)} (optionally prefixed with '-')")
+        rows = [c for c in self.changes if c["delta"]] if changed_only else self.changes
+        rows = sorted(rows, key=SORTS[name], reverse=sort.startswith("-"))
+        size = max(1, min(int(size), 1000))
+        pages = max(1, math.ceil(len(rows) / size))
+        number = max(1, min(int(number), pages))
+        start = (number - 1) * size
+        return {
+            "page": number, "pages": pages, "size": size, "count": len(rows), "sort": sort,
+            "results": [self._public(c) for c in rows[start:start + size]],
+        }
+
+    @staticmethod
+    def _public(c):
+        return {k: v for k, v in c.items() if k != "cell"}
+
+    # ---- parking between requests ---------------------------------------------
+    def save(self) -> str:
+        purge_expired()
+        self.token = self.token or secrets.token_urlsafe(16)
+        name = _path(self.token)
+        default_storage.delete(name)
+        default_storage.save(name, ContentFile(pickle.dumps(self)))
+        return self.token
+
+    @classmethod
+    def load(cls, token: str) -> Optional["FormulaDiff"]:
+        name = _path(token)
+        try:
+            if name is None or _expired(name):
+                return None
+            with default_storage.open(name, "rb") as fh:
+                return pickle.load(fh)
+        except FileNotFoundError:
+            return None
+
+    def discard(self):
+        if self.token:
+            default_storage.delete(_path(self.token))
+
+    # ---- commit -----------------------------------------------------------------
+    def commit(self, user=None):
+        """
+        Write the previewed values and their audit entries (one FormulaRun, one
+        bulk insert). Raises FormulaError if the session changed since the preview.
+        """
+        from .formula_executor import FormulaExecutor
+
+        if session_stamp(self.session_id) != self.stamp:
+            raise FormulaError("Facts changed since this preview was taken; preview again")
+        formula = Formula.objects.get(pk=self.formula_id)
+        session = PlanningSession.objects.select_related(
+            "org_unit", "scenario__layout_year").get(pk=self.session_id)
+        executor = FormulaExecutor(formula, session, self.period)
+        run = executor.apply_changes(self.changes, user=user)
+        self.discard()
+        return run
@@ -0,0 +1,102 @@
+# formula_profile.py
+"""
+Per-run instrumentation of FormulaExecutor.
+
+FormulaProfiler measures one run: wall time, loop combinations, SQL query
+count and time (through a connection execute wrapper, so DEBUG is not
+needed), fact rows read and written, inclusive time per compiled
+sub-expression (function calls and cell references), and optionally a
+cProfile dump. `save()` stores the figures on the run's FormulaRun, where
+FormulaRunAdmin lists them.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import time
+from typing import Dict, List
+
+from django.db import connection
+
+SLOWEST = 10
+
+
+class FormulaProfiler:
+    def __init__(self, cprofile: bool = False):
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.timings: Dict[str, List] = {}   # expression -> [calls, seconds]
+        self.combinations = 0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.wall_seconds = None
+        self._wrapper = None
+
+    def _execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_count += 1
+            self.query_seconds += time.perf_counter() - started
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._wrapper = connection.execute_wrapper(self._execute)
+        self._wrapper.__enter__()
+        if self.cprofile:
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.cprofile:
+            self.cprofile.disable()
+        self._wrapper.__exit__(*exc)
+        self.wall_seconds = time.perf_counter() - self._started
+        return False
+
+    def slowest(self, n: int = SLOWEST):
+        rows = sorted(self.timings.items(), key=lambda kv: kv[1][1], reverse=True)[:n]
+        return [{"expr": expr, "calls": calls, "seconds": round(secs, 6)}
+                for expr, (calls, secs) in rows]
+
+    def stats(self):
+        """Plain dict of the measured figures."""
+        return {
+            "wall_seconds": round(self.wall_seconds or 0, 6),
+            "combinations": self.combinations,
+            "query_count": self.query_count,
+            "query_seconds": round(self.query_seconds, 6),
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "slow_expressions": self.slowest(),
+        }
+
+    def save(self, run):
+        """Store the figures (and cProfile dump) on `run`."""
+        for field, value in self.stats().items():
+            setattr(run, field, value)
+        run.profiled = True
+        fields = ["profiled", *self.stats()]
+        if self.cprofile:
+            self.cprofile.create_stats()
+            run.profile_data = marshal.dumps(self.cprofile.stats)
+            fields.append("profile_data")
+        run.save(update_fields=fields)
+
+
+def profile_report(data: bytes, limit: int = 25, sort: str = "cumulative") -> str:
+    """Text report of a stored cProfile dump (FormulaRun.profile_data)."""
+    stats = pstats.Stats(_Loaded(data), stream=io.StringIO())
+    stats.sort_stats(sort).print_stats(limit)
+    return stats.stream.getvalue()
+
+
+class _Loaded:
+    """pstats.Stats source from marshalled stats bytes."""
+    def __init__(self, data):
+        self.stats = marshal.loads(bytes(data))
+
+    def create_stats(self):
+        pass
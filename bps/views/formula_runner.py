@@ -0,0 +1,123 @@
+# formula_runner.py
+"""
+Run one formula across many planning sessions concurrently.
+
+Sessions are grouped into partitions (one per session, or one per OrgUnit)
+and each partition runs in a worker of a thread or process pool, with its
+own DB connection and one transaction per session, so a failing session
+rolls back alone. Results, timings and failures are collected per session.
+
+Threads suit request handlers (the per-combination work is mostly waiting
+on the database); the process backend forks workers and scales the
+in-memory evaluation with available cores.
+"""
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from bps.models.models import Formula
+from bps.models.models_workflow import PlanningSession
+
+BACKENDS = ("thread", "process")
+
+
+def _run_partition(formula_id: int, session_ids: List[int], period: str,
+                   preview: bool, mode: str, profile: bool = None) -> List[Dict[str, Any]]:
+    from .formula_executor import FormulaExecutor
+
+    out = []
+    try:
+        formula = Formula.objects.get(pk=formula_id)
+        sessions = PlanningSession.objects.select_related(
+            "org_unit", "scenario__layout_year").in_bulk(session_ids)
+        for sid in session_ids:
+            started = time.perf_counter()
+            result = {"session": sid, "org_unit": None, "run": None, "entries": 0, "error": None}
+            try:
+                session = sessions[sid]
+                result["org_unit"] = session.org_unit.code
+                with transaction.atomic():
+                    executor = FormulaExecutor(formula, session, period, preview=preview, mode=mode,
+                                               profile=profile)
+                    result["entries"] = executor.execute().count()
+                    result["run"] = executor.run.pk if executor.run else None
+            except Exception as exc:
+                result["error"] = f"{type(exc).__name__}: {exc}"
+            result["seconds"] = round(time.perf_counter() - started, 3)
+            out.append(result)
+    finally:
+        # worker threads/processes must not leak their connection
+        connection.close()
+    return out
+
+
+def _partitions(sessions, by: str) -> List[List[int]]:
+    if by == "session":
+        return [[s.pk] for s in sessions]
+    groups = defaultdict(list)
+    for s in sessions:
+        groups[s.org_unit_id].append(s.pk)
+    return list(groups.values())
+
+
+def run_formula_parallel(formula: Formula, sessions: Iterable[PlanningSession], period: str, *,
+                         workers: int = None, backend: str = "thread", by: str = "session",
+                         preview: bool = False, mode: str = "slice",
+                         profile: bool = None, on_progress=None) -> Dict[str, Any]:
+    """
+    Execute `formula` for every session in `sessions` (partitioned `by`
+    "session" or "org_unit") on `workers` concurrent workers.
+    `on_progress(done, total)` is called per finished partition; returning
+    False cancels the partitions not started yet.
+    Returns {"sessions": [per-session results], "ok", "failed", "entries", "seconds"}.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    if by not in ("session", "org_unit"):
+        raise ValueError("by must be 'session' or 'org_unit'")
+    parts = _partitions(list(sessions), by)
+    workers = workers or getattr(settings, "BPS_FORMULA_WORKERS", None) or os.cpu_count() or 1
+    workers = max(1, min(workers, len(parts) or 1))
+
+    started = time.perf_counter()
+    if backend == "process":
+        # forked children must open their own connections
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bps-formula")
+
+    results: List[Dict[str, Any]] = []
+    with pool:
+        futures = {
+            pool.submit(_run_partition, formula.pk, part, period, preview, mode, profile): part
+            for part in parts
+        }
+        for done, fut in enumerate(as_completed(futures), 1):
+            if on_progress and on_progress(done, len(futures)) is False:
+                for pending in futures:
+                    pending.cancel()
+                on_progress = None
+            try:
+                results.extend(fut.result())
+            except Exception as exc:     # worker died (e.g. killed process)
+                results.extend({"session": sid, "org_unit": None, "run": None, "entries": 0,
+                                "error": f"{type(exc).__name__}: {exc}", "seconds": None}
+                               for sid in futures[fut])
+
+    results.sort(key=lambda r: r["session"])
+    failed = sum(1 for r in results if r["error"])
+    return {
+        "sessions": results,
+        "ok": len(results) - failed,
+        "failed": failed,
+        "entries": sum(r["entries"] for r in results),
+        "workers": workers,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
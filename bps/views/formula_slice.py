@@ -0,0 +1,113 @@
+# formula_slice.py
+"""
+In-memory image of the facts a formula run reads and writes.
+
+FactSlice loads one session's facts for the key figures / periods a compiled
+formula touches in a single query (extras aggregated in SQL), answers cell
+reads from hash indexes built on first use, and collects target writes so
+the executor can flush them with a few bulk statements.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional
+
+from bps.models.models import PlanningFact
+from bps.models.models_extras import extras_map_subquery
+
+# ref dimension name -> slice row column
+FACT_COLUMNS = {
+    "orgunit": "org_unit", "org_unit": "org_unit",
+    "service": "service", "account": "account",
+    "year": "year", "version": "version",
+}
+
+_AGGREGATES = {
+    "SUM": lambda vals: sum(vals, Decimal("0")),
+    "AVG": lambda vals: sum(vals, Decimal("0")) / len(vals) if vals else None,
+    "MIN": lambda vals: min(vals) if vals else None,
+    "MAX": lambda vals: max(vals) if vals else None,
+}
+
+
+class FactSlice:
+    def __init__(self, session, kf_codes: Optional[Iterable[str]], period_codes: Optional[Iterable[str]]):
+        """`kf_codes` / `period_codes` of None load every key figure / period."""
+        ly = session.scenario.layout_year
+        qs = PlanningFact.objects.filter(
+            session=session, year_id=ly.year_id, version_id=ly.version_id,
+            period__isnull=False,
+        )
+        if kf_codes is not None:
+            qs = qs.filter(key_figure__code__in=set(kf_codes))
+        if period_codes is not None:
+            qs = qs.filter(period__code__in=set(period_codes))
+        qs = qs.annotate(extras_map=extras_map_subquery()).order_by("pk").values(
+            "id", "period__code", "key_figure__code", "org_unit_id", "service_id",
+            "account_id", "year_id", "version_id", "dim_signature", "value", "extras_map",
+        )
+
+        self.buckets = defaultdict(list)   # (period, kf) -> [row]
+        self.cells = {}                    # (period, kf, org, svc, acct, signature) -> row
+        self._indexes = {}                 # (period, kf, dims) -> {values: [row]}
+        for f in qs.iterator(chunk_size=2000):
+            self._add(f["period__code"], f["key_figure__code"], {
+                "id": f["id"],
+                "org_unit": f["org_unit_id"],
+                "service": f["service_id"],
+                "account": f["account_id"],
+                "year": f["year_id"],
+                "version": f["version_id"],
+                "signature": f["dim_signature"],
+                "value": f["value"],
+                "extras": {k: int(v) for k, v in (f["extras_map"] or {}).items()},
+            })
+
+    def _add(self, period, kf, row):
+        self.buckets[(period, kf)].append(row)
+        self.cells[(period, kf, row["org_unit"], row["service"], row["account"], row["signature"])] = row
+
+    @staticmethod
+    def _column(row, dim):
+        col = FACT_COLUMNS.get(dim)
+        return row[col] if col else row["extras"].get(dim)
+
+    def matches(self, period: str, kf: str, fkwargs: Dict[str, Any]):
+        """Rows of (period, kf) whose dims equal the bound ref dims, in pk order."""
+        dims = tuple(sorted(fkwargs))
+        key = (period, kf, dims)
+        index = self._indexes.get(key)
+        if index is None:
+            index = defaultdict(list)
+            for row in self.buckets.get((period, kf), ()):
+                index[tuple(self._column(row, d) for d in dims)].append(row)
+            self._indexes[key] = index
+        return index.get(tuple(getattr(fkwargs[d], "pk", fkwargs[d]) for d in dims), ())
+
+    def value(self, period: str, kf: str, fkwargs: Dict[str, Any]) -> Decimal:
+        rows = self.matches(period, kf, fkwargs)
+        return rows[0]["value"] if rows else Decimal("0")
+
+    def aggregate(self, fn: str, period: str, kf: str, fkwargs: Dict[str, Any]) -> Decimal:
+        total = _AGGREGATES[fn]([r["value"] for r in self.matches(period, kf, fkwargs)])
+        return Decimal(str(total or 0))
+
+    def combinations(self, kf_codes, period: Optional[str], dims):
+        """Distinct non-null `dims` tuples over rows of `period` (and `kf_codes`); None = all."""
+        out = set()
+        for (per, kf), rows in self.buckets.items():
+            if (period is not None and per != period) or (kf_codes is not None and kf not in kf_codes):
+                continue
+            for row in rows:
+                values = tuple(self._column(row, d) for d in dims)
+                if None not in values:
+                    out.add(values)
+        return out
+
+    def cell(self, period, kf, org, svc, acct, signature):
+        return self.cells.get((period, kf, org, svc, acct, signature))
+
+    def insert(self, period, kf, row):
+        """Add a not-yet-saved cell so later combos read it."""
+        self._add(period, kf, row)
+        for key in [k for k in self._indexes if k[:2] == (period, kf)]:
+            del self._indexes[key]
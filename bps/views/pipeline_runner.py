@@ -0,0 +1,141 @@
+# pipeline_runner.py
+"""
+Run a scenario's planning functions across all of its sessions.
+
+The pipeline is the scenario's ScenarioFunction rows in `order`, cut into
+groups: consecutive functions of the same PlanningStage form one group. A
+group whose stage `can_run_in_parallel` runs all of its function x session
+steps at once; any other group runs its functions one after another, each
+across all sessions concurrently. Groups run strictly in order, and a group
+with failed steps stops the pipeline unless `continue_on_error`.
+
+Each step runs in a thread-pool worker with its own DB connection and its
+own transaction, retried up to `retries` times with a growing pause, so a
+deadlock or a failing session rolls back alone. Per-step results, attempts
+and timings are collected in one ScenarioPipelineRun.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bps.models.models import PlanningFunction
+from bps.models.models_workflow import (
+    PlanningScenario, PlanningSession, PlanningStage, ScenarioFunction, ScenarioPipelineRun,
+)
+
+BACKOFF = 0.5   # seconds; attempt n waits n * BACKOFF before retrying
+
+
+def pipeline_groups(scenario: PlanningScenario) -> List[Tuple[Optional[PlanningStage], List[ScenarioFunction]]]:
+    """The scenario's functions in order, grouped by consecutive stage."""
+    rows = (ScenarioFunction.objects.filter(scenario=scenario)
+            .select_related("function", "stage").order_by("order", "pk"))
+    return [(stage, list(items)) for stage, items in groupby(rows, key=lambda sf: sf.stage)]
+
+
+def _json_result(result):
+    return result if isinstance(result, (int, float, str, type(None))) else str(result)
+
+
+def _run_step(function_id: int, session_id: int, retries: int, backoff: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    step = {"result": None, "error": None, "attempts": 0}
+    try:
+        func = PlanningFunction.objects.get(pk=function_id)
+        session = PlanningSession.objects.select_related(
+            "org_unit", "scenario__layout_year").get(pk=session_id)
+        while True:
+            step["attempts"] += 1
+            try:
+                with transaction.atomic():
+                    step["result"] = _json_result(func.execute(session))
+                step["error"] = None
+                break
+            except Exception as exc:
+                step["error"] = f"{type(exc).__name__}: {exc}"
+                if step["attempts"] > retries:
+                    break
+                time.sleep(backoff * step["attempts"])
+    except Exception as exc:
+        step["error"] = f"{type(exc).__name__}: {exc}"
+    finally:
+        # pool threads must not leak their connection
+        connection.close()
+    step["seconds"] = round(time.perf_counter() - started, 3)
+    return step
+
+
+def run_pipeline(scenario: PlanningScenario, *, sessions=None, workers: int = None,
+                 retries: int = None, backoff: float = BACKOFF, user=None,
+                 continue_on_error: bool = False, on_progress=None) -> ScenarioPipelineRun:
+    """
+    Execute the scenario's function pipeline for `sessions` (default: all of
+    the scenario's sessions) on `workers` threads. `on_progress(done, total)`
+    is called after each wave of steps; returning False skips the rest.
+    Returns the saved ScenarioPipelineRun with one entry per step in `steps`.
+    """
+    if sessions is None:
+        sessions = scenario.sessions.all()
+    sessions = list(sessions.select_related("org_unit") if hasattr(sessions, "select_related") else sessions)
+    sessions.sort(key=lambda s: s.pk)
+    groups = pipeline_groups(scenario)
+    if retries is None:
+        retries = getattr(settings, "BPS_PIPELINE_RETRIES", 1)
+    workers = workers or getattr(settings, "BPS_PIPELINE_WORKERS", None) or os.cpu_count() or 1
+    workers = max(1, min(workers, len(sessions) * max((len(fns) for _, fns in groups), default=1) or 1))
+
+    run = ScenarioPipelineRun.objects.create(
+        scenario=scenario, started_by=user, workers=workers, retries=retries)
+    started = time.perf_counter()
+    steps: List[Dict[str, Any]] = []
+    stop = False
+    total = len(sessions) * sum(len(functions) for _, functions in groups)
+
+    def describe(sf, session):
+        return {
+            "order": sf.order, "function": sf.function.name,
+            "function_type": sf.function.function_type,
+            "stage": sf.stage.code if sf.stage else None,
+            "session": session.pk, "org_unit": session.org_unit.code,
+        }
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bps-pipeline") as pool:
+        for stage, functions in groups:
+            # waves of steps that may run together
+            if stage is not None and stage.can_run_in_parallel:
+                waves = [functions]
+            else:
+                waves = [[sf] for sf in functions]
+            for wave in waves:
+                tasks = [(sf, s) for sf in wave for s in sessions]
+                if stop:
+                    steps.extend({**describe(sf, s), "skipped": True} for sf, s in tasks)
+                    continue
+                futures = [pool.submit(_run_step, sf.function_id, s.pk, retries, backoff) for sf, s in tasks]
+                for (sf, s), fut in zip(tasks, futures):
+                    steps.append({**describe(sf, s), **fut.result()})
+                if not continue_on_error and any(st.get("error") for st in steps):
+                    stop = True
+                if on_progress and on_progress(len(steps), total) is False:
+                    stop = True
+
+    run.steps = steps
+    run.steps_failed = sum(1 for st in steps if st.get("error"))
+    run.steps_skipped = sum(1 for st in steps if st.get("skipped"))
+    run.steps_ok = len(steps) - run.steps_failed - run.steps_skipped
+    if not run.steps_failed and not run.steps_skipped:
+        run.status = ScenarioPipelineRun.Status.SUCCEEDED
+    elif run.steps_ok:
+        run.status = ScenarioPipelineRun.Status.PARTIAL
+    else:
+        run.status = ScenarioPipelineRun.Status.FAILED
+    run.seconds = round(time.perf_counter() - started, 3)
+    run.finished_at = timezone.now()
+    run.save()
+    return run
@@ -3,7 +3,7 @@ from uuid import UUID
 import json
 from django.core.paginator import Paginator
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from django.contrib import messages
@@ -28,7 +28,7 @@ from .forms import (
     SubFormulaForm, FormulaForm, FactForm,
     PlanningFunctionForm, ReferenceDataForm
 )
-from .formula_executor import FormulaExecutor
+from ..models.models_extras import extras_map_subquery, dimension_label_maps
 
 
 # ── Dashboard & Basic Pages ────────────────────────────────────────────────
@@ -249,10 +249,13 @@ class PlanningSessionDetailView(FormMixin, DetailView):
             PlanningFact.objects.filter(request=dr)
             if dr else PlanningFact.objects.none()
         )
-        facts_qs = facts_qs.select_related(
-            "org_unit", "service", "account",
-            "period", "key_figure", "uom", "ref_uom"
-        ).order_by("period__order", "key_figure__code", "service__name")
+        facts_qs = facts_qs.order_by(
+            "period__order", "key_figure__code", "service__name"
+        ).annotate(extras_map=extras_map_subquery()).values(
+            "org_unit__name", "service__name", "account__code", "account__name",
+            "period__code", "key_figure__code", "value", "uom__code",
+            "ref_value", "ref_uom__code", "extras_map",
+        )
 
         # paging params
         try:
@@ -270,95 +273,52 @@ class PlanningSessionDetailView(FormMixin, DetailView):
         page_obj = paginator.get_page(page_num)
 
         # ---------- NEW: enrich current page with all dimensions ----------
-        # Current page items (already select_related)
+        # Current page rows: values() dicts, extras already aggregated in SQL
         page_facts = list(page_obj.object_list)
 
-        # Discover which extra-dimension keys appear on this page
-        extra_keys = set()
+        # Discover which extra-dimension keys (and ids) appear on this page
+        extra_ids = {}
         for f in page_facts:
-            extra_keys.update((f.extra_dimensions_json or {}).keys())
+            for key, obj_id in (f["extras_map"] or {}).items():
+                extra_ids.setdefault(key, set()).add(obj_id)
 
-        # Build header labels and resolve target models
+        # Build header labels from the dimension's model
         extra_headers = []
-        extra_models = {}
-        for key in sorted(extra_keys):
+        for key in sorted(extra_ids):
             try:
-                ct = ContentType.objects.get(model=key)
-                Model = ct.model_class()
+                Model = ContentType.objects.get(model=key).model_class()
                 label = getattr(Model._meta, "verbose_name", key).title()
-                extra_models[key] = Model
             except ContentType.DoesNotExist:
                 label = key.replace("_", " ").title()
-                extra_models[key] = None
             extra_headers.append({"key": key, "label": label})
 
-        # Build lookup maps for both PK and (if present) 'code' values
-        extra_maps = {}
-        for key, Model in extra_models.items():
-            values = {
-                (f.extra_dimensions_json or {}).get(key)
-                for f in page_facts
-                if (f.extra_dimensions_json or {}).get(key) is not None
-            }
-            if not Model or not values:
-                extra_maps[key] = {}
-                continue
-
-            pk_vals   = [v for v in values if isinstance(v, int)]
-            code_vals = [v for v in values if isinstance(v, str)]
-
-            mapping = {}
-            if pk_vals:
-                for obj in Model.objects.filter(pk__in=pk_vals):
-                    mapping[obj.pk] = str(obj)
-            if code_vals and hasattr(Model, "code"):
-                for obj in Model.objects.filter(code__in=code_vals):
-                    mapping[getattr(obj, "code")] = str(obj)
-
-            extra_maps[key] = mapping
-
-
-        def display_period_code(fact):
-            """
-            Return a short display code for the fact's period.
-            Year-dependent rows have no period -> show 'YEAR'.
-            """
-            return fact.period.code if fact.period else "YEAR"
+        # id -> label maps, limited to the ids on this page
+        extra_maps = dimension_label_maps(set(extra_ids), extra_ids)
 
         # Build rows for the template, aligned to extra_headers
         facts_rows = []
         for f in page_facts:
-            ed = f.extra_dimensions_json or {}
-
-            # Prefer a useful identifier for account: code or name
-            acct = f.account
-            acct_disp = None
-            if acct is not None:
-                acct_disp = getattr(acct, "code", None) or getattr(acct, "name", None) or str(acct)
-
+            ed = f["extras_map"] or {}
             row = {
-                "org_unit":  f.org_unit.name,
-                "service":   f.service.name if f.service else None,
-                "account":   acct_disp,
-                # "period":    f.period.code,
-                "period":     display_period_code(f),
-                "key_figure": f.key_figure.code,
-                "key_figure": f.key_figure.code,
-                "value":     f.value,
-                "uom":       f.uom.code if f.uom else None,
-                "ref_value": f.ref_value,
-                "ref_uom":   f.ref_uom.code if f.ref_uom else None,
+                "org_unit":  f["org_unit__name"],
+                "service":   f["service__name"],
+                # Prefer a useful identifier for account: code or name
+                "account":   f["account__code"] or f["account__name"],
+                # Year-dependent rows have no period -> show 'YEAR'
+                "period":     f["period__code"] or "YEAR",
+                "key_figure": f["key_figure__code"],
+                "value":     f["value"],
+                "uom":       f["uom__code"],
+                "ref_value": f["ref_value"],
+                "ref_uom":   f["ref_uom__code"],
                 "extra_vals": [],
             }
 
             for hdr in extra_headers:
-                key = hdr["key"]
-                raw = ed.get(key)
-                if raw is None:
-                    row["extra_vals"].append(None)
-                else:
-                    disp = extra_maps.get(key, {}).get(raw, raw)
-                    row["extra_vals"].append(disp)
+                raw = ed.get(hdr["key"])
+                row["extra_vals"].append(
+                    None if raw is None else extra_maps.get(hdr["key"], {}).get(raw, raw)
+                )
 
             facts_rows.append(row)
         # -----------------------------------------------------------------
@@ -536,19 +496,37 @@ class FormulaListView(FormMixin, ListView):
         return self.form_invalid(form)
 
 
+def _job_queued(request, job, what, *args, **kwargs):
+    """
+    Answer a request that queued a background job: 202 + poll URL for JSON
+    clients, otherwise a message with the poll URL and a redirect.
+    """
+    from ..api.views_jobs import job_payload, job_url
+
+    if request.accepts("application/json") and not request.accepts("text/html"):
+        job.refresh_from_db()
+        response = JsonResponse(job_payload(job, request), status=202)
+        response["Location"] = job_url(job, request)
+        return response
+    messages.info(request, f"{what} queued as job #{job.pk}; progress: {job_url(job, request)}")
+    return redirect(*args, **kwargs)
+
+
 class FormulaRunView(View):
     def get(self, request, pk):
+        from ..utils.job_queue import enqueue
+
         formula = get_object_or_404(Formula, pk=pk)
         session = request.user.planningsession_set.filter(
             status=PlanningSession.Status.DRAFT
         ).first()
+        if session is None:
+            messages.error(request, "No draft planning session to run the formula on.")
+            return redirect('bps:formula_list')
         period = request.GET.get('period', '01')
-        entries = FormulaExecutor(formula, session, period, preview=False).execute()
-        messages.success(
-            request,
-            f"Executed {formula.name}, {entries.count()} entries updated."
-        )
-        return redirect('bps:formula_list')
+        job = enqueue("formula", {"formula": formula.pk, "session": session.pk, "period": period},
+                      user=request.user)
+        return _job_queued(request, job, f"Formula {formula.name}", 'bps:formula_list')
 
 
 # ── Planning Functions ──────────────────────────────────────────────────────
@@ -572,14 +550,23 @@ class PlanningFunctionListView(FormMixin, ListView):
 
 class RunPlanningFunctionView(View):
     def get(self, request, pk, session_id):
+        from ..utils.job_queue import enqueue
+
         func = get_object_or_404(PlanningFunction, pk=pk)
         session = get_object_or_404(PlanningSession, pk=session_id)
-        result = func.execute(session)
-        messages.success(
-            request,
-            f"{func.get_function_type_display()} executed, result: {result}"
-        )
-        return redirect('bps:session_detail', pk=session_id)
+        job = enqueue("function", {"function": func.pk, "session": session.pk}, user=request.user)
+        return _job_queued(request, job, func.get_function_type_display(),
+                           'bps:session_detail', pk=session_id)
+
+
+class RunScenarioPipelineView(View):
+    """Queue the scenario's planning functions across all of its sessions (bps_worker runs them)."""
+    def post(self, request, code):
+        from ..utils.job_queue import enqueue
+
+        scenario = get_object_or_404(PlanningScenario, code=code)
+        job = enqueue("pipeline", {"scenario": scenario.code}, user=request.user)
+        return _job_queued(request, job, f"Pipeline {scenario.code}", 'bps:scenario_dashboard', code=code)
 
 
 class CopyActualView(View):
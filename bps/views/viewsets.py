@@ -19,6 +19,8 @@ class PlanningFactViewSet(viewsets.ModelViewSet):
       * partial_update: PATCH /api/facts/{id}/
       * destroy:     DELETE /api/facts/{id}/
       * export:      GET    /api/facts/export/
+                     GET    /api/facts/export/?background=1[&layout_year=&session=&search=]
+                            queues the CSV as a job -> 202 + poll URL
     """
     queryset = PlanningFact.objects.select_related(
         'org_unit','service','period','key_figure'
@@ -37,6 +39,16 @@ class PlanningFactViewSet(viewsets.ModelViewSet):
         """
         Return a CSV dump of the current filter/queryset
         """
+        if request.query_params.get('background'):
+            from bps.api.views_jobs import job_payload, job_url
+            from bps.utils.job_queue import enqueue
+
+            params = {k: request.query_params[k] for k in ('layout_year', 'session', 'search')
+                      if request.query_params.get(k)}
+            job = enqueue('export', params, user=request.user if request.user.is_authenticated else None)
+            job.refresh_from_db()
+            return Response(job_payload(job, request), status=status.HTTP_202_ACCEPTED,
+                            headers={'Location': job_url(job, request)})
         qs = self.filter_queryset(self.get_queryset())
         resp = HttpResponse(content_type='text/csv')
         resp['Content-Disposition'] = 'attachment; filename="facts.csv"'
@@ -87,6 +87,45 @@ DATABASES = {
     }
 }
 
+# Cache (locmem by default; point CACHE_BACKEND/CACHE_LOCATION at file/redis to share between workers)
+CACHES = {
+    'default': {
+        'BACKEND': env('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env('CACHE_LOCATION', default='bps'),
+    }
+}
+
+# Grid/pivot response cache (bps/api/cache.py); timeout 0 disables it
+BPS_GRID_CACHE = env('BPS_GRID_CACHE', default='default')
+BPS_GRID_CACHE_TIMEOUT = env.int('BPS_GRID_CACHE_TIMEOUT', default=300)
+
+# In-process dimension registry (bps/utils/dimension_registry.py); max age in seconds, 0 = until invalidated
+BPS_DIMENSION_REGISTRY_TTL = env.int('BPS_DIMENSION_REGISTRY_TTL', default=300)
+
+# Re-run dependent formulas after grid edits / planning function runs (bps/views/formula_graph.py);
+# runs inside the saving request, in a savepoint, so failures are reported but never undo the edit
+BPS_FORMULA_AUTO_RECALC = env.bool('BPS_FORMULA_AUTO_RECALC', default=False)
+
+# Concurrent workers for multi-session formula runs (bps/views/formula_runner.py); 0 = CPU count
+BPS_FORMULA_WORKERS = env.int('BPS_FORMULA_WORKERS', default=0)
+
+# Record timings, query/row counts and slowest sub-expressions on every FormulaRun (bps/views/formula_profile.py)
+BPS_FORMULA_PROFILE = env.bool('BPS_FORMULA_PROFILE', default=False)
+
+# Seconds a formula preview diff stays available for paging / commit (bps/views/formula_preview.py);
+# previews are files under MEDIA_ROOT, which every web worker must share
+BPS_FORMULA_PREVIEW_TIMEOUT = env.int('BPS_FORMULA_PREVIEW_TIMEOUT', default=900)
+
+# Scenario function pipeline (bps/views/pipeline_runner.py): workers (0 = CPU count) and retries per step
+BPS_PIPELINE_WORKERS = env.int('BPS_PIPELINE_WORKERS', default=0)
+BPS_PIPELINE_RETRIES = env.int('BPS_PIPELINE_RETRIES', default=1)
+
+# Background jobs (bps/utils/job_queue.py, manage.py bps_worker); EAGER runs them inside the request
+BPS_JOBS_EAGER = env.bool('BPS_JOBS_EAGER', default=False)
+BPS_JOB_POLL_SECONDS = env.float('BPS_JOB_POLL_SECONDS', default=1.0)
+BPS_JOB_HEARTBEAT_SECONDS = env.int('BPS_JOB_HEARTBEAT_SECONDS', default=10)
+BPS_JOB_STALE_SECONDS = env.int('BPS_JOB_STALE_SECONDS', default=120)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -134,6 +173,8 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+# job outputs (e.g. CSV exports) go through default_storage
+MEDIA_ROOT = env('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
 # during development time
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "bpsproject", "static"),